@@ -0,0 +1,58 @@
+import argparse
+import json
+import sys
+
+# Compare two sets of benchmark results (see run.py), e.g. from before and after a change:
+#
+#   python -m benchmarks.compare before.json after.json --threshold 0.2
+#
+# prints the best time and peak memory of every benchmark that appears in both, and exits with status 1 if any got
+# slower by more than the threshold (a fraction; benchmarks that take less than --min-seconds are ignored, since their
+# timings are mostly noise)
+
+
+def load(filename):
+    with open(filename) as f:
+        results = json.load(f)
+    return results['metadata'], {(r['benchmark'], r['rows']): r for r in results['results']}
+
+
+def compare(before, after, threshold=0.2, min_seconds=0.001):
+    regressions = []
+    lines = ['{:<45} {:>10} {:>10} {:>10} {:>7} {:>12} {:>12}'.format(
+        'benchmark', 'rows', 'before', 'after', 'ratio', 'peak before', 'peak after')]
+    for key in sorted(set(before) & set(after)):
+        b, a = before[key], after[key]
+        ratio = a['best'] / b['best'] if b['best'] > 0 else float('inf')
+        regressed = ratio > 1 + threshold and max(a['best'], b['best']) >= min_seconds
+        if regressed:
+            regressions.append(key)
+        lines.append('{:<45} {:>10} {:>10.4f} {:>10.4f} {:>7.2f} {:>12} {:>12}{}'.format(
+            key[0], key[1], b['best'], a['best'], ratio, b['peak_bytes'], a['peak_bytes'],
+            '  REGRESSION' if regressed else ''))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two sets of daqual benchmark results')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='the slow-down, as a fraction, that counts as a regression (default 0.2)')
+    parser.add_argument('--min-seconds', type=float, default=0.001,
+                        help='ignore benchmarks faster than this in both sets (default 0.001)')
+    args = parser.parse_args(argv)
+
+    before_metadata, before = load(args.before)
+    after_metadata, after = load(args.after)
+    print('before: {} ({})'.format(before_metadata.get('commit'), before_metadata.get('created')))
+    print('after:  {} ({})'.format(after_metadata.get('commit'), after_metadata.get('created')))
+    lines, regressions = compare(before, after, args.threshold, args.min_seconds)
+    print('\n'.join(lines))
+    if regressions:
+        print('{} regressions'.format(len(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
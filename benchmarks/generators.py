@@ -0,0 +1,71 @@
+import string
+
+import numpy as np
+import pandas as pd
+
+
+# Synthetic data shaped like the examples in examples/daqual (accounts, balances, transactions and ISO currencies), at
+# any number of rows.  Data is generated with numpy from a fixed seed, so the same rows give the same data every time.
+#
+# Every account number, currency and transaction account is drawn from the corresponding master, so that the
+# referential checks pass; the benchmarks time the checks doing their full work rather than failing fast.
+
+
+# ISO-style currencies: three letter codes, numeric codes and minor units
+def iso_currencies(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(string.ascii_uppercase))
+    codes = pd.unique(pd.Series([''.join(c) for c in rng.choice(letters, size=(n * 2, 3))]))[:n]
+    return pd.DataFrame({
+        'ENTITY': ['ENTITY {}'.format(i) for i in range(len(codes))],
+        'Currency': ['Currency {}'.format(code) for code in codes],
+        'Alphabetic Code': codes,
+        'Numeric Code': rng.integers(1, 1000, size=len(codes)),
+        'Minor unit': rng.choice([0, 2, 3], size=len(codes), p=[0.1, 0.85, 0.05]),
+    })
+
+
+def account_numbers(n):
+    return pd.Series(np.arange(100, 100 + n).astype(str), dtype='str').radd('A-')
+
+
+def accounts(n, currencies, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'Account Number': account_numbers(n),
+                         'Currency': rng.choice(currencies['Alphabetic Code'].to_numpy(), size=n)})
+
+
+def balances(n, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    return pd.DataFrame({'account': account_numbers(n).iloc[rng.permutation(n)].reset_index(drop=True),
+                         'balance': np.round(rng.normal(1000, 500, size=n), 2)})
+
+
+def transactions(n, n_accounts, seed=0):
+    rng = np.random.default_rng(seed + 2)
+    dates = pd.date_range('2019-01-01', '2019-12-31').strftime('%d-%b-%Y').to_numpy()
+    return pd.DataFrame({
+        'date': rng.choice(dates, size=n),
+        'account': account_numbers(n_accounts).to_numpy()[rng.integers(0, n_accounts, size=n)],
+        'credit/debit': rng.choice(np.array(['C', 'D']), size=n),
+        'amount': np.round(rng.exponential(50, size=n), 2),
+    })
+
+
+dataset_names = ['iso-currencies.csv', 'accounts.csv', 'balances.csv', 'balances-previous.csv', 'transactions.csv']
+
+
+# a complete set of related objects, each of rows rows (other than the currencies): the accounts, their balances today
+# and on the previous business day (in a different order, and within 5% of today's), and transactions against them
+def dataset(rows, seed=0):
+    currencies = iso_currencies(seed=seed)
+    today = balances(rows, seed)
+    previous = today.sample(frac=1, random_state=seed + 3).reset_index(drop=True)
+    previous['balance'] = np.round(previous['balance'] * np.random.default_rng(seed + 4).uniform(0.95, 1.05, rows), 2)
+    return {
+        'iso-currencies.csv': currencies,
+        'accounts.csv': accounts(rows, currencies, seed),
+        'balances.csv': today,
+        'balances-previous.csv': previous,
+        'transactions.csv': transactions(rows, rows, seed),
+    }
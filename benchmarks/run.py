@@ -0,0 +1,188 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import daqual
+from daqual import daqual as dq
+from . import generators
+
+# Benchmarks for daqual: every score_* function is timed on synthetic data shaped like the examples (see
+# generators.py), and so is validate_objects end to end, at each of a number of row counts.  Each benchmark records the
+# best and median of several runs and the peak memory allocated during one further run (as seen by tracemalloc, which
+# sees Python and numpy allocations but not Arrow's), and the results are written as JSON so that they can be compared
+# between commits with compare.py:
+#
+#   python -m benchmarks.run --rows 1e4 1e5 1e6 --output before.json
+#   ... change things ...
+#   python -m benchmarks.run --rows 1e4 1e5 1e6 --output after.json
+#   python -m benchmarks.compare before.json after.json
+#
+# Data for 1e7 rows and more needs a machine with plenty of memory (tens of GB at 1e8 rows); --data-dir keeps the
+# generated files so that they need only be written once.
+
+logger = logging.getLogger(__name__)
+
+# the checks that are timed, as (benchmark name, object, scoring function, params); every score_* function has at
+# least one, and all of them together (with every object of the dataset) make up the validation list for the end to
+# end benchmarks
+account_master = {'column': 'account', 'master': 'accounts.csv', 'master_column': 'Account Number'}
+currency_master = {'column': 'Currency', 'master': 'iso-currencies.csv', 'master_column': 'Alphabetic Code'}
+checks = [
+    ('score_1', 'accounts.csv', dq.score_1, {}),
+    ('score_column_count', 'accounts.csv', dq.score_column_count, {'expected_columns': 2}),
+    ('score_column_names', 'accounts.csv', dq.score_column_names, {'columns': ['Account Number', 'Currency']}),
+    ('score_row_count', 'balances.csv', dq.score_row_count,
+     {'comparison': 'balances-previous.csv', 'expected_delta': '>='}),
+    ('score_no_blanks', 'transactions.csv', dq.score_no_blanks, {'column': 'account'}),
+    ('score_unique_column', 'accounts.csv', dq.score_unique_column, {'column': 'Account Number'}),
+    ('score_unique_column[error_bound]', 'accounts.csv', dq.score_unique_column,
+     {'column': 'Account Number', 'error_bound': 0.01}),
+    ('score_column_format', 'transactions.csv', dq.score_column_format, {'column': 'account', 'match': r'A-\d+$'}),
+    ('score_column_format[codes]', 'accounts.csv', dq.score_column_format,
+     {'column': 'Currency', 'match': '[A-Z]{3}$'}),
+    ('score_int', 'iso-currencies.csv', dq.score_int, {'column': 'Numeric Code'}),
+    ('score_float', 'transactions.csv', dq.score_float, {'column': 'amount'}),
+    ('score_number', 'balances.csv', dq.score_number, {'column': 'balance'}),
+    ('score_date', 'transactions.csv', dq.score_date, {'column': 'date'}),
+    ('score_column_valid_values', 'transactions.csv', dq.score_column_valid_values, account_master),
+    ('score_column_valid_values[currencies]', 'accounts.csv', dq.score_column_valid_values, currency_master),
+    ('score_column_valid_values[error_bound]', 'transactions.csv', dq.score_column_valid_values,
+     dict(account_master, error_bound=0.01)),
+    ('score_every_master_value_used', 'transactions.csv', dq.score_every_master_value_used, account_master),
+    ('score_comparison', 'balances.csv', dq.score_comparison,
+     {'column': 'balance', 'comparison': 'balances-previous.csv', 'comparator': 'between', 'factor': 0.1}),
+    ('score_comparison[keys]', 'balances.csv', dq.score_comparison,
+     {'column': 'balance', 'comparison': 'balances-previous.csv', 'comparator': 'between', 'factor': 0.1,
+      'keys': ['account']}),
+    ('score_comparison[groupby]', 'transactions.csv', dq.score_comparison,
+     {'column': 'amount', 'comparison': 'transactions.csv', 'comparator': '=',
+      'groupby': {'columns': ['account', 'credit/debit'], 'aggregation': 'sum'}}),
+]
+
+# the ways validate_objects is run end to end, as keyword arguments for it
+end_to_end = {
+    'validate_objects': lambda rows: {},
+    'validate_objects[chunksize]': lambda rows: {'chunksize': max(1000, rows // 10)},
+    'validate_objects[workers=4]': lambda rows: {'workers': 4},
+}
+
+
+# the score_* functions that no benchmark covers
+def uncovered_scoring_functions():
+    covered = {check[2].__name__ for check in checks}
+    return sorted(name for name, value in vars(dq).items()
+                  if name.startswith('score_') and callable(value) and name not in covered)
+
+
+# run fn repeat times, and once more under tracemalloc; returns the best and median times and the peak allocation
+def measure(fn, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'best': min(times), 'median': statistics.median(times), 'repeat': repeat, 'peak_bytes': peak}
+
+
+def write_dataset(folder, rows, seed):
+    folder = os.path.join(folder, str(rows))
+    os.makedirs(folder, exist_ok=True)
+    for name, df in generators.dataset(rows, seed).items():
+        filename = os.path.join(folder, name)
+        if not os.path.exists(filename):
+            df.to_csv(filename, index=False)
+    return folder + '/'
+
+
+def run(rows_list, repeat=3, only=None, data_dir=None, seed=0):
+    results = []
+    folder = data_dir if data_dir is not None else tempfile.mkdtemp(prefix='daqual-benchmarks-')
+    try:
+        for rows in rows_list:
+            root = write_dataset(folder, rows, seed)
+            provider = dict(daqual.Daqual.file_system_provider, file_system_provider_root=root)
+
+            # each scoring function on its own, with every object already in memory
+            d = daqual.Daqual(provider)
+            for object_key in generators.dataset_names:
+                df = pd.read_csv(root + object_key)
+                d.object_list[object_key] = {'dataframe': df, 'columns': df.columns.to_list(), 'fingerprint': None}
+            for name, object_key, scoring_function, p in checks:
+                if only is None or only in name:
+                    result = measure(lambda: scoring_function(d, object_key, p), repeat)
+                    results.append(dict(benchmark=name, rows=rows, **result))
+                    logger.info("{} at {} rows: {:.4f}s".format(name, rows, result['best']))
+
+            # validate_objects end to end, from files on disk, with a fresh (cold) instance each time
+            validation_list = [[object_key, dq.score_1, {}, 1, 0] for object_key in generators.dataset_names]
+            validation_list += [[object_key, scoring_function, p, 1, 0]
+                                for name, object_key, scoring_function, p in checks]
+            for name, kwargs in end_to_end.items():
+                if only is None or only in name:
+                    result = measure(lambda: daqual.Daqual(provider).validate_objects(validation_list, **kwargs(rows)),
+                                     repeat)
+                    results.append(dict(benchmark=name, rows=rows, **result))
+                    logger.info("{} at {} rows: {:.4f}s".format(name, rows, result['best']))
+    finally:
+        if data_dir is None:
+            shutil.rmtree(folder, ignore_errors=True)
+    return {'metadata': metadata(), 'results': results}
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'processors': os.cpu_count(),
+            'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the daqual scoring functions and validate_objects')
+    parser.add_argument('--rows', nargs='+', type=float, default=[1e4, 1e5, 1e6],
+                        help='the numbers of rows to benchmark at (default 1e4 1e5 1e6)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each benchmark (default 3)')
+    parser.add_argument('--only', help='only run the benchmarks whose names contain this')
+    parser.add_argument('--data-dir', help='where to keep the generated data between runs (default: a temp folder)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='the file to write the results to (default: standard output)')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('daqual').setLevel(logging.ERROR)
+    logging.basicConfig(format='%(message)s')
+    for name in uncovered_scoring_functions():
+        logger.warning("No benchmark for {}".format(name))
+
+    results = run([int(rows) for rows in args.rows], args.repeat, args.only, args.data_dir, args.seed)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
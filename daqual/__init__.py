@@ -1,4 +1,14 @@
 from .daqual import Daqual
-from .daqual2 import daqual2
+from .daqual2 import daqual2, RowFailureIndex
+from .cache import DataFrameCache, ColumnarCache
+from .tagging import S3Tagger
+from .s3 import S3Session
+from .summaries import SummaryStore
+from .profiles import ProfileStore
+from .instrumentation import Instrumentation, OpenTelemetryHook
 
 
+from .calendars import BusinessCalendar
+from .backfill import Backfill
+from .specs import CompiledSpec, compile_spec, load_spec
+from .results import SQLiteResultStore, ParquetResultStore
@@ -0,0 +1,80 @@
+import math
+
+import pandas as pd
+
+from .sketches import HyperLogLog, BloomFilter, CountMinSketch, hash_values
+
+
+# Approximate versions of the checks that otherwise hold every distinct value of a column in memory (uniqueness and
+# the referential checks against a master), for very large objects where a bounded error is an acceptable price for
+# fixed memory.  They are opt-in, per check, by giving the check an error_bound in its params, e.g.
+#
+#   ['transactions.csv', score_unique_column, {'column': 'id', 'error_bound': 0.01}, 1, 1]
+#
+#   score_unique_column            - fails if a count-min sketch shows a value repeated, or if a HyperLogLog
+#                                    estimate of the number of distinct values falls short of the number of
+#                                    (non-blank) values by more than three standard errors of the estimate; the
+#                                    error_bound sizes both sketches and is not an allowance for repeats, so a
+#                                    column with fewer repeats than the sketches can see may still pass
+#   score_column_valid_values      - the master values are held in a Bloom filter with a false positive rate of
+#   score_every_master_value_used    error_bound (likewise our column's values, for score_every_master_value_used),
+#                                    so a value that is missing is overlooked with probability at most error_bound;
+#                                    values reported as missing certainly are
+
+
+# the HyperLogLog precision whose standard error is no more than a third of the error bound (up to 2**18 registers)
+def hll_precision(error_bound):
+    return min(18, max(4, int(math.ceil(2 * math.log2(3 * 1.04 / error_bound)))))
+
+
+# a Bloom filter of the distinct values of a series, sized from a (quick, low precision) estimate of how many there are
+def bloom_filter_of(series, error_bound):
+    h = hash_values(series)
+    capacity = HyperLogLog().add_hashes(h[~series.isna().to_numpy()]).estimate() * 1.1 + 1
+    return BloomFilter(capacity, error_bound).add_hashes(h)
+
+
+# Approximate uniqueness of a column, which may be given a chunk at a time through add(); memory is fixed by the error
+# bound rather than growing with the number of distinct values.  Blanks are ignored.
+class ApproximateUniqueness:
+
+    def __init__(self, error_bound, n_repeated=10):
+        self.error_bound = error_bound
+        self.n_repeated = n_repeated
+        self.distinct = HyperLogLog(hll_precision(error_bound))
+        self.counts = CountMinSketch(epsilon=error_bound / 10)
+        self.repeated = {}      # up to n_repeated of the values seen most often, for reporting
+        self.rows = 0
+
+    def add(self, series):
+        values = series.dropna()
+        h = hash_values(values)
+        self.rows += len(values)
+        self.distinct.add_hashes(h)
+        self.counts.add_hashes(h)
+        frequent = values[self.counts.estimate_hashes(h) > 1 + self.noise()].drop_duplicates()
+        candidates = pd.concat([frequent, pd.Series(list(self.repeated), dtype=values.dtype)]).drop_duplicates()
+        estimates = pd.Series(self.counts.estimate(candidates), index=candidates.to_numpy())
+        self.repeated = estimates.sort_values(ascending=False, kind='stable').iloc[:self.n_repeated].to_dict()
+        return self
+
+    # the most a count may be over-estimated by (with high probability)
+    def noise(self):
+        return self.counts.total * self.error_bound / 10
+
+    # the estimated fraction of values that repeat an earlier value
+    def repeated_fraction(self):
+        if self.rows == 0:
+            return 0
+        return max(0, self.rows - self.distinct.estimate()) / self.rows
+
+    # False if any value is seen to repeat, or if there are significantly (three standard errors) fewer distinct
+    # values than rows
+    def unique(self):
+        if self.most_repeated():
+            return False
+        return self.rows - self.distinct.estimate() <= 3 * self.distinct.standard_error()
+
+    # the most repeated values, with their estimated counts, ignoring any whose estimate is within the sketch's error
+    def most_repeated(self):
+        return {value: int(count) for value, count in self.repeated.items() if count > 1 + self.noise()}
@@ -0,0 +1,215 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+
+from .cache import DataFrameCache
+from .calendars import compiled_calendar
+from .specs import CompiledSpec
+
+logger = logging.getLogger(__name__)
+
+
+# Validate a template validation list for every business date in a range, e.g.
+#
+#   backfill = Backfill(Daqual.file_system_provider, template, progress='backfill.jsonl')
+#   results = backfill.run('2019-01-01', '2019-03-31')
+#
+# The template is a validation list whose strings (object keys and parameter values, other than 'match' regexes) are
+# formatted with str.format() for each date, with the keys of date_values() below - e.g.
+# 'accounts-{business_date}.csv' and 'accounts-{previous_business_date}.csv' - or a compiled spec (see specs.py).
+# The business dates come from the calendar (Daqual.default_calendar unless one is given).
+#
+# Each date is validated by its own Daqual instance, on a pool of at most workers threads.  Neighbouring dates share
+# objects (one date's object is the next date's previous version), so retrieval goes through SharedObjects: each
+# version of an object is retrieved once, with every column any date needs from it, and kept only until the last date
+# that uses it has finished.  All the instances also share one DataFrameCache (or the cache in daqual_kwargs), and
+# any result_sink in daqual_kwargs, which records each date's results against that business date, and each object's
+# against its template, e.g. 'accounts-{business_date}.csv'.
+#
+# With a progress file, each date's result is appended to it as a line of JSON as soon as the date is finished, and a
+# later run with the same file skips the dates already there, so an interrupted backfill picks up where it stopped.
+# Dates whose objects could not be retrieved are recorded too, but are tried again by a later run.
+#
+# run() returns {iso business date: {'quality': average quality, 'objects': {object key: quality}}}, with objects None
+# for a date whose objects could not be retrieved; a date whose validation raised is logged and left out.
+class Backfill:
+
+    def __init__(self, provider, template, custom_calendar=None, workers=4, progress=None, validate_kwargs=None,
+                 **daqual_kwargs):
+        self.provider = provider
+        self.template = template
+        self.calendar = compiled_calendar(custom_calendar if custom_calendar is not None else default_calendar())
+        self.workers = workers
+        self.progress = progress
+        self.validate_kwargs = validate_kwargs or {}
+        self.daqual_kwargs = daqual_kwargs
+        self.daqual_kwargs.setdefault('cache', DataFrameCache())
+        self.lock = threading.Lock()
+
+    def dates(self, start, end):
+        return self.calendar.date_range(start, end)
+
+    # the values available to the template for a business date
+    def date_values(self, business_date):
+        previous = self.calendar.calc_date(business_date, False, -1)
+        following = self.calendar.calc_date(business_date, False, 1)
+        return {
+            'business_date': abbreviated(business_date),
+            'previous_business_date': abbreviated(previous),
+            'next_business_date': abbreviated(following),
+            'iso_business_date': business_date,
+            'iso_previous_business_date': previous,
+            'iso_next_business_date': following,
+        }
+
+    def validation_list(self, business_date):
+        if isinstance(self.template, CompiledSpec):
+            return self.template.validation_list(self.date_values(business_date))
+        return render(self.template, self.date_values(business_date))
+
+    # {object key: the template it was rendered from} for a business date, so that results are recorded (and their
+    # history queried) by template rather than by each date's key
+    def object_names(self, business_date):
+        if isinstance(self.template, CompiledSpec):
+            return self.template.object_names(self.date_values(business_date))
+        return {render_value(item[0], self.date_values(business_date)): item[0] for item in self.template}
+
+    def completed(self):
+        results = {}
+        if self.progress is not None and os.path.exists(self.progress):
+            with open(self.progress) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        results[record['business_date']] = {'quality': record['quality'],
+                                                            'objects': record['objects']}
+        return results
+
+    def record(self, business_date, result):
+        if self.progress is not None:
+            with self.lock, open(self.progress, 'a') as f:
+                f.write(json.dumps(dict(business_date=business_date, **result)) + '\n')
+
+    def run(self, start, end):
+        from .daqual import Daqual
+
+        results = {d: r for d, r in self.completed().items() if r['objects'] is not None}
+        dates = [d for d in self.dates(start, end) if d not in results]
+        if not dates:
+            return {d: results[d] for d in self.dates(start, end) if d in results}
+        validation_lists = {d: self.validation_list(d) for d in dates}
+        shared = SharedObjects(self.provider, validation_lists.values(),
+                               Daqual(self.provider, projection=self.daqual_kwargs.get('projection', True)))
+        provider = dict(self.provider, retrieve=shared.retrieve)
+        logger.info("Backfilling {} business dates from {} to {}{}".format(
+            len(dates), dates[0], dates[-1], ', {} already done'.format(len(results)) if results else ''))
+
+        def validate(business_date):
+            validation_list = validation_lists[business_date]
+            try:
+                result = Daqual(provider, **self.daqual_kwargs).validate_objects(
+                    validation_list, business_date=business_date, object_names=self.object_names(business_date),
+                    **self.validate_kwargs)
+            finally:
+                shared.release(validation_list)
+            if result == 0:
+                logger.error("Could not retrieve the objects for business date {}".format(business_date))
+                return {'quality': 0, 'objects': None}
+            return {'quality': float(result[0]), 'objects': {k: float(v['quality']) for k, v in result[1].items()}}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(dates)))) as executor:
+            futures = {executor.submit(validate, d): d for d in dates}
+            for future in concurrent.futures.as_completed(futures):
+                business_date = futures[future]
+                try:
+                    results[business_date] = future.result()
+                except Exception as e:
+                    logger.error("Backfill of business date {} failed: {}".format(business_date, repr(e)))
+                    continue
+                self.record(business_date, results[business_date])
+                logger.info("Backfilled business date {} - quality: {}".format(business_date,
+                                                                                 results[business_date]['quality']))
+        return {d: results[d] for d in self.dates(start, end) if d in results}
+
+
+# Retrieval shared between the Daqual instances of a backfill: each version of an object (by key and fingerprint) is
+# retrieved by the first instance to ask for it, with the union of the columns that every validation list needs from
+# it, while any other instance asking at the same time waits for that retrieval rather than starting its own.  A
+# retrieved object is held until every validation list that uses it has been released.
+class SharedObjects:
+
+    def __init__(self, provider, validation_lists, daqual):
+        self.retrieve_object = provider['retrieve']
+        self.users = collections.Counter()
+        self.columns = {}           # object key: the columns needed from it, or None for all of them
+        for validation_list in validation_lists:
+            needed = daqual.required_columns(validation_list) if daqual.projection else {}
+            for object_key in dict.fromkeys(item[0] for item in validation_list):
+                self.users[object_key] += 1
+                if object_key not in needed:
+                    self.columns[object_key] = None
+                elif self.columns.get(object_key, set()) is not None:
+                    self.columns[object_key] = self.columns.get(object_key, set()) | needed[object_key]
+        self.loads = {}             # (object key, fingerprint): a Future of the (score, dataframe) retrieved
+        self.lock = threading.Lock()
+
+    # a provider 'retrieve' function, called by (and given) each Daqual instance
+    def retrieve(self, d, object_key, usecols=None):
+        key = (object_key, d.fingerprints.get(object_key))
+        with self.lock:
+            future = self.loads.get(key)
+            owner = future is None
+            if owner:
+                future = self.loads[key] = concurrent.futures.Future()
+        if owner:
+            try:
+                future.set_result(self.retrieve_all(d, object_key, usecols))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            logger.info("Sharing the retrieval of object {}".format(object_key))
+        score, df = future.result()
+        if score == 1 and usecols is not None:
+            df = df[list(usecols)]
+        return (score, df)
+
+    def retrieve_all(self, d, object_key, usecols):
+        needed = self.columns.get(object_key)
+        if usecols is None or needed is None:
+            return self.retrieve_object(d, object_key)
+        header = d.headers.get(object_key) or list(usecols)
+        return self.retrieve_object(d, object_key, usecols=[c for c in header if c in needed or c in usecols])
+
+    def release(self, validation_list):
+        with self.lock:
+            for object_key in dict.fromkeys(item[0] for item in validation_list):
+                self.users[object_key] -= 1
+                if self.users[object_key] <= 0:
+                    for key in [k for k in self.loads if k[0] == object_key]:
+                        del self.loads[key]
+
+
+# a validation list with the strings in each item formatted with values, as Daqual's examples' custom_transformer,
+# but leaving the template untouched
+def render(validation_list, values):
+    return [[render_value(value, values) for value in item] for item in validation_list]
+
+
+def render_value(value, values):
+    if isinstance(value, str):
+        return value.format(**values)
+    if isinstance(value, dict):
+        return {k: v.format(**values) if k != 'match' and isinstance(v, str) else v for k, v in value.items()}
+    return value
+
+
+def abbreviated(iso_date):
+    return iso_date.replace('-', '')
+
+
+def default_calendar():
+    from .daqual import Daqual
+    return Daqual.default_calendar
@@ -0,0 +1,212 @@
+import collections
+import hashlib
+import logging
+import os
+import pathlib
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+# A cache of parsed DataFrames, keyed by object key plus a fingerprint of the object's content (an S3 ETag, or a file's
+# size, modification time and inode, see the provider 'fingerprint' functions), so that an object which has not changed
+# is never retrieved or parsed twice.
+#
+# DataFrames are held in memory, least-recently-used first out, within a budget of max_bytes (as measured by
+# DataFrame.memory_usage).  If a folder is supplied the cache is also written through to disk there, as Arrow IPC
+# files, so that other Daqual instances and processes pointed at the same folder can share it; this requires pyarrow.
+#
+# A cache can be shared between Daqual instances and threads; cached DataFrames must be treated as read-only.
+class DataFrameCache:
+
+    def __init__(self, max_bytes=1024**3, folder=None):
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.entries = collections.OrderedDict()   # (object_key, fingerprint): (dataframe, size in bytes)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if folder is not None:
+            try:
+                import pyarrow
+            except ImportError:
+                raise ImportError("A DataFrameCache with a folder requires pyarrow (pip install pyarrow)")
+            pathlib.Path(folder).mkdir(parents=True, exist_ok=True)
+
+    def get(self, object_key, fingerprint):
+        key = (object_key, fingerprint)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+
+        df = self.read_from_disk(key)
+        with self.lock:
+            if df is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.add(key, df)
+        return df
+
+    def put(self, object_key, fingerprint, df):
+        key = (object_key, fingerprint)
+        with self.lock:
+            self.add(key, df)
+        self.write_to_disk(key, df)
+
+    # add to the in-memory LRU, evicting the least recently used DataFrames to stay within budget; callers hold the lock
+    def add(self, key, df):
+        if key in self.entries:
+            self.current_bytes -= self.entries.pop(key)[1]
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_bytes:
+            logger.info("Not caching {} in memory; {} bytes exceeds the cache budget".format(key[0], size))
+            return
+        while self.current_bytes + size > self.max_bytes:
+            evicted_key, (evicted_df, evicted_size) = self.entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+            logger.info("Evicted {} from the dataframe cache".format(evicted_key[0]))
+        self.entries[key] = (df, size)
+        self.current_bytes += size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    def disk_filename(self, key):
+        digest = hashlib.sha1('\0'.join(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest + '.arrow')
+
+    def read_from_disk(self, key):
+        if self.folder is None:
+            return None
+        import pyarrow.feather
+        try:
+            return pyarrow.feather.read_table(self.disk_filename(key)).to_pandas()
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable cache entry for {}: {}".format(key[0], e))
+            return None
+
+    # written to a temporary name and then renamed, so that concurrent readers never see a partial file
+    def write_to_disk(self, key, df):
+        if self.folder is None:
+            return
+        import pyarrow
+        import pyarrow.feather
+        filename = self.disk_filename(key)
+        temp_filename = '{}.{}.tmp'.format(filename, uuid.uuid4().hex)
+        try:
+            pyarrow.feather.write_feather(pyarrow.Table.from_pandas(df), temp_filename)
+        except Exception as e:      # e.g. columns of mixed types that arrow cannot represent
+            logger.warning("Could not write {} to the dataframe cache on disk: {}".format(key[0], e))
+            pathlib.Path(temp_filename).unlink(missing_ok=True)
+            return
+        os.replace(temp_filename, filename)
+
+
+# a cheap fingerprint of a local file, from its size, modification time and identity (device and inode) rather than its
+# content, so that fingerprinting a file doesn't mean reading it; a file rewritten in place gets a new modification time
+def file_signature(filename):
+    stat = os.stat(filename)
+    return '{}-{}-{}-{}'.format(stat.st_size, stat.st_mtime_ns, stat.st_dev, stat.st_ino)
+
+
+# An on-disk cache of parsed objects in a columnar format, keyed by the checksum (fingerprint) of the source object, so
+# that an object that has been parsed once is memory-mapped on later runs rather than parsed from CSV again.
+#
+# format is 'feather' (Arrow IPC, uncompressed so that it can be memory-mapped) or 'parquet'.  The folder is kept
+# within max_bytes by removing the least recently used files.  Requires pyarrow.
+#
+# Used beneath the provider's retrieve function when present in the provider definition as 'columnar_cache'.
+class ColumnarCache:
+
+    def __init__(self, folder, max_bytes=10 * 1024**3, format='feather'):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("ColumnarCache requires pyarrow (pip install pyarrow)")
+        if format not in ('feather', 'parquet'):
+            raise ValueError("Unsupported columnar cache format {}".format(format))
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.format = format
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        pathlib.Path(folder).mkdir(parents=True, exist_ok=True)
+
+    def filename(self, checksum):
+        return os.path.join(self.folder, '{}.{}'.format(checksum, 'arrow' if self.format == 'feather' else 'parquet'))
+
+    def get(self, checksum):
+        filename = self.filename(checksum)
+        try:
+            table = self.read_table(filename)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable columnar cache file {}: {}".format(filename, e))
+            with self.lock:
+                self.misses += 1
+            return None
+        os.utime(filename)      # mark as recently used
+        with self.lock:
+            self.hits += 1
+        return table.to_pandas()
+
+    def put(self, checksum, df):
+        import pyarrow
+        filename = self.filename(checksum)
+        temp_filename = '{}.{}.tmp'.format(filename, uuid.uuid4().hex)
+        try:
+            table = pyarrow.Table.from_pandas(df)
+            if self.format == 'feather':
+                import pyarrow.feather
+                pyarrow.feather.write_feather(table, temp_filename, compression='uncompressed')
+            else:
+                import pyarrow.parquet
+                pyarrow.parquet.write_table(table, temp_filename)
+        except Exception as e:      # e.g. columns of mixed types that arrow cannot represent
+            logger.warning("Could not write {} to the columnar cache: {}".format(checksum, e))
+            pathlib.Path(temp_filename).unlink(missing_ok=True)
+            return
+        os.replace(temp_filename, filename)
+        self.evict()
+
+    def read_table(self, filename):
+        if self.format == 'feather':
+            import pyarrow.feather
+            return pyarrow.feather.read_table(filename, memory_map=True)
+        import pyarrow.parquet
+        return pyarrow.parquet.read_table(filename, memory_map=True)
+
+    # remove the least recently used files until the folder is within max_bytes
+    def evict(self):
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.folder):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total = sum(f[1] for f in files)
+            for mtime, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                pathlib.Path(path).unlink(missing_ok=True)
+                total -= size
+                self.evictions += 1
+                logger.info("Evicted {} from the columnar cache".format(path))
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -0,0 +1,147 @@
+import threading
+from datetime import date
+
+import numpy as np
+
+
+# A custom calendar (a dict of 'schedule' and 'holidays', see Daqual.default_calendar) compiled for fast lookups.
+#
+# Holidays are held as a set of ordinals, and recurring holidays (given as 'MM-DD', and matched as Daqual.calc_date
+# always has, against month-day without leading zeros) as a set of month * 100 + day.  For every day between start
+# and end an index of the calendar's business days is precomputed - weekdays that are not holidays for the
+# 'workingdays' schedule, and days that are not holidays otherwise - so that the next or previous business day, and
+# offsets of any number of business days, are found by looking up positions in arrays rather than by stepping a day
+# at a time.  Dates outside start and end are still answered, by stepping.
+class BusinessCalendar:
+
+    def __init__(self, custom_calendar, start='1970-01-01', end='2100-12-31'):
+        self.schedule = custom_calendar['schedule']
+        self.step = 7 if self.schedule == 'weekly' else 1
+        holidays = custom_calendar['holidays']
+        self.holidays = {date.fromisoformat(h).toordinal() for h in holidays if len(h) == 10}
+        recurring = {h for h in holidays if len(h) == 5}
+        self.recurring = {month * 100 + day for month in range(1, 13) for day in range(1, 32)
+                          if '{}-{}'.format(month, day) in recurring}
+
+        self.first = date.fromisoformat(start).toordinal()
+        ordinals = np.arange(self.first, date.fromisoformat(end).toordinal() + 1)
+        days = (ordinals - date(1970, 1, 1).toordinal()).astype('datetime64[D]')
+        months = days.astype('datetime64[M]')
+        month_days = (months.astype(np.int64) % 12 + 1) * 100 + (days - months).astype(np.int64) + 1
+        business = ~np.isin(ordinals, list(self.holidays)) & ~np.isin(month_days, list(self.recurring))
+        if self.schedule == 'workingdays':
+            business &= (ordinals - 1) % 7 < 5      # date.fromordinal(1) was a Monday
+        cumulative = np.cumsum(business)
+        self.days = ordinals[business]                          # the business days, as ordinals
+        self.at_or_after = cumulative - business                # for each day, the index in days of the first
+        self.at_or_before = cumulative - 1                      # business day on or after it, or on or before it
+
+    # the position of an ordinal in the precomputed index, or None if it is outside it
+    def position(self, ordinal):
+        i = ordinal - self.first
+        return i if 0 <= i < len(self.at_or_after) else None
+
+    def is_business_day(self, d):
+        ordinal = as_ordinal(d)
+        return not (ordinal in self.holidays or
+                    (self.recurring and as_date(ordinal).month * 100 + as_date(ordinal).day in self.recurring) or
+                    (self.schedule == 'workingdays' and (ordinal - 1) % 7 > 4))
+
+    # the first business day on or after (direction 1) or on or before (direction -1) an ordinal
+    def roll(self, ordinal, direction):
+        i = self.position(ordinal)
+        if i is not None:
+            j = self.at_or_after[i] if direction > 0 else self.at_or_before[i]
+            if 0 <= j < len(self.days):
+                return int(self.days[j])
+        while not self.is_business_day(ordinal):
+            ordinal += direction
+        return ordinal
+
+    def next_business_date(self, d):
+        return as_date(self.roll(as_ordinal(d) + 1, 1))
+
+    def prev_business_date(self, d):
+        return as_date(self.roll(as_ordinal(d) - 1, -1))
+
+    # the business day n business days after (or, for negative n, before) d; if d is not a business day itself, the
+    # count starts from the business day before it (for n > 0) or after it (for n < 0)
+    def offset(self, d, n):
+        ordinal = self.roll(as_ordinal(d), -1 if n > 0 else 1)
+        i = self.position(ordinal)
+        if i is not None:
+            j = (self.at_or_before[i] if n > 0 else self.at_or_after[i]) + n
+            if 0 <= j < len(self.days):
+                return as_date(int(self.days[j]))
+        step = 1 if n > 0 else -1
+        for k in range(abs(n)):
+            ordinal = self.roll(ordinal + step, step)
+        return as_date(ordinal)
+
+    # exactly as Daqual.calc_date: move customdelta schedule steps (a day, or a week for the weekly schedule) from
+    # currentDate, and then, while that isn't a business day, keep moving customdelta days
+    def calc_date(self, currentDate, isoabbreviated=False, customdelta=1):
+        ordinal = date.fromisoformat(currentDate).toordinal() + self.step * customdelta
+        if customdelta in (1, -1):
+            ordinal = self.roll(ordinal, customdelta)
+        elif not self.is_business_day(ordinal):
+            if customdelta == 0:
+                raise ValueError("{} is not a business day, and a customdelta of 0 can't move from it".format(
+                    as_date(ordinal)))
+            while not self.is_business_day(ordinal):
+                ordinal += customdelta
+        return format_date(as_date(ordinal), isoabbreviated)
+
+    # the dates on which the schedule runs from start to end inclusive, as ISO strings (or abbreviated ISO strings,
+    # without hyphens): every business day for the daily and workingdays schedules, or every calc_date step from the
+    # first business day on or after start for the weekly schedule
+    def date_range(self, start, end, isoabbreviated=False):
+        first, last = as_ordinal(start), as_ordinal(end)
+        if self.step != 1:
+            dates = []
+            ordinal = self.roll(first, 1)
+            while ordinal <= last:
+                dates.append(format_date(as_date(ordinal), isoabbreviated))
+                ordinal = as_ordinal(self.calc_date(as_date(ordinal).isoformat(), False, 1))
+            return dates
+        if self.position(first) is None or self.position(last) is None:
+            dates = []
+            ordinal = self.roll(first, 1)
+            while ordinal <= last:
+                dates.append(format_date(as_date(ordinal), isoabbreviated))
+                ordinal = self.roll(ordinal + 1, 1)
+            return dates
+        days = self.days[self.at_or_after[self.position(first)]:self.at_or_before[self.position(last)] + 1]
+        dates = np.datetime_as_string((days - date(1970, 1, 1).toordinal()).astype('datetime64[D]'))
+        if isoabbreviated:
+            dates = np.char.replace(dates, '-', '')
+        return dates.tolist()
+
+
+def as_ordinal(d):
+    if isinstance(d, int):
+        return d
+    if isinstance(d, str):
+        return date.fromisoformat(d).toordinal()
+    return d.toordinal()
+
+
+def as_date(ordinal):
+    return date.fromordinal(ordinal)
+
+
+def format_date(d, isoabbreviated):
+    return d.isoformat().replace('-', '') if isoabbreviated else d.isoformat()
+
+
+# compiled calendars, by their schedule and holidays, so that each custom calendar is only compiled once
+compiled_calendars = {}
+compiled_calendars_lock = threading.Lock()
+
+def compiled_calendar(custom_calendar):
+    key = (custom_calendar['schedule'], tuple(custom_calendar['holidays']))
+    calendar = compiled_calendars.get(key)
+    if calendar is None:
+        with compiled_calendars_lock:
+            calendar = compiled_calendars.setdefault(key, BusinessCalendar(custom_calendar))
+    return calendar
@@ -0,0 +1,190 @@
+import re
+
+import pandas as pd
+
+from .approximate import ApproximateUniqueness, bloom_filter_of
+from .formats import count_format_matches
+from .numeric import invalid_numbers
+
+
+# Folds allow a scoring function to be evaluated over an object one chunk of rows at a time, for objects that are too
+# large to hold in memory (see Daqual.validate_objects with chunksize).  Each fold is created for one item of a
+# validation list, is given every chunk of the object in turn through update(), and then produces exactly the same
+# score as the in-memory scoring function would have from score().
+#
+# Chunks are read with the columns that folds look at as text, so that every chunk sees the values as they are in the
+# object whatever rows it happens to hold; left to itself, pandas infers the dtypes of each chunk separately, and would
+# e.g. read a code column as numbers in a chunk where every code happens to be digits.  Read in one go, pandas gives a
+# column that is entirely numbers, booleans or blanks another dtype, so ColumnKinds notes which columns those are, and
+# the folds whose scores depend on the dtype of the values (dtype_sensitive) are folded again with those columns
+# converted to it (see as_inferred).
+
+# the text that read_csv reads as booleans
+boolean_values = {'True': True, 'TRUE': True, 'true': True, 'False': False, 'FALSE': False, 'false': False}
+
+
+# Which of a set of columns, seen a chunk at a time as text, hold nothing but numbers, booleans or blanks, and the
+# dtype that pandas would have given them when reading the whole object:
+#   int64   - every value is a whole number
+#   float64 - every value is a number, and some aren't whole or are blank; or every value is blank
+#   bool    - every value is a boolean
+#   object  - every value is a boolean or blank (which pandas keeps as True, False and NaN)
+class ColumnKinds:
+
+    def __init__(self, columns):
+        self.numbers = dict.fromkeys(columns, True)     # column: every value so far is a number
+        self.whole = dict.fromkeys(columns, True)       # column: every value so far is a whole number
+        self.booleans = dict.fromkeys(columns, True)    # column: every value so far is a boolean
+        self.seen = dict.fromkeys(columns, False)       # column: any value has been seen that isn't blank
+        self.blanks = dict.fromkeys(columns, False)     # column: any value has been blank
+
+    def update(self, chunk):
+        for column in self.numbers:
+            if column not in chunk.columns:
+                continue
+            values = chunk[column]
+            present = values.dropna()
+            self.seen[column] = self.seen[column] or len(present) > 0
+            self.blanks[column] = self.blanks[column] or len(present) < len(values)
+            if self.booleans[column]:
+                self.booleans[column] = bool(present.isin(boolean_values.keys()).all())
+            if self.numbers[column]:
+                invalid = invalid_numbers(values, ('int', 'float'))
+                if invalid['float'].any():
+                    self.numbers[column] = False
+                elif invalid['int'].any() or len(present) < len(values):
+                    self.whole[column] = False
+
+    # {column: dtype} for the columns that pandas wouldn't have read as text
+    def inferred_dtypes(self):
+        dtypes = {}
+        for column in self.numbers:
+            if not self.seen[column]:
+                dtypes[column] = 'float64'
+            elif self.booleans[column]:
+                dtypes[column] = 'object' if self.blanks[column] else 'bool'
+            elif self.numbers[column]:
+                dtypes[column] = 'int64' if self.whole[column] else 'float64'
+        return dtypes
+
+
+# a column read as text converted to a dtype from ColumnKinds.inferred_dtypes
+def as_inferred(values, dtype):
+    if dtype in ('bool', 'object'):
+        return values.map(boolean_values).astype(dtype)
+    return pd.to_numeric(values).astype(dtype)
+
+
+class ScoreFold:
+
+    dtype_sensitive = False
+
+    def __init__(self, daqual, object_name, p):
+        self.daqual = daqual
+        self.object_name = object_name
+        self.p = p
+
+    def update(self, chunk):
+        raise NotImplementedError
+
+    def score(self):
+        raise NotImplementedError
+
+
+# score_no_blanks
+class NoBlanksFold(ScoreFold):
+
+    def __init__(self, daqual, object_name, p):
+        super().__init__(daqual, object_name, p)
+        self.blank = False
+
+    def update(self, chunk):
+        if not self.blank and self.p['column'] in chunk.columns:
+            self.blank = bool(chunk[self.p['column']].isna().any())
+
+    def score(self):
+        return 0 if self.blank else 1
+
+
+# score_column_format
+class ColumnFormatFold(ScoreFold):
+
+    dtype_sensitive = True
+
+    def __init__(self, daqual, object_name, p):
+        super().__init__(daqual, object_name, p)
+        self.pattern = re.compile(p['match'])
+        self.matches = 0
+        self.rows = 0
+
+    def update(self, chunk):
+        self.matches += count_format_matches(chunk[self.p['column']], self.pattern)
+        self.rows += len(chunk)
+
+    def score(self):
+        return self.matches / self.rows
+
+
+# score_unique_column; memory is bounded by the number of distinct values rather than the chunk size, or fixed by the
+# error bound if one is given
+class UniqueColumnFold(ScoreFold):
+
+    dtype_sensitive = True
+
+    def __init__(self, daqual, object_name, p):
+        super().__init__(daqual, object_name, p)
+        self.approximate = ApproximateUniqueness(p['error_bound']) if p.get('error_bound') is not None else None
+        self.values = set()
+        self.rows = 0
+
+    def update(self, chunk):
+        if self.approximate is not None:
+            self.approximate.add(chunk[self.p['column']])
+            return
+        values = chunk[self.p['column']].to_list()
+        self.values.update(values)
+        self.rows += len(values)
+
+    def score(self):
+        if self.approximate is not None:
+            return self.daqual.approximate_unique_score(self.object_name, self.p, self.approximate)
+        return 1 if len(self.values) == self.rows else 0
+
+
+# score_column_valid_values; the master object is held in memory
+class ColumnValidValuesFold(ScoreFold):
+
+    dtype_sensitive = True
+
+    def __init__(self, daqual, object_name, p):
+        super().__init__(daqual, object_name, p)
+        self.master = daqual.get_dataframe(p['master'])[p['master_column']]
+        self.master_filter = bloom_filter_of(self.master, p['error_bound']) if p.get('error_bound') is not None \
+            else None
+        self.invalid = pd.Series(dtype='int64')
+        self.rows = 0
+
+    def update(self, chunk):
+        s = chunk[self.p['column']]
+        valid = s.isin(self.master) if self.master_filter is None else self.master_filter.contains(s)
+        invalid = s[~valid].value_counts(dropna=False)
+        self.invalid = self.invalid.add(invalid, fill_value=0).astype('int64')
+        self.rows += len(s)
+
+    def score(self):
+        invalid = self.invalid.sort_values(ascending=False, kind='stable')
+        return self.daqual.valid_values_score(self.object_name, self.p, self.rows, invalid)
+
+
+# score_row_count; any comparison object is held in memory
+class RowCountFold(ScoreFold):
+
+    def __init__(self, daqual, object_name, p):
+        super().__init__(daqual, object_name, p)
+        self.rows = 0
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+
+    def score(self):
+        return self.daqual.row_count_score(self.rows, self.p)
@@ -1,14 +1,29 @@
 import pandas as pd
-import numpy as np
 import re
+import io
 import logging
-import boto3
 import botocore
 import shutil
 import pathlib
 import uuid
-from datetime import timedelta
-from datetime import date
+import concurrent.futures
+import hashlib
+import json
+import time
+from datetime import date, datetime, timezone
+from .cache import DataFrameCache, file_signature
+from .calendars import compiled_calendar
+from .formats import count_format_matches
+from .numeric import invalid_number_mask, sample_rows
+from .approximate import ApproximateUniqueness, bloom_filter_of
+from .instrumentation import null_instrumentation
+from .planner import ValidationPlan, deferred_logs, profile_fact_names, profile_facts
+from .profiles import profile_dataframe
+from .tagging import S3Tagger
+from .s3 import S3Session
+from .summaries import comparison_spec, summarisable, summarise
+from .chunked import ColumnKinds, as_inferred, NoBlanksFold, ColumnFormatFold, UniqueColumnFold, ColumnValidValuesFold, \
+    RowCountFold
 
 
 # TODO - sort out error-handling throughout
@@ -17,6 +32,19 @@ temp_folder = './temp/'
 
 logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
+logger.addFilter(deferred_logs)
+
+# the S3 connection layer and tagger used by the aws_provider
+s3_session = S3Session()
+s3_tagger = S3Tagger(session=s3_session)
+
+# a short, bounded, printable sample of a value_counts() Series for use in log messages
+def sample_values(counts, n=10):
+    sample = ', '.join('{}: {}'.format(k, v) for k, v in counts.head(n).items())
+    if len(counts) > n:
+        sample += ', ... ({} more)'.format(len(counts) - n)
+    return sample
+
 
 class Daqual:
 
@@ -42,10 +70,49 @@ class Daqual:
     # capabilities.  Example providers/provider-mappings are implemented at the end of the class definition to make
     # use of specific provider-functionality implemented as part of the base Daqal implementation (for S3 and local
     # filesystem providers)
-    def __init__(self, provider):
+    #
+    # max_concurrency bounds the number of objects that are retrieved at the same time, and retrieve_timeout (in
+    # seconds) is the longest we are prepared to wait for any single object, from when its retrieval starts; None
+    # waits indefinitely
+    #
+    # objects are normally parsed straight from the provider's stream; materialize=True additionally keeps a raw copy
+    # of every object in a temp folder (see get_file)
+    #
+    # parsed objects are kept in a DataFrameCache (see cache.py) between calls to validate_objects; supply a cache to
+    # share it between instances, to change its memory budget or to persist it on disk
+    #
+    # with projection=True only the columns that a validation list uses are loaded from each object
+    #
+    # summary_store, a summaries.SummaryStore, lets objects that are only needed as the previous version of another
+    # object in comparisons be answered from a summary recorded on an earlier run, rather than retrieved again
+    #
+    # instrumentation, an instrumentation.Instrumentation, records timings of each phase, object and check of
+    # validate_objects and passes them to its hooks; without one nothing is recorded
+    #
+    # profile_store, a profiles.ProfileStore, keeps a statistics profile of every object loaded; checks that can be
+    # answered from a profile (row counts, blanks, uniqueness and numbers) are then answered from the stored profile
+    # of an unchanged object rather than by retrieving it again
+    #
+    # result_sink, e.g. a results.SQLiteResultStore, is given the score, threshold and timing of every check and the
+    # quality and fingerprint of every object at the end of each call to validate_objects, so that the history of an
+    # object's quality can be queried (see results.py)
+    def __init__(self, provider, max_concurrency=8, retrieve_timeout=None, materialize=False, cache=None,
+                 projection=True, summary_store=None, profile_store=None, instrumentation=None, result_sink=None):
         self.object_list = {}
         self.provider=provider
         self.uuid = uuid.uuid4().hex
+        self.max_concurrency = max_concurrency
+        self.retrieve_timeout = retrieve_timeout
+        self.materialize = materialize
+        self.cache = cache if cache is not None else DataFrameCache()
+        self.fingerprints = {}
+        self.headers = {}
+        self.retrieval_failures = {}    # object_key: why it couldn't be retrieved, for the last validate_objects
+        self.projection = projection
+        self.summary_store = summary_store
+        self.profile_store = profile_store
+        self.instrumentation = instrumentation if instrumentation is not None else null_instrumentation
+        self.result_sink = result_sink
 
     def __del__(self):
         unique_temp_folder = temp_folder + self.uuid
@@ -53,37 +120,130 @@ class Daqual:
 
     # retrieve objects from the filesystem and return a pandas DataFrame
     # intended primarily for easy/local development
-    def retrieve_object_from_filesystem(self, objectkey):
-        bucket, file_objectkey = objectkey.split('/',1)
+    #
+    # the file is parsed in place through a memory map, unless this instance materializes raw files (see get_file)
+    #
+    # usecols, if given, restricts the columns that are parsed (see required_columns)
+    def retrieve_object_from_filesystem(self, objectkey, usecols=None):
+        if self.materialize:
+            filename = self.get_file(objectkey)
+        else:
+            filename = self.provider['file_system_provider_root'] + objectkey
+        df = pd.read_csv(filename, memory_map=True, usecols=usecols)
 
-        unique_temp_folder = temp_folder + self.uuid + '/'
-        pathlib.Path(unique_temp_folder+bucket).mkdir(parents=True, exist_ok=True)
-        tempfilename=unique_temp_folder + objectkey
+        logger.info("Retrieved and converted object {}".format(filename))
+        return (1,df)
 
+    # read a file from the filesystem as an iterator of dataframes of at most chunksize rows; dtype, if given, fixes
+    # the dtypes of columns (see score_in_chunks)
+    def retrieve_chunks_of_object_from_filesystem(self, objectkey, chunksize, usecols=None, dtype=None):
+        filename = self.provider['file_system_provider_root'] + objectkey
+        with pd.read_csv(filename, chunksize=chunksize, usecols=usecols, dtype=dtype) as reader:
+            yield from reader
+
+    # copy a file from the filesystem into this instance's temp folder, returning the name of the copy
+    def materialize_object_from_filesystem(self, objectkey):
+        tempfilename = self.temp_filename(objectkey)
         filename = self.provider['file_system_provider_root'] + objectkey
         shutil.copyfile(filename,tempfilename)
-        df = pd.read_csv(tempfilename)
+        return tempfilename
 
-        logger.info("Retrieved and converted object {}".format(filename))
-        return (1,df)
+
+    # just the column names of a file, read from its first line
+    def header_of_object_from_filesystem(self, objectkey):
+        filename = self.provider['file_system_provider_root'] + objectkey
+        return pd.read_csv(filename, nrows=0).columns.to_list()
+
+
+    # a fingerprint of a file (see cache.file_signature), used to key cached dataframes; the file itself isn't read
+    def fingerprint_object_from_filesystem(self, objectkey):
+        return file_signature(self.provider['file_system_provider_root'] + objectkey)
 
 
     # retrieve objects from S3 and return a pandas DataFrame
-    def retrieve_object_from_S3(self, objectkey):
+    #
+    # the object body is parsed as it streams from S3, unless this instance materializes raw files (see get_file)
+    #
+    # usecols, if given, restricts the columns that are parsed (see required_columns)
+    def retrieve_object_from_S3(self, objectkey, usecols=None):
+        if self.materialize:
+            tempfilename = self.get_file(objectkey)
+            if tempfilename is None:
+                return(0, None)
+            df = pd.read_csv(tempfilename, usecols=usecols)
+        else:
+            bucket, s3_objectkey = objectkey.split('/',1)
+            try:
+                body = self.s3().client.get_object(Bucket=bucket, Key=s3_objectkey)['Body']
+            except botocore.exceptions.ClientError as e:
+                logger.error("Could not retrieve object {}".format(objectkey))
+                return(0, None)
+            with body:
+                df = pd.read_csv(body, usecols=usecols)
+
+        logger.info("Retrieved and converted object {}".format(objectkey))
+        return (1,df)
 
+    # stream an object from S3 as an iterator of dataframes of at most chunksize rows; dtype as for the filesystem
+    def retrieve_chunks_of_object_from_S3(self, objectkey, chunksize, usecols=None, dtype=None):
         bucket, s3_objectkey = objectkey.split('/',1)
-        unique_temp_folder = temp_folder + self.uuid + '/'
-        pathlib.Path(unique_temp_folder+bucket).mkdir(parents=True, exist_ok=True)
-        tempfilename=unique_temp_folder + objectkey
+        body = self.s3().client.get_object(Bucket=bucket, Key=s3_objectkey)['Body']
+        with body, pd.read_csv(body, chunksize=chunksize, usecols=usecols, dtype=dtype) as reader:
+            yield from reader
+
+    # download an object from S3 into this instance's temp folder, returning the name of the downloaded file
+    def materialize_object_from_S3(self, objectkey):
+        bucket, s3_objectkey = objectkey.split('/',1)
+        tempfilename = self.temp_filename(objectkey)
         try:
-            boto3.resource('s3').Bucket(bucket).download_file(s3_objectkey, tempfilename)
+            session = self.s3()
+            session.client.download_file(bucket, s3_objectkey, tempfilename, Config=session.transfer_config)
         except botocore.exceptions.ClientError as e:
             logger.error("Could not retrieve object {}".format(objectkey))
-            return(0, None)
-        df = pd.read_csv(tempfilename)
+            return None
+        return tempfilename
 
-        logger.info("Retrieved and converted object {}".format(objectkey))
-        return (1,df)
+    # just the column names of an S3 object, from a ranged request for the first first_bytes of it (doubled until the
+    # range holds the whole of the first line), so that the body is only ever fetched once, for parsing.  None if it
+    # can't be found
+    def header_of_object_from_S3(self, objectkey, first_bytes=64 * 1024):
+        bucket, s3_objectkey = objectkey.split('/',1)
+        while True:
+            try:
+                body = self.s3().client.get_object(Bucket=bucket, Key=s3_objectkey,
+                                                   Range='bytes=0-{}'.format(first_bytes - 1))['Body']
+            except botocore.exceptions.ClientError as e:
+                return None
+            with body:
+                data = body.read()
+            end = data.rfind(b'\n')
+            if end >= 0 or len(data) < first_bytes:
+                return pd.read_csv(io.BytesIO(data[:end + 1] if end >= 0 else data), nrows=0).columns.to_list()
+            first_bytes *= 2
+
+    # the ETag of an S3 object, used to key cached dataframes; None (don't cache) if the object can't be found
+    def fingerprint_object_from_S3(self, objectkey):
+        bucket, s3_objectkey = objectkey.split('/',1)
+        try:
+            return self.s3().client.head_object(Bucket=bucket, Key=s3_objectkey)['ETag'].strip('"')
+        except botocore.exceptions.ClientError as e:
+            return None
+
+    # the keys of every object in S3 starting with prefix (given as bucket/prefix), as object keys
+    def list_objects_in_S3(self, prefix):
+        bucket, s3_prefix = prefix.split('/',1)
+        return [bucket + '/' + key for key in self.s3().list_keys(bucket, s3_prefix)]
+
+    # the provider's S3 connection layer (see s3.py)
+    def s3(self):
+        return self.provider.get('s3') or s3_session
+
+    # the name of the file in which a raw copy of an object is kept, creating its folder if needed
+    def temp_filename(self, objectkey):
+        unique_temp_folder = temp_folder + self.uuid + '/'
+        tempfilename = unique_temp_folder + objectkey
+        pathlib.Path(tempfilename).parent.mkdir(parents=True, exist_ok=True)
+        return tempfilename
 
     # TODO - need to consider if an object is quality-checked more than once, need to prevent its score being overwritten
     # consider whether to record the instance that did the tagging, and perhaps a fingerprint of the QC definition.
@@ -92,38 +252,421 @@ class Daqual:
     # Alternatively we could simply "error", or return a pre-existing QC value/tag, or provide optionality re: the
     # approach
 
-    # set object metadata in S3
+    # set object metadata in S3, through the aws_provider's tagger (see tagging.py)
     def update_object_tagging_S3(objectkey, tag, value):
-        bucket, s3_objectkey = objectkey.split('/', 1)
-        tags = boto3.client('s3').get_object_tagging(Bucket=bucket,Key=s3_objectkey)
-        t = tags['TagSet']
-        if len(t) >0:
-            for i in t:
-                if i['Key']==tag:
-                    i['Value']=str(value)
-        else:
-            t.append({'Key': tag, 'Value': str(value)})
-
-        ts = {'TagSet':t}
-        boto3.client('s3').put_object_tagging(Bucket=bucket, Key=s3_objectkey, Tagging=ts)
+        s3_tagger.tag(objectkey, tag, value)
 
     # set a quality score against the object
     def set_quality_score(self,objectkey, quality):
-        logger.info("Setting quality_score on {} to {}".format(objectkey,quality))
-        self.provider['tag'](objectkey,'quality_score', quality)
+        self.set_quality_scores({objectkey: quality})
+
+    # set quality scores against several objects, given as a dict of objectkey: quality; providers with a 'tagger'
+    # tag them all in one go, others have their 'tag' function called for each object in turn
+    def set_quality_scores(self, qualities):
+        for objectkey, quality in qualities.items():
+            logger.info("Setting quality_score on {} to {}".format(objectkey,quality))
+        if self.provider.get('tagger') is not None:
+            self.provider['tagger'].tag_many({objectkey: {'quality_score': quality}
+                                              for objectkey, quality in qualities.items()},
+                                             fingerprints={objectkey: self.fingerprints.get(objectkey)
+                                                           for objectkey in qualities})
+        elif self.provider.get('tag') is not None:
+            for objectkey, quality in qualities.items():
+                self.provider['tag'](objectkey,'quality_score', quality)
 
     # simply retrieve a particular dataframe
     def get_dataframe(self,object_name):
         return self.object_list[object_name]['dataframe']
 
-    # this may be useful for use-cases where we want to play withe the raw files
+    # the column names of an object as they appear in the object itself, whether or not every column was loaded
+    def get_columns(self,object_name):
+        return self.object_list[object_name]['columns']
+
+    # record the offending values (as a dict of value: count) found by a scoring function, so that they can be
+    # inspected from the object_list returned by validate_objects
+    def record_exceptions(self, object_name, scoring_function, column, values):
+        if object_name in self.object_list:
+            exceptions = self.object_list[object_name].setdefault('exceptions', {})
+            exceptions.setdefault(scoring_function, {})[column] = values.to_dict()
+
+    # this may be useful for use-cases where we want to play withe the raw files; the raw file is only written to the
+    # temp folder (once) when it is asked for, or for every object if the instance was created with materialize=True.
+    # Providers without a 'materialize' function are expected to have put the file there themselves, as before
     def get_file(self,objectkey):
-        unique_temp_folder = temp_folder + self.uuid + '/'
-        tempfilename = unique_temp_folder + objectkey
+        tempfilename = self.temp_filename(objectkey)
+        materialize = self.provider.get('materialize')
+        if materialize is not None and not pathlib.Path(tempfilename).exists():
+            return materialize(self, objectkey)
         return tempfilename
 
 
 
+    # retrieve a single object, from the cache if we have already parsed this version of it, otherwise through the
+    # provider.  Returns (1, dataframe) or (0, None) in the same way as the provider's retrieve function
+    #
+    # columns, if given, is the set of columns that are actually needed (see required_columns); if the provider can
+    # read an object's header then only those columns are loaded.  The object's full list of column names is kept in
+    # self.headers either way
+    def load_object(self, object_key, columns=None):
+        with self.instrumentation.span(object_key, 'object', object=object_key) as span:
+            score, df = self.load_object_within(span, object_key, columns)
+            if score == 1 and self.instrumentation.enabled:
+                span.set(rows=len(df), bytes=int(df.memory_usage(deep=True).sum()))
+            return (score, df)
+
+    # load_object, noting where the object came from on its span
+    def load_object_within(self, span, object_key, columns):
+        fingerprint = None
+        if self.provider.get('fingerprint') is not None:
+            fingerprint = self.provider['fingerprint'](self, object_key)
+        self.fingerprints[object_key] = fingerprint
+
+        if fingerprint is not None:
+            df = self.cache.get(object_key, fingerprint)
+            if df is not None:
+                logger.info("Retrieved object {} from cache".format(object_key))
+                span.set(source='cache')
+                self.headers[object_key] = df.columns.to_list()
+                if columns is not None:
+                    df = df[[c for c in df.columns if c in columns] or df.columns[:1]]
+                return (1, df)
+
+        usecols = None
+        cache_key = fingerprint
+        if columns is not None and self.provider.get('header') is not None:
+            header = self.provider['header'](self, object_key)
+            if header is None:
+                return (0, None)
+            self.headers[object_key] = header
+            usecols = [c for c in header if c in columns] or header[:1]  # at least one column, to count the rows
+            if len(usecols) < len(header) and fingerprint is not None:
+                cache_key = '{}:{}'.format(fingerprint, hashlib.sha1('\0'.join(usecols).encode('utf-8')).hexdigest())
+            else:
+                usecols = None
+            if cache_key != fingerprint:
+                df = self.cache.get(object_key, cache_key)
+                if df is not None:
+                    logger.info("Retrieved columns {} of object {} from cache".format(usecols, object_key))
+                    span.set(source='cache')
+                    return (1, df)
+
+        columnar_cache = self.provider.get('columnar_cache')
+        if columnar_cache is not None and fingerprint is not None:
+            df = columnar_cache.get(cache_key)
+            if df is not None:
+                logger.info("Retrieved object {} from columnar cache".format(object_key))
+                span.set(source='columnar cache')
+                self.cache.put(object_key, cache_key, df)
+                self.headers.setdefault(object_key, df.columns.to_list())
+                return (1, df)
+
+        span.set(source='provider')
+        if usecols is None:
+            score, df = self.provider['retrieve'](self, object_key)
+        else:
+            score, df = self.provider['retrieve'](self, object_key, usecols=usecols)
+        if score == 1:
+            self.headers.setdefault(object_key, df.columns.to_list())
+            if fingerprint is not None:
+                self.cache.put(object_key, cache_key, df)
+                if columnar_cache is not None:
+                    columnar_cache.put(cache_key, df)
+        return (score, df)
+
+    # retrieve a list of objects through the provider, using a bounded pool of threads so that several (network bound)
+    # retrievals can be in flight at once.  Returns a dict of object_key: dataframe, in the same order as object_keys,
+    # or None if any object could not be retrieved (or timed out); failures are always reported in object_keys order
+    #
+    # each retrieval has retrieve_timeout seconds from when it starts (not from when we get round to waiting for it).
+    # As soon as one object fails the set has failed, so retrievals that haven't started are cancelled, and we stop
+    # waiting for any that overrun; those can't be interrupted, but finish in the background and are discarded
+    #
+    # columns optionally maps object keys to the set of columns needed from that object (see load_object)
+    def retrieve_objects(self, object_keys, columns=None):
+        columns = columns or {}
+        started = {}        # object_key: when its retrieval started
+        failures = {}
+        dataframes = {}
+
+        def load(object_key):
+            started[object_key] = time.monotonic()
+            return self.load_object(object_key, columns.get(object_key))
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency,
+                                                                                len(object_keys))))
+        try:
+            futures = {executor.submit(load, object_key): object_key for object_key in object_keys}
+            pending = set(futures)
+            while pending:
+                done, pending = concurrent.futures.wait(pending, timeout=self.time_to_deadline(
+                    [futures[f] for f in pending], started), return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        score, df = future.result()
+                    except Exception as e:
+                        failures[futures[future]] = repr(e)
+                        continue
+                    if score == 1:
+                        dataframes[futures[future]] = df
+                    else:
+                        failures[futures[future]] = 'not retrieved'
+                for future in [f for f in pending if self.overdue(futures[f], started)]:
+                    failures[futures[future]] = 'timed out after {} seconds'.format(self.retrieve_timeout)
+                    pending.discard(future)
+                if failures:
+                    pending = {future for future in pending if not future.cancel()}
+        finally:
+            executor.shutdown(wait=not failures, cancel_futures=True)
+
+        for object_key in object_keys:
+            if object_key in failures:
+                logger.error("Could not retrieve object {}: {}".format(object_key, failures[object_key]))
+        self.retrieval_failures = failures
+        if failures:
+            return None
+        return {object_key: dataframes[object_key] for object_key in object_keys}
+
+    # how long to wait for the pending retrievals (given by object key) before one of them reaches its deadline;
+    # retrievals that haven't started yet are looked at again after at most retrieve_timeout.  None if there is no
+    # timeout
+    def time_to_deadline(self, object_keys, started):
+        if self.retrieve_timeout is None:
+            return None
+        now = time.monotonic()
+        return max(0, min([started[k] + self.retrieve_timeout - now for k in object_keys if k in started],
+                          default=self.retrieve_timeout))
+
+    # has the retrieval of an object been running for longer than retrieve_timeout?
+    def overdue(self, object_key, started):
+        return self.retrieve_timeout is not None and object_key in started and \
+            time.monotonic() - started[object_key] >= self.retrieve_timeout
+
+
+    # work out which columns of each object a validation list actually uses, from the parameters of each scoring
+    # function (see column_requirements below).  Returns a dict of object_key: set of column names; an object is
+    # absent from the dict if any of its scoring functions could need every column (e.g. an unregistered custom
+    # scoring function), as are the master and comparison objects of an unregistered scoring function
+    def required_columns(self, validation_list):
+        columns = {}
+        unrestricted = set()
+        for item in validation_list:
+            object_key, scoring_function, p = item[0], item[1], item[2]
+            requirement = column_requirements.get(scoring_function)
+            if requirement is None:
+                unrestricted.add(object_key)
+                if isinstance(p, dict):
+                    unrestricted.update(p[reference] for reference in ('master', 'comparison')
+                                        if isinstance(p.get(reference), str))
+                continue
+            columns.setdefault(object_key, set())
+            for required_object, required_columns in requirement(object_key, p).items():
+                columns.setdefault(required_object, set()).update(required_columns)
+        return {k: v for k, v in columns.items() if k not in unrestricted}
+
+
+    # the objects in a validation list that can be scored a chunk at a time without ever being held in memory: those
+    # whose every scoring function has a fold (see chunked_folds below) or only looks at the object's column names,
+    # and which are not needed in full as the master or comparison of another test
+    def streamable_objects(self, validation_list):
+        streamable = dict.fromkeys(item[0] for item in validation_list)
+        for item in validation_list:
+            object_key, scoring_function, p = item[0], item[1], item[2]
+            if scoring_function not in chunked_folds and scoring_function not in header_only_scoring_functions:
+                streamable.pop(object_key, None)
+            for reference in ('master', 'comparison'):
+                if isinstance(p, dict) and p.get(reference) is not None:
+                    streamable.pop(p[reference], None)
+        return list(streamable)
+
+    # score the items (given as (index, item) pairs) for one object by folding them over the object's chunks, so that
+    # only chunksize rows are in memory at once.  Returns a dict of index: score
+    #
+    # the columns the folds look at are read as text; if any of them turn out to be entirely numbers, as they would
+    # have been read in one go, the folds whose scores depend on that are folded over the object again, with those
+    # columns as numbers (see chunked.py)
+    def score_in_chunks(self, object_key, items, chunksize, usecols=None):
+        items = [(index, item) for index, item in items if item[1] in chunked_folds]
+        if not items:
+            return {}
+        columns = {item[2]['column'] for index, item in items if 'column' in item[2]}
+        kinds = ColumnKinds(columns)
+        folds = self.fold_chunks(object_key, items, chunksize, usecols, columns, kinds=kinds)
+        dtypes = kinds.inferred_dtypes()
+        refold = [(index, item) for index, item in items
+                  if folds[index].dtype_sensitive and item[2].get('column') in dtypes]
+        if refold:
+            logger.info("Folding checks over {} again, with columns read as {}".format(object_key, dtypes))
+            folds.update(self.fold_chunks(object_key, refold, chunksize, usecols, columns, dtypes=dtypes))
+        return {index: fold.score() for index, fold in folds.items()}
+
+    # fold items over the chunks of an object, with columns read as text and then, if dtypes is given, those of its
+    # columns converted to the dtypes pandas would have inferred (see chunked.py).  Returns a dict of index: fold
+    def fold_chunks(self, object_key, items, chunksize, usecols, columns, kinds=None, dtypes=None):
+        folds = {index: chunked_folds[item[1]](self, object_key, item[2]) for index, item in items}
+        with self.instrumentation.span(object_key, 'object', object=object_key, source='provider') as span:
+            rows = 0
+            for chunk in self.provider['retrieve_chunks'](self, object_key, chunksize, usecols=usecols,
+                                                          dtype=dict.fromkeys(columns, str)):
+                if kinds is not None:
+                    kinds.update(chunk)
+                for column, dtype in (dtypes or {}).items():
+                    chunk[column] = as_inferred(chunk[column], dtype)
+                for fold in folds.values():
+                    fold.update(chunk)
+                rows += len(chunk)
+            span.set(rows=rows, chunked=True)
+        return folds
+
+
+    # the objects in a validation list that are only needed as the comparison (previous version) for score_row_count
+    # and grouped score_comparison tests, and otherwise only have tests that look at their column names, and for which the
+    # summary store holds a summary of the current version of the object covering those comparisons.  Such objects
+    # need not be retrieved at all.  Returns a dict of object_key: summary
+    def summarised_objects(self, validation_list):
+        if self.summary_store is None or self.provider.get('fingerprint') is None:
+            return {}
+        candidates = {}
+        excluded = set()
+        for item in validation_list:
+            object_key, scoring_function, p = item[0], item[1], item[2]
+            if scoring_function not in header_only_scoring_functions:
+                excluded.add(object_key)
+            if not isinstance(p, dict):
+                continue
+            if p.get('master') is not None:
+                excluded.add(p['master'])
+            if p.get('comparison') is not None:
+                if scoring_function is score_row_count:
+                    candidates.setdefault(p['comparison'], set())
+                elif scoring_function is score_comparison and summarisable(p):
+                    candidates.setdefault(p['comparison'], set()).add(comparison_spec(p))
+                else:
+                    excluded.add(p['comparison'])
+
+        summarised = {}
+        for object_key, specs in candidates.items():
+            if object_key in excluded:
+                continue
+            summary = self.summary_store.get(object_key)
+            if summary is None or not specs.issubset(summary['bases']):
+                continue
+            fingerprint = self.provider['fingerprint'](self, object_key)
+            if fingerprint is not None and fingerprint == summary['fingerprint']:
+                logger.info("Using the stored summary of {} rather than retrieving it".format(object_key))
+                self.fingerprints[object_key] = fingerprint
+                summarised[object_key] = summary
+        return summarised
+
+    # store summaries of the objects that were the subject of row count and grouped comparison tests, so that when they are
+    # the previous version of an object in future they need not be retrieved (see summarised_objects)
+    def record_summaries(self, validation_list):
+        if self.summary_store is None:
+            return
+        summaries = {}
+        for item in validation_list:
+            object_key, scoring_function, p = item[0], item[1], item[2]
+            if scoring_function not in (score_row_count, score_comparison):
+                continue
+            entry = self.object_list[object_key]
+            if entry.get('dataframe') is None or entry.get('fingerprint') is None:
+                continue
+            if object_key not in summaries:
+                summaries[object_key] = summarise(entry['dataframe'], entry['columns'], entry['fingerprint'])
+            if scoring_function is score_comparison and summarisable(p):
+                summaries[object_key]['bases'][comparison_spec(p)] = self.comparison_basis(object_key, p)
+        for object_key, summary in summaries.items():
+            self.summary_store.put(object_key, summary)
+
+    # the objects in a validation list whose tests can all be answered from a statistics profile (see profiles.py) and
+    # which no other test needs the rows of, and for which the profile store holds a profile of the current version of
+    # the object that answers every one of those tests (see profile_answers).  Such objects need not be retrieved at
+    # all.  Returns a dict of object_key: profile
+    def profiled_objects(self, validation_list):
+        if self.profile_store is None or self.provider.get('fingerprint') is None:
+            return {}
+        candidates = {}     # object_key: [(column, facts, scoring function, params)] of its checks on columns
+        excluded = set()
+        for item in validation_list:
+            object_key, scoring_function, p = item[0], item[1], item[2]
+            facts = fused_checks[scoring_function][0](p) if scoring_function in fused_checks else None
+            if facts is not None and facts.issubset(profile_fact_names):
+                candidates.setdefault(object_key, []).append((p['column'], facts, scoring_function, p))
+            elif scoring_function is score_row_count or scoring_function in header_only_scoring_functions:
+                candidates.setdefault(object_key, [])
+            else:
+                excluded.add(object_key)
+            if not isinstance(p, dict):
+                continue
+            if p.get('master') is not None:
+                excluded.add(p['master'])
+            if p.get('comparison') is not None:
+                if scoring_function is score_row_count:
+                    candidates.setdefault(p['comparison'], [])
+                else:
+                    excluded.add(p['comparison'])
+
+        profiled = {}
+        for object_key, checks in candidates.items():
+            if object_key in excluded:
+                continue
+            profile = self.profile_store.get(object_key)
+            if profile is None or not all(profile_answers(profile, *check) for check in checks):
+                continue
+            fingerprint = self.provider['fingerprint'](self, object_key)
+            if fingerprint is not None and fingerprint == profile['fingerprint']:
+                logger.info("Using the stored profile of {} rather than retrieving it".format(object_key))
+                self.fingerprints[object_key] = fingerprint
+                profiled[object_key] = profile
+        return profiled
+
+    # profile the objects that were retrieved, adding the columns loaded this time to any stored profile of the same
+    # version of the object, and keep the profiles with the objects so that checks can be answered from them
+    def profile_objects(self):
+        if self.profile_store is None:
+            return
+        for object_key, entry in self.object_list.items():
+            if entry.get('dataframe') is None or entry.get('fingerprint') is None:
+                continue
+            df = entry['dataframe']
+            profile = self.profile_store.get(object_key)
+            if profile is not None and profile['fingerprint'] == entry['fingerprint']:
+                missing = [c for c in df.columns if c not in profile['columns']]
+                if not missing:
+                    entry['profile'] = profile
+                    continue
+            else:
+                missing = list(df.columns)
+            logger.info("Profiling columns {} of {}".format(missing, object_key))
+            self.profile_store.put(object_key, profile_dataframe(df, entry['columns'], entry['fingerprint'], missing))
+            entry['profile'] = self.profile_store.get(object_key)
+
+    # the number of rows in an object, from its summary or profile if it was not retrieved
+    def row_count_of(self, object_name):
+        if 'summary' in self.object_list[object_name]:
+            return self.object_list[object_name]['summary']['row_count']
+        if 'profile' in self.object_list[object_name]:
+            return self.object_list[object_name]['profile']['row_count']
+        return len(self.get_dataframe(object_name).index)
+
+    # the column that score_comparison compares, as a single-column DataFrame: grouped and aggregated if the comparison
+    # has a groupby (and so indexed by the group keys), indexed by the key columns if it has keys, and taken from the
+    # object's summary if it was not retrieved
+    def comparison_basis(self, object_name, p):
+        if 'summary' in self.object_list[object_name]:
+            return self.object_list[object_name]['summary']['bases'][comparison_spec(p)]
+
+        df = self.get_dataframe(object_name)
+        aggregation = p.get('groupby', {}).get('aggregation')
+        if aggregation is not None:
+            if aggregation not in comparison_aggregations:
+                raise ValueError("Unsupported aggregation {} for score_comparison; expecting one of {}".format(
+                    aggregation, comparison_aggregations))
+            return df.groupby(p['groupby']['columns'])[p['column']].agg(aggregation).to_frame()
+        if p.get('keys'):
+            return df.set_index(p['keys'])[[p['column']]]
+        return df[[p['column']]]
+
+
     # The primary function of Daqual - to iterate over a list of tests, to run a test against an object and to record
     # a measure of the quality of that object, and to form a measure of the overall quality of the set of tests
     # defined by that list.
@@ -136,55 +679,147 @@ class Daqual:
     # test models.  The threshold is also a value between 0 and 1, and defines the minimum quality expected for that
     # particular test for the entire "test set" to pass (or fail). A threshold of 1 requires a quality score for that
     # test to be 1 for the "test set" to pass.
-    def validate_objects(self,validation_list):
+    #
+    # If a chunksize is given then objects whose tests can all be evaluated a chunk at a time (see streamable_objects)
+    # are never loaded in full; they are read chunksize rows at a time, and give the same scores as when in memory.
+    #
+    # If workers is more than 1 then independent tests are scored at the same time on that many threads; scores,
+    # weighting, thresholds and logging are still applied in validation list order, exactly as when run one at a time.
+    #
+    # If the instance was given an Instrumentation, the result is (average_quality, object_list, metrics), with metrics
+    # describing where the time went (see instrumentation.py)
+    #
+    # business_date (an ISO date; today by default) is the date the results are recorded against in the result sink,
+    # and object_names optionally maps object keys to the logical names they are recorded under there (each key is its
+    # own name by default; see results.py).  A run whose objects could not all be retrieved is recorded too, as failed.
+    #
+    # The object_list returned describes each object (its quality, number of tests, columns, fingerprint and any
+    # exceptions recorded, and the rows and columns that were loaded) but doesn't hold on to the objects themselves
+    def validate_objects(self,validation_list, chunksize=None, workers=None, business_date=None, object_names=None):
+        self.instrumentation.reset()
+        with self.instrumentation.span('validate_objects', 'validate_objects', checks=len(validation_list)):
+            result = self.validate(validation_list, chunksize, workers, business_date, object_names)
+        if self.instrumentation.enabled and result != 0:
+            return result + (self.instrumentation.metrics(),)
+        return result
+
+    # validate_objects, without its instrumentation
+    def validate(self, validation_list, chunksize, workers, business_date=None, object_names=None):
+        start = time.perf_counter()
+        self.retrieval_failures = {}
 
         self.object_list={}
         # first retrieve all required objects, create dataframes for them
-        for item in validation_list:
-            object_key = item[0]
-            if object_key not in self.object_list.keys():    # if we haven't already retrieved and processed this object
-                score, df = self.provider['retrieve'](self,object_key)
+        with self.instrumentation.span('plan', 'phase'):
+            object_keys = list(dict.fromkeys(item[0] for item in validation_list))
+            columns = self.required_columns(validation_list) if self.projection else None
+            summarised = self.summarised_objects(validation_list)
+            profiled = {k: v for k, v in self.profiled_objects(validation_list).items() if k not in summarised}
+            streamed = []
+            if chunksize is not None and self.provider.get('retrieve_chunks') is not None:
+                streamed = [k for k in self.streamable_objects(validation_list)
+                            if k not in summarised and k not in profiled]
+        with self.instrumentation.span('retrieve', 'phase'):
+            dataframes = self.retrieve_objects([k for k in object_keys
+                                                if k not in streamed and k not in summarised and k not in profiled],
+                                               columns)
+            # each array is defined such that ALL files in a specific validation list must exist
+            if dataframes is None:
+                return self.retrieval_failed(validation_list, business_date, object_names, start)
+            headers = {}
+            for object_key in streamed:
+                headers[object_key] = self.provider['header'](self, object_key)
+                if headers[object_key] is None:
+                    logger.error("Could not retrieve object {}".format(object_key))
+                    self.retrieval_failures = {object_key: 'no header'}
+                    return self.retrieval_failed(validation_list, business_date, object_names, start)
+
+        for object_key in object_keys:
+            self.object_list[object_key]={} # create the key and the dict
+            if object_key in dataframes:
+                df = dataframes[object_key]
                 setattr(df,'objectname',object_key) # a convenience such that we can always go in the reverse direction
                                                     # and retrieve the object key from the dataframe
-                if score == 1:
-                    self.object_list[object_key]={} # create the key and the dict
-                    self.object_list[object_key]['dataframe']=df
-                    self.object_list[object_key]['quality'] = 0
-                    self.object_list[object_key]['n_tests'] = 0
-                    self.object_list[object_key]['total_weighting'] = 0
-                if score == 0:          # each array is defined such that ALL files in a specific validation list
-                    return 0            # must exist
+                self.object_list[object_key]['dataframe']=df
+                self.object_list[object_key]['columns'] = self.headers.get(object_key, df.columns.to_list())
+                self.object_list[object_key]['fingerprint'] = self.fingerprints.get(object_key)
+            elif object_key in summarised:
+                self.object_list[object_key]['summary'] = summarised[object_key]
+                self.object_list[object_key]['columns'] = summarised[object_key]['columns']
+                self.object_list[object_key]['fingerprint'] = summarised[object_key]['fingerprint']
+            elif object_key in profiled:
+                self.object_list[object_key]['profile'] = profiled[object_key]
+                self.object_list[object_key]['columns'] = profiled[object_key]['header']
+                self.object_list[object_key]['fingerprint'] = profiled[object_key]['fingerprint']
+            else:
+                self.object_list[object_key]['columns'] = headers[object_key]
+                self.object_list[object_key]['fingerprint'] = None
+            self.object_list[object_key]['quality'] = 0
+            self.object_list[object_key]['n_tests'] = 0
+            self.object_list[object_key]['total_weighting'] = 0
+        with self.instrumentation.span('profile', 'phase'):
+            self.profile_objects()
 
         # if we have all required files, then for each entry in the validation list, we perform the requisite
         # scoring and test, and for each individual object we keep track of the total number of tests, the total
         # weighting, and the cumulative weighted quality score
 
-        failed_an_individual_test=False
-        for item in validation_list:
-            object_key = item[0]
-            scoring_function=item[1]
-            function_parameters=item[2]
-            individual_weight = item[3]
-            individual_threshold = item[4]
-
-            self.object_list[object_key]['n_tests'] += 1
-            self.object_list[object_key]['total_weighting'] += individual_weight
-
-            individual_test_score = item[1](self,object_key, item[2])
-            logger.info('Validating {} with test {}({}) - Quality Score = {}'.format(object_key,
-                                                                                     scoring_function.__name__,
-                                                                                     function_parameters,
-                                                                                     individual_test_score))
-            # if an individual test fails its minimum threshold then we need to record that fact and "fail" the overall
-            # validation/quality assessment
-            if (individual_test_score < individual_threshold):
-                logger.warn("Threshold failure: {} {}({}) scored {}, expecting at least {}".format(
-                    object_key,scoring_function.__name__,function_parameters,
-                    individual_test_score,individual_threshold))
-                failed_an_individual_test=True
-
-            # we record the contribution to the object quality, even if the test failed a threshold test
-            self.object_list[object_key]['quality'] += (individual_weight * individual_test_score)
+        with self.instrumentation.span('score_chunks', 'phase'):
+            chunked_scores = {}
+            for object_key in streamed:
+                usecols = None
+                if columns is not None and object_key in columns:
+                    header = self.get_columns(object_key)
+                    usecols = [c for c in header if c in columns[object_key]] or header[:1]
+                chunked_scores.update(self.score_in_chunks(object_key,
+                                                           [(i, item) for i, item in enumerate(validation_list)
+                                                            if item[0] == object_key],
+                                                           chunksize, usecols))
+
+        with self.instrumentation.span('score', 'phase'):
+            plan = ValidationPlan(self, validation_list, fused_checks)
+            concurrent_scores = {}
+            if workers is not None and workers > 1:
+                concurrent_scores = plan.score_concurrently([i for i in range(len(validation_list))
+                                                             if i not in chunked_scores
+                                                             and i not in plan.duplicate_of],
+                                                            workers)
+
+            failed_an_individual_test=False
+            check_results = []
+            for index, item in enumerate(validation_list):
+                object_key = item[0]
+                scoring_function=item[1]
+                function_parameters=item[2]
+                individual_weight = item[3]
+                individual_threshold = item[4]
+
+                self.object_list[object_key]['n_tests'] += 1
+                self.object_list[object_key]['total_weighting'] += individual_weight
+
+                if index in chunked_scores:
+                    individual_test_score = chunked_scores[index]
+                elif index in concurrent_scores:
+                    individual_test_score, records = concurrent_scores[index]
+                    for record in records:
+                        logger.handle(record)
+                else:
+                    individual_test_score = plan.score(index)
+                logger.info('Validating {} with test {}({}) - Quality Score = {}'.format(object_key,
+                                                                                         scoring_function.__name__,
+                                                                                         function_parameters,
+                                                                                         individual_test_score))
+                # if an individual test fails its minimum threshold then we need to record that fact and "fail" the
+                # overall validation/quality assessment
+                if (individual_test_score < individual_threshold):
+                    logger.warning("Threshold failure: {} {}({}) scored {}, expecting at least {}".format(
+                        object_key,scoring_function.__name__,function_parameters,
+                        individual_test_score,individual_threshold))
+                    failed_an_individual_test=True
+
+                # we record the contribution to the object quality, even if the test failed a threshold test
+                self.object_list[object_key]['quality'] += (individual_weight * individual_test_score)
+                check_results.append((individual_test_score, plan.seconds.get(index)))
 
         # now having completed every test we go through the entire list of results and re-weight the quality score
         # for each object, (which in turn is set or tagged on the object itself for most providers).  We also
@@ -192,17 +827,76 @@ class Daqual:
         average_quality = 0
         for i in self.object_list.keys():
             self.object_list[i]['quality'] /= self.object_list[i]['total_weighting']
-            self.set_quality_score(i, self.object_list[i]['quality'])
             average_quality += self.object_list[i]['quality']
             logger.info("Object summary for {} - quality: {}, n_tests: {}".format(i, self.object_list[i]['quality'], self.object_list[i]['n_tests']))
         average_quality /= len(self.object_list)
+        with self.instrumentation.span('summaries', 'phase'):
+            self.record_summaries(validation_list)
+        with self.instrumentation.span('tag', 'phase'):
+            self.set_quality_scores({i: self.object_list[i]['quality'] for i in self.object_list.keys()})
 
         # Need to actually fail the validation if a threshold is failed
         # Return the "overall" quality test/measure as being zero to indicate a test somewhere failed to meet its threshold
         if failed_an_individual_test==True:
            average_quality=0
 
-        return (average_quality, self.object_list) # return also the actual list of dataframes, files, etc. Necessary?
+        with self.instrumentation.span('results', 'phase'):
+            if self.result_sink is not None:
+                self.record_results(validation_list, check_results, average_quality, business_date, object_names,
+                                    time.perf_counter() - start)
+            self.release_dataframes()
+
+        return (average_quality, self.object_list)
+
+    # validate's result when its objects could not all be retrieved (those that failed are in retrieval_failures):
+    # the run is recorded in the result sink as failed, with no checks, and 0 is returned
+    def retrieval_failed(self, validation_list, business_date, object_names, start):
+        if self.result_sink is not None:
+            self.object_list = {object_key: {'fingerprint': self.fingerprints.get(object_key), 'quality': None,
+                                             'n_tests': 0,
+                                             'status': 'retrieval failed' if object_key in self.retrieval_failures
+                                             else 'not validated'}
+                                for object_key in dict.fromkeys(item[0] for item in validation_list)}
+            self.record_results([], [], 0, business_date, object_names, time.perf_counter() - start,
+                                status='retrieval failed')
+            self.object_list = {}
+        return 0
+
+    # pass the results of a run to the result sink (see results.py); check_results are (score, seconds) for each item
+    # of the validation list
+    def record_results(self, validation_list, check_results, average_quality, business_date, object_names, seconds,
+                       status='completed'):
+        run_id = uuid.uuid4().hex
+        business_date = business_date or date.today().isoformat()
+        object_names = object_names or {}
+        checks = [{'run_id': run_id, 'business_date': business_date, 'check_index': index, 'object_key': item[0],
+                   'object_name': object_names.get(item[0], item[0]), 'check_name': item[1].__name__,
+                   'params': json.dumps(item[2], sort_keys=True, default=str),
+                   'weight': item[3], 'threshold': item[4], 'score': float(score), 'passed': int(score >= item[4]),
+                   'seconds': check_seconds, 'fingerprint': self.object_list[item[0]].get('fingerprint')}
+                  for index, (item, (score, check_seconds)) in enumerate(zip(validation_list, check_results))]
+        objects = [{'run_id': run_id, 'business_date': business_date, 'object_key': object_key,
+                    'object_name': object_names.get(object_key, object_key), 'fingerprint': entry.get('fingerprint'),
+                    'quality': float(entry['quality']) if entry['quality'] is not None else None,
+                    'n_tests': entry['n_tests'],
+                    'rows': len(entry['dataframe']) if entry.get('dataframe') is not None else None,
+                    'status': entry.get('status', 'validated')}
+                   for object_key, entry in self.object_list.items()]
+        run = {'run_id': run_id, 'business_date': business_date, 'created': datetime.now(timezone.utc).isoformat(),
+               'quality': float(average_quality), 'checks': len(checks), 'seconds': seconds, 'status': status}
+        try:
+            self.result_sink.record(run, checks, objects)
+        except Exception as e:
+            logger.error("Could not record the results of run {}: {}".format(run_id, repr(e)))
+
+    # replace the dataframes in object_list by the number of rows and the columns that were loaded, so that the objects
+    # themselves are not kept alive by the results (those with fingerprints remain in the cache)
+    def release_dataframes(self):
+        for entry in self.object_list.values():
+            df = entry.pop('dataframe', None)
+            if df is not None:
+                entry['rows'] = len(df)
+                entry['loaded_columns'] = df.columns.to_list()
 
 
     '''
@@ -212,8 +906,8 @@ class Daqual:
     param: expected_columns - the number of expected columns
     '''
     def score_column_count(self, object_name, p):
-        dataframe = self.get_dataframe(object_name)
-        score=len(dataframe.columns)/p['expected_columns']
+        columns = self.get_columns(object_name)
+        score=len(columns)/p['expected_columns']
         if score <= 1:
             return score
         if (score > 2):
@@ -221,7 +915,7 @@ class Daqual:
         elif (score > 1):
             score = 2 - score
 
-        logger.warn("Object {} has {} columns, expecting only {}".format(dataframe.objectname,len(dataframe.columns),p['expected_columns']))
+        logger.warning("Object {} has {} columns, expecting only {}".format(object_name,len(columns),p['expected_columns']))
         return score
 
 
@@ -240,8 +934,7 @@ class Daqual:
     #
     # param: columns - a list of expected columns
     def score_column_names(self,object_name, p):
-        df=self.get_dataframe(object_name)
-        if (df.columns.to_list() == p['columns']):
+        if (list(self.get_columns(object_name)) == p['columns']):
             return 1
         else:
             return 0
@@ -250,52 +943,80 @@ class Daqual:
     # provide a master data frame, and column therein, and confirm the % of values from our regular dataframe, and column,
     # that are present in that master set. useful check of referential integrity and consistency across files
     #
-    # params: column, master, master_column
+    # membership is tested with a hashed lookup (Series.isin) so the cost grows linearly with the number of rows
+    # rather than rows x master; the offending values and their counts are recorded against the object (see
+    # record_exceptions) and can also be obtained directly from get_invalid_values()
+    #
+    # params: column, master, master_column, optionally error_bound (see approximate.py)
     def score_column_valid_values(self,object_name,p):
         df=self.get_dataframe(object_name)
+        return self.valid_values_score(object_name, p, len(df[p['column']]), self.get_invalid_values(object_name, p))
 
-        master = self.get_dataframe(p['master'])
-        s=df[p['column']].to_list()
-
-        m=master[p['master_column']].to_list()
-        c=0
-        for i in s:
-            if i in m:
-                c+=1
-        if c < len(s):
-            logger.warn('Unexpected values in {} column {}; values are not in master data {} col'.format(
-                df['objectname'],p['column'],p['master'],p['master_column']
-            ))
-        return c/len(s)
+    # the score (and the logging and recording of exceptions) for score_column_valid_values, given the total number of
+    # values and the value_counts() of those not in the master
+    def valid_values_score(self, object_name, p, total, invalid):
+        c = total - invalid.sum()
+        if c < total:
+            logger.warning('Unexpected values in {} column {}; {} values are not in master data {} column {}: {}'
+                           .format(object_name, p['column'], total - c, p['master'], p['master_column'],
+                                   sample_values(invalid)))
+        self.record_exceptions(object_name, 'score_column_valid_values', p['column'], invalid)
+        return c/total
+
+
+    # the values (and the number of times each occurs) in our column that are not present in the master column
+    #
+    # params: column, master, master_column, optionally error_bound
+    def get_invalid_values(self,object_name,p):
+        s=self.get_dataframe(object_name)[p['column']]
+        m=self.get_dataframe(p['master'])[p['master_column']]
+        if p.get('error_bound') is not None:
+            return s[~bloom_filter_of(m, p['error_bound']).contains(s)].value_counts(dropna=False)
+        return s[~s.isin(m)].value_counts(dropna=False)
 
 
     # provide a master data frame, and column therein, and confirm that each and every value from that master list is used
     # at least once in our primary dataframe. returns the percentage of the master list that is indeed used in the primary dataframe
     #
-    # params: column, master, master_column
+    # the unused master values are recorded against the object, see get_unused_master_values()
+    #
+    # params: column, master, master_column, optionally error_bound (see approximate.py)
     def score_every_master_value_used(self,object_name,p):
-        df=self.get_dataframe(object_name)
-        master = self.get_dataframe(p['master'])
-        s=df[p['column']].to_list()
+        m=self.get_dataframe(p['master'])[p['master_column']]
+        original_count=m.nunique(dropna=False)
 
-        m=set(master[p['master_column']].to_list())
-        used=set()
-        original_count=len(m)
-        c=0
-        for i in m:
-            if i in s:
-                used.add(i)
+        unused = self.get_unused_master_values(object_name, p)
+        if len(unused) > 0:
+            logger.warning('Unused master values in {} column {}; {} values are not used by {} column {}: {}'.format(
+                p['master'],p['master_column'],len(unused),object_name,p['column'],sample_values(unused)
+            ))
+        self.record_exceptions(object_name, 'score_every_master_value_used', p['column'], unused)
 
-        score = len(used)/original_count
+        score = (original_count-len(unused))/original_count
 
         return score
 
 
+    # the values (and the number of times each occurs in the master) from the master column that are never used in our
+    # column
+    #
+    # params: column, master, master_column, optionally error_bound
+    def get_unused_master_values(self,object_name,p):
+        s=self.get_dataframe(object_name)[p['column']]
+        m=self.get_dataframe(p['master'])[p['master_column']]
+        if p.get('error_bound') is not None:
+            return m[~bloom_filter_of(s, p['error_bound']).contains(m)].value_counts(dropna=False)
+        return m[~m.isin(s.unique())].value_counts(dropna=False)
+
+
     # does a column contain only unique values
     #
-    # param: column - the column to check
+    # param: column - the column to check, optionally error_bound (see approximate.py)
     def score_unique_column(self,object_name, p):
         df=self.get_dataframe(object_name)
+        if p.get('error_bound') is not None:
+            return self.approximate_unique_score(object_name, p,
+                                                 ApproximateUniqueness(p['error_bound']).add(df[p['column']]))
         values = df[p['column']].to_list()
         values_set = set(values)
         if len(values) == len(values_set):
@@ -303,6 +1024,14 @@ class Daqual:
         else:
             return 0
 
+    # the score (and logging) for score_unique_column with an error_bound, given the ApproximateUniqueness of the column
+    def approximate_unique_score(self, object_name, p, uniqueness):
+        if uniqueness.unique():
+            return 1
+        logger.warning("Column {} of {} is not unique: about {:.2%} of its values are repeats; most repeated: {}"
+                       .format(p['column'], object_name, uniqueness.repeated_fraction(), uniqueness.most_repeated()))
+        return 0
+
     # TODO - need to allow a generic comparison basis, e.g. just "more than" or "less than"
     # get the % of rows expected; if you get too many columns, it still returns a % showing your overage, upto a maximum
     # if you have double or more the number of rows desired, the returned score is 0
@@ -310,12 +1039,13 @@ class Daqual:
     # param: expected_row_count - the number of expected rows
     def score_row_count(self,object_name,p):
 
-        df = self.get_dataframe(object_name)
-        row_count = len(df.index)
+        return self.row_count_score(self.row_count_of(object_name), p)
+
+    # the score for score_row_count, given the number of rows in the object
+    def row_count_score(self, row_count, p):
         comparison = p.get('comparison')
         if comparison != None:
-            comparison_df = self.get_dataframe(comparison)
-            comparison_row_count = len(comparison_df.index)
+            comparison_row_count = self.row_count_of(comparison)
 
             if p.get('expected_delta') == '>=':
                 if row_count>=comparison_row_count:
@@ -343,40 +1073,41 @@ class Daqual:
     # param: match - the regex to use, column - the column to match
     def score_column_format(self,object_name, p):
         df = self.get_dataframe(object_name)
-        r = p['match']
-        pattern = re.compile(r)
-        score=0
-        for i in df[p['column']]:
-            if i is None or pd.isnull(i):
-                i=""
-            if pattern.match(i):
-                score+=1
+        pattern = re.compile(p['match'])
+        score = count_format_matches(df[p['column']], pattern)
 
         score = score/len(df[p['column']])
         return score
 
 
+    # the % of the non-blank values in a column that are whole numbers, whether held as numbers or as text (signed or
+    # not), see numeric.py; blank values are left out altogether, so a column of blanks scores 1
+    #
+    # the number of offending values, and a sample of their rows, are logged, and the values recorded against the
+    # object (see record_exceptions)
     def score_int(self,objectname, p):
-        dt = self.get_dataframe(objectname)[p['column']].dtype
-        if dt == np.dtype('int64'):
-            return 1
-        else:
-            return 0
+        return self.numeric_score(objectname, p, 'int')
 
 
+    # the % of the non-blank values in a column that are numbers, whole or not
     def score_float(self,objectname, p):
-        dt = self.get_dataframe(objectname)[p['column']].dtype
-        if dt == np.dtype('float64'):
-            return 1
-        else:
-            return 0
+        return self.numeric_score(objectname, p, 'float')
 
 
     def score_number(self,objectname, p):
-        if score_float(self,objectname,p):
-            return 1
-        else:
-            return score_int(self,objectname,p)
+        return self.numeric_score(objectname, p, 'number')
+
+
+    # the score for score_int, score_float and score_number: the % of non-blank values that are numbers of that kind
+    def numeric_score(self, objectname, p, kind):
+        values = self.get_dataframe(objectname)[p['column']]
+        invalid = invalid_number_mask(values, kind)
+        n_invalid = int(invalid.sum())
+        if n_invalid:
+            logger.warning('{} values in {} column {} are not {} values, in rows: {}'.format(
+                n_invalid, objectname, p['column'], kind, sample_rows(values.index, invalid)))
+            self.record_exceptions(objectname, 'score_' + kind, p['column'], values[invalid].value_counts(dropna=False))
+        return valid_fraction(int(values.notna().sum()), n_invalid)
 
 
     def score_date(self, objectname, p):
@@ -400,79 +1131,45 @@ class Daqual:
     # look at situations where we add blank rows to the old file, and expect the new file to (potentially) have
     # more/new data.
     #
+    # params: column, comparison - the object to compare with, comparator - one of >, >=, =, <=, <, != or between,
+    # optionally delta or factor - the tolerance that gives the bounds of our values, groupby - {columns, aggregation}
+    # where aggregation is one of sum, mean, min, max or count, and keys - columns that identify the rows to compare
     def score_comparison(self, objectname,p):
-        df = self.get_dataframe(objectname).copy()
-        comparison = self.get_dataframe(p['comparison']).copy() # we will need this later to work ou
-
-        # TODO - do we keep the natural ordering of the file/DF or do we (optionally?) force the ordering with a sort?
-
-        # TODO - need to add aggregation-based comparison (e.g. groupby sum and mean) capability
         # if we have a grouping construct then re-shape the dataframes into the appropriate aggregations of themselves
-        if 'groupby' in p.keys():
-            columns = p['groupby']['columns']
-            aggregation = p['groupby'].get('aggregation')
-
-            if aggregation == 'sum':
-                df = df.groupby(columns).sum()
-                comparison = comparison.groupby(columns).sum()
-            elif aggregation == 'mean':
-                df = df.groupby(columns).mean()
-                comparison = comparison(columns).mean()
-
-        original_rows = len(comparison)
-
-
-        # make sure the two datasets have the same number of rows for a trivial comparison
-        missing_rows = len(comparison)-len(df)
+        # (see comparison_basis); the comparison may come from a stored summary rather than the object itself
+        series = self.comparison_basis(objectname, p)[p['column']]
+        comparison = self.comparison_basis(p['comparison'], p)[p['column']]
+
+        # line the two up: grouped comparisons on their group keys, comparisons with keys on those keys, and otherwise
+        # row by row.  Every row of the comparison is compared; those with no counterpart in our object compare as
+        # blank, and rows only in our object are ignored
+        if p.get('groupby', {}).get('aggregation') is None and not p.get('keys'):
+            series = series.set_axis(pd.RangeIndex(len(series)))
+            comparison = comparison.set_axis(pd.RangeIndex(len(comparison)))
+        if not series.index.is_unique:
+            raise ValueError("Rows of {} are not identified uniquely by {}".format(objectname, p.get('keys')))
+        missing_rows = len(comparison.index.difference(series.index))
         if missing_rows > 0:
-            logger.info("Primary object {} does not have enough rows; padding with {} rows".format(objectname, abs(
-                missing_rows)))
-            for i in range(missing_rows):
-                df = df.append(pd.Series(),ignore_index=True)   # could do in-place,but would mess up the original DF
-        elif missing_rows < 0:
-            logger.info("Comparison object {} does not have enough rows; padding with {} rows".format(p['comparison'],
-                                                                                                      abs(missing_rows)))
-            for i in range(abs(missing_rows)):
-                comparison = comparison.append(pd.Series(),ignore_index=True)
-
-
+            logger.info("Primary object {} has no counterpart for {} rows of comparison object {}".format(
+                objectname, missing_rows, p['comparison']))
+        series = series.reindex(comparison.index)
 
-
-        # prepare an "adjusted series", with upper and lower bounds, to compare with our comparison series
-        adjusted_series = df.copy()
+        # upper and lower bounds of our values, to compare with the comparison values
         if 'delta' in p:
-            adjusted_series['daqual_upper_bound'] = adjusted_series[p['column']] + p['delta']
-            adjusted_series['daqual_lower_bound'] = adjusted_series[p['column']] - p['delta']
+            upper_bound = series + p['delta']
+            lower_bound = series - p['delta']
         elif 'factor' in p:
-            upper_factor = 1+p['factor']
-            lower_factor = 1-p['factor']
-            adjusted_series['daqual_upper_bound'] = adjusted_series[p['column']] * upper_factor
-            adjusted_series['daqual_lower_bound'] = adjusted_series[p['column']] * lower_factor
+            upper_bound = series * (1+p['factor'])
+            lower_bound = series * (1-p['factor'])
         else:
-            adjusted_series['daqual_upper_bound'] = adjusted_series[p['column']]
-            adjusted_series['daqual_lower_bound'] = adjusted_series[p['column']]
-
+            upper_bound = lower_bound = series
 
         if p['comparator'] != 'between':
-            df_series = adjusted_series['daqual_upper_bound']
-            difference=self.compare(df_series,comparison[p['column']],p['comparator'])
-
-        else:
-            df_series = adjusted_series['daqual_lower_bound']
-            difference1 = self.compare(df_series, comparison[p['column']], '>=')
-
-            df_series = adjusted_series['daqual_upper_bound']
-            difference2 = self.compare(df_series, comparison[p['column']], '<=')
+            difference = self.compare(upper_bound, comparison, p['comparator'])
+        else:   # the comparison value lies within our bounds
+            difference = self.compare(lower_bound, comparison, '<=') & self.compare(upper_bound, comparison, '>=')
 
-            difference = difference1 & difference2
-
-        difference_count = difference.sum()  # count the Trues; all blank rows added to allow comparison only have False
-                                             # as a result of a comparison in any case
-
-        # Need to use the original comparison length actually, since we potentially added some blank rows
-        quality = difference_count/original_rows
-
-        return quality
+        return difference.sum()/len(comparison)
 
     def compare(self, df_series,comparison, comparator):
         # there really ought to be a way of doing this by simply passing the comparator function,
@@ -509,40 +1206,16 @@ class Daqual:
         # except: "weekends", "holidays", custom
         # exceptthen: "next", "nextday"
 
+    # move customdelta steps of the calendar's schedule (a day, or a week for the weekly schedule) from currentDate,
+    # and then, if that's a holiday (or a weekend, for the workingdays schedule), roll on by customdelta days at a time
+    # until we hit a valid date.  Each calendar is compiled once into a BusinessCalendar (see calendars.py), which
+    # answers this from its index of business days
     def calc_date(currentDate, custom_calendar, isoabbreviated, customdelta=1):
-        # build a couple of lists of holidays that we want to exclude from our returnable date
-        iso_holidays=[]
-        for h in [x for x in custom_calendar['holidays'] if len(x)==10]: # so if these are full iso dates, then convert them to date objects
-            iso_holidays.append(date.fromisoformat(h))
-        recurring_holidays = [x for x in custom_calendar['holidays'] if len(x)==5]
-
-        startingdate=date.fromisoformat(currentDate)
-        if custom_calendar['schedule'] == 'workingdays':
-            delta = timedelta(days=1)
-        elif custom_calendar['schedule'] == 'daily':
-            delta = timedelta(days=1)
-        elif custom_calendar['schedule'] == 'weekly':
-            delta = timedelta(days=7)
-        else:
-            delta = timedelta(days=1)
-        # if custom_calendar['schedule'] == 'monthly': # need to think what this means
-        #     delta = timedelta()
-        finaldate = startingdate + delta*customdelta
-
-        # now correct for the possibility that we've ended up on an invalid/holiday date, in which case roll forward
-        # by a day at a time until we hit a valid date
-        oneday = timedelta(days=1)
-        while  (finaldate in iso_holidays or
-               ((str(finaldate.month) + '-' + str(finaldate.day)) in recurring_holidays) or
-               (custom_calendar['schedule']=="workingdays" and finaldate.weekday() > 4)):
-            finaldate+=(oneday*customdelta)
-
-        d=finaldate.isoformat()
-
-        if isoabbreviated==False:
-            return d
-        else:
-            return ''.join([x for x in d if x!='-']) # strip out the hyphens from the ISO dat
+        return compiled_calendar(custom_calendar).calc_date(currentDate, isoabbreviated, customdelta)
+
+    # the compiled form of a calendar, for finding business days, offsets and ranges of business dates
+    def business_calendar(custom_calendar=None):
+        return compiled_calendar(custom_calendar if custom_calendar is not None else Daqual.default_calendar)
 
     # could automate this by making use of:http://kayaposoft.com/enrico/
 
@@ -563,16 +1236,114 @@ class Daqual:
     # Define some function mappings for provider-specific behaviour
     file_system_provider = {
         'retrieve': retrieve_object_from_filesystem,
+        'materialize': materialize_object_from_filesystem,
+        'fingerprint': fingerprint_object_from_filesystem,
+        'header': header_of_object_from_filesystem,
+        'retrieve_chunks': retrieve_chunks_of_object_from_filesystem,
         'tag': None,    # filesystem provider doesn't currently support tagging
 
         # root of where to find files for this provider
-        "file_system_provider_root":'../examples/'
+        "file_system_provider_root":'../examples/',
+
+        # optionally, a cache.ColumnarCache in which to keep parsed objects between runs
+        'columnar_cache': None
     }
 
     aws_provider = {
         'retrieve': retrieve_object_from_S3,
+        'materialize': materialize_object_from_S3,
+        'fingerprint': fingerprint_object_from_S3,
+        'header': header_of_object_from_S3,
+        'retrieve_chunks': retrieve_chunks_of_object_from_S3,
+        'list': list_objects_in_S3,
         'tag': update_object_tagging_S3,
+        'tagger': s3_tagger,   # writes tags in bulk; replace with S3Tagger(deferred=True) to write them on flush()
+
+        # the pooled client shared by everything above; to change its settings, e.g.
+        #   s3 = S3Session(max_pool_connections=64); dict(aws_provider, s3=s3, tagger=S3Tagger(session=s3))
+        's3': s3_session,
 
         # DEPRECATED - BUCKETNAME no longer required (part of object name)
-        'BUCKET_NAME': 'daqual'  # replace with your bucket name
+        'BUCKET_NAME': 'daqual',  # replace with your bucket name
+
+        # optionally, a cache.ColumnarCache in which to keep parsed objects between runs
+        'columnar_cache': None
     }
+
+
+
+# The columns each of the default scoring functions needs, as a function of (object_name, params) returning a dict of
+# object_name: columns, used by Daqual.required_columns to avoid loading columns that no test looks at.  Scoring
+# functions that only look at an object's column names (e.g. score_column_names) need no columns at all, since the
+# names are always read from the object's header.  Custom scoring functions can be registered here too; unregistered
+# functions are given every column.
+def comparison_columns(object_name, p):
+    columns = [p['column']] + list(p.get('groupby', {}).get('columns', [])) + list(p.get('keys') or [])
+    return {object_name: columns, p['comparison']: columns}
+
+column_requirements = {
+    score_1: lambda object_name, p: {},
+    score_column_count: lambda object_name, p: {},
+    score_column_names: lambda object_name, p: {},
+    score_row_count: lambda object_name, p: {p['comparison']: []} if p.get('comparison') is not None else {},
+    score_no_blanks: lambda object_name, p: {object_name: [p['column']]},
+    score_unique_column: lambda object_name, p: {object_name: [p['column']]},
+    score_column_format: lambda object_name, p: {object_name: [p['column']]},
+    score_int: lambda object_name, p: {object_name: [p['column']]},
+    score_float: lambda object_name, p: {object_name: [p['column']]},
+    score_number: lambda object_name, p: {object_name: [p['column']]},
+    score_date: lambda object_name, p: {object_name: [p['column']]},
+    score_column_valid_values: lambda object_name, p: {object_name: [p['column']], p['master']: [p['master_column']]},
+    score_every_master_value_used: lambda object_name, p: {object_name: [p['column']],
+                                                           p['master']: [p['master_column']]},
+    score_comparison: comparison_columns,
+}
+
+
+# can a check on a column be scored from an object's profile alone?
+def profile_answers(profile, column, facts, scoring_function, p):
+    column_facts = profile_facts(profile, column, facts)
+    return column_facts is not None and fused_checks[scoring_function][1](column_facts, p) is not None
+
+
+# The scoring functions that can be evaluated over an object a chunk at a time, and the fold that does so (see
+# chunked.py); and those which only ever look at an object's column names, and so never need its rows
+chunked_folds = {
+    score_no_blanks: NoBlanksFold,
+    score_column_format: ColumnFormatFold,
+    score_unique_column: UniqueColumnFold,
+    score_column_valid_values: ColumnValidValuesFold,
+    score_row_count: RowCountFold,
+}
+
+header_only_scoring_functions = {score_1, score_column_count, score_column_names}
+
+# The aggregations that a score_comparison groupby may use
+comparison_aggregations = ('sum', 'mean', 'min', 'max', 'count')
+
+# the score for a column of rows non-blank values, invalid of which are not numbers of the kind wanted (blanks are
+# ignored, rather than counted as passes)
+def valid_fraction(rows, invalid):
+    return (rows - invalid) / rows if rows else 1
+
+# score_int, score_float and score_number are only answered from facts when every value is valid; otherwise the scoring
+# function is run itself, so that the offending values and their rows are logged
+def numeric_check(kind):
+    fact = ('invalid_numbers', kind)
+    return (lambda p: {fact}, lambda facts, p: 1 if facts[fact] == 0 else None)
+
+# The scoring functions that can be answered from facts about a single column (see planner.py), so that all such checks
+# on a column share one scan of it: the facts each needs, as a function of its params (or None if, with those params,
+# the check has to be scored by the scoring function itself), and how to score from those facts (or None if, with
+# those facts, the check has to be scored by the scoring function itself)
+fused_checks = {
+    score_no_blanks: (lambda p: {('nulls',)},
+                      lambda facts, p: 0 if facts[('nulls',)] > 0 else 1),
+    score_column_format: (lambda p: {('matches', p['match'])},
+                          lambda facts, p: facts[('matches', p['match'])] / facts[('rows',)]),
+    score_unique_column: (lambda p: {('unique',)} if p.get('error_bound') is None else None,
+                          lambda facts, p: 1 if facts[('unique',)] else 0),
+    score_int: numeric_check('int'),
+    score_float: numeric_check('float'),
+    score_number: numeric_check('number'),
+}
@@ -1,26 +1,103 @@
+import hashlib
+import io
 import logging
 import pandas as pd
-import subprocess
 import numpy as np
 
+from .numeric import invalid_number_mask, sample_rows
+
 logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class daqual2:
+# The rows of a DataFrame that have failed a test, as a numpy boolean mask per column (True where a row failed), so
+# that the rows failing any column, or every column, are found with vectorized ORs and ANDs rather than sets of row
+# numbers.  len() and iteration give the columns with at least one failing row.
+class RowFailureIndex:
 
-    def __init__(self, filename):
-        self.df = pd.read_csv(filename)
-        self.filename = filename
-        self.invalid_rows = []
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self.masks = {}
+
+    # record the failing rows (a boolean mask of n_rows) of a column, in addition to any already recorded for it
+    def add(self, column, mask):
+        mask = np.asarray(mask, dtype=bool)
+        if column in self.masks:
+            self.masks[column] = self.masks[column] | mask
+        else:
+            self.masks[column] = mask
+
+    def failing(self, column):
+        return self.masks.get(column, np.zeros(self.n_rows, dtype=bool))
+
+    # the rows failing in any of the columns (all of those recorded, by default)
+    def union(self, columns=None):
+        columns = list(self.masks.keys() if columns is None else columns)
+        return np.logical_or.reduce([self.failing(c) for c in columns]) if columns else \
+            np.zeros(self.n_rows, dtype=bool)
+
+    # the rows failing in every one of the columns (all of those recorded, by default)
+    def intersection(self, columns=None):
+        columns = list(self.masks.keys() if columns is None else columns)
+        return np.logical_and.reduce([self.failing(c) for c in columns]) if columns else \
+            np.zeros(self.n_rows, dtype=bool)
+
+    # the positions of the rows in a mask
+    def rows(self, mask):
+        return np.flatnonzero(mask)
+
+    def columns(self):
+        return [c for c, mask in self.masks.items() if mask.any()]
+
+    def __len__(self):
+        return len(self.columns())
+
+    def __iter__(self):
+        return iter(self.columns())
 
 
+# A binary file wrapper that hashes everything read through it, so that a file can be hashed in the same pass as it is
+# parsed.  Reads go through a large buffer; hexdigest() reads (and hashes) whatever the parser left unread.
+class HashingReader(io.RawIOBase):
 
-        process = subprocess.Popen(['shasum', filename],
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
-        self.hash = stdout.split()[0].decode('UTF-8')
+    buffer_size = 4 * 1024 * 1024
+
+    def __init__(self, raw, hash_function='sha1'):
+        self.raw = io.BufferedReader(raw, buffer_size=self.buffer_size)
+        self.hasher = hashlib.new(hash_function) if isinstance(hash_function, str) else hash_function()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.raw.readinto(buffer)
+        if n:
+            self.hasher.update(memoryview(buffer)[:n])
+        return n
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.hasher.update(data)
+        return data
+
+    def hexdigest(self):
+        for block in iter(lambda: self.read(self.buffer_size), b''):
+            pass
+        return self.hasher.hexdigest()
+
+
+class daqual2:
+
+    # hash_function is the name of a hashlib algorithm (SHA1 by default, the identity of the file), or any callable
+    # returning an object with update() and hexdigest() - e.g. xxhash.xxh3_64, for faster content addressing.  The
+    # file is read once, and hashed as it is parsed
+    def __init__(self, filename, hash_function='sha1'):
+        self.filename = filename
+        with open(filename, 'rb', buffering=0) as f:
+            reader = HashingReader(f, hash_function)
+            self.df = pd.read_csv(reader)
+            self.hash = reader.hexdigest()
+        self.invalid_rows = RowFailureIndex(len(self.df))
 
 
 
@@ -54,46 +131,51 @@ class daqual2:
 
 
 
+    # the % of values in a column that are whole numbers (held as numbers or as text, signed or not; see numeric.py).
+    # As ever in daqual2, a blank value is not an integer.  The failing rows are kept in the object's RowFailureIndex,
+    # and their number, with a sample of them, logged
     def score_field_int(self, column_name):
-        dt = self.df[column_name].dtype
-        if dt == np.dtype('int64'):
-            return 1  # if every row is an int then return 1, but otherwise, let's go and find the rows that are not
-        else:
-            valid=0
-            invalid=0
-            for n,item in enumerate( self.df[column_name]):
-                if str(item).isdigit():
-                    valid += 1
-                else:
-                    invalid += 1
-                    print(f'row {n} column {column_name} is not an integer')
-            return valid/(valid+invalid)
+        values = self.df[column_name]
+        invalid = invalid_number_mask(values, 'int') | values.isna().to_numpy()
+        n_invalid = int(invalid.sum())
+        if n_invalid:
+            logger.warning('{} rows of column {} are not integers: {}'.format(n_invalid, column_name,
+                                                                             sample_rows(values.index, invalid)))
+        self.invalid_rows.add(column_name, invalid)
+        return (len(values) - n_invalid) / len(values) if len(values) else 1
+
+    # a boolean mask of the rows of a column that do not meet the criteria of the provided function; the function is
+    # applied to each value of just that column, or, if vectorized, once to the whole column (returning a boolean
+    # Series)
+    def get_invalid_mask(self, function, column, vectorized=False):
+        values = self.df[column]
+        result = function(values) if vectorized else values.map(function)
+        return (result == False).to_numpy(dtype=bool)
 
     # for a provided function see get a list of the row indices that do not meet the criteria of the provided function
-    def get_invalid_rows(self, function, column):
-        return list(self.df[self.df.applymap(function)[column] == False].index)
+    def get_invalid_rows(self, function, column, vectorized=False):
+        return list(self.df.index[self.get_invalid_mask(function, column, vectorized)])
 
     # for a provided function get the % of rows that do not match that function for a given column
-    # store the indices of the failing rows in the object
-    def generic_score(self,function, column):
-        invalid_rows = self.get_invalid_rows(function,column)
+    # store the failing rows in the object's RowFailureIndex
+    def generic_score(self,function, column, vectorized=False):
+        invalid_mask = self.get_invalid_mask(function, column, vectorized)
         total_rows=len(self.df[column])
-        row_score = (total_rows-len(invalid_rows))/total_rows
-        self.invalid_rows[column] += invalid_rows
+        row_score = (total_rows-int(invalid_mask.sum()))/total_rows
+        self.invalid_rows.add(column, invalid_mask)
         return row_score
 
 
+    # the % of columns with no failing rows
     def calculate_column_score(self):
         invalid_columns = len(self.invalid_rows)
         total_columns = len(self.df.columns)
-        column_score = (total_columns-invalid_columns/total_columns)
+        column_score = (total_columns-invalid_columns)/total_columns
         return column_score
 
+    # the % of rows that have not failed in any column
     def calculate_row_score(self):
-        unique_invalid_rows = set()
-        for column in self.invalid_rows:
-            unique_invalid_rows.add(column)
-        total_invalid_rows = len(unique_invalid_rows)
+        total_invalid_rows = int(self.invalid_rows.union().sum())
         total_rows=len(self.df)
         row_score = (total_rows-total_invalid_rows)/total_rows
         return row_score
@@ -0,0 +1,71 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# The regex syntax that means the same to Python's re and to the RE2 engine used by Arrow's string kernels, as the
+# tokens a pattern may be made of: ASCII literals and escaped punctuation, ., ^, alternation, plain and non-capturing
+# groups, greedy and lazy quantifiers (RE2 allows at most 1000 repetitions), and character classes of literals,
+# ranges and escaped punctuation.  Anything else - $ (which re also matches before a trailing newline), \d, \w and
+# other escapes whose classes are Unicode-aware in re, POSIX classes, atomic groups, possessive quantifiers, comments,
+# look-arounds, back-references, inline flags - is matched with re
+re2_compatible_token = re.compile(r"""
+    [^\\\[\](){}?*+$]                            # a literal, or . ^ |
+  | \\[^0-9A-Za-z]                                # escaped punctuation
+  | \(\?: | \((?!\?) | \)                         # non-capturing and plain groups
+  | (?: [*+?] | \{\d{1,4}(?:,\d{0,4})?\} ) \??    # quantifiers, greedy or lazy
+  | \[\^? (?: [^\\\[\]] | \\[^0-9A-Za-z] )+ \]     # character classes
+""", re.VERBOSE)
+
+
+# the number of values in a series that match a compiled regex; blanks are matched as empty strings
+#
+# blanks are counted in bulk, and each distinct value is only matched once (weighted by the number of times it occurs),
+# so columns with repeated values (codes, currencies, account numbers) are cheap to match.  Columns made up of mostly
+# distinct values are matched with Arrow's string kernels when the column is held in Arrow and the regex means the same
+# thing to both engines, and otherwise with re; either way each value matches exactly as pattern.match(value) would.
+def count_format_matches(series, pattern):
+    blanks = series.isna()
+    n_blanks = int(blanks.sum())
+    score = n_blanks if n_blanks and pattern.match("") else 0
+
+    values = series[~blanks] if n_blanks else series
+    if len(values) == 0:
+        return score
+
+    sample = values.iloc[:10000]
+    if sample.nunique() <= len(sample) // 2:  # judging from a sample, values are repeated
+        codes, uniques = pd.factorize(values)
+        matched = np.fromiter((pattern.match(value) is not None for value in uniques), dtype=bool, count=len(uniques))
+        return score + int(np.bincount(codes, minlength=len(uniques))[matched].sum())
+
+    if is_arrow_string(values) and arrow_compatible(pattern):
+        try:
+            return score + int(values.str.match(pattern.pattern).sum())
+        except ValueError:      # e.g. pyarrow's ArrowInvalid, for a pattern RE2 turns out not to accept
+            pass
+    return score + sum(1 for value in values.to_numpy(dtype=object) if pattern.match(value))
+
+
+def is_arrow_string(series):
+    dtype = series.dtype
+    if isinstance(dtype, pd.StringDtype):
+        return dtype.storage == 'pyarrow'
+    return isinstance(dtype, pd.ArrowDtype) and dtype.kind in 'OSU'
+
+
+def arrow_compatible(pattern):
+    if (pattern.flags & ~re.UNICODE) != 0 or not pattern.pattern.isascii():
+        return False
+    position = 0
+    while position < len(pattern.pattern):
+        token = re2_compatible_token.match(pattern.pattern, position)
+        if token is None:
+            return False
+        if token.group().startswith('{') and max(int(n) for n in re.findall(r'\d+', token.group())) > 1000:
+            return False
+        if token.group()[-1:] in '*+?}' and pattern.pattern[token.end():token.end() + 1] == '+':
+            return False        # possessive
+        position = token.end()
+    return True
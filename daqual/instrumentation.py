@@ -0,0 +1,162 @@
+import itertools
+import threading
+import time
+
+
+# Instrumentation of validate_objects: the time spent in each phase (retrieval, profiling, scoring, tagging, ...), in
+# retrieving each object (with where it came from - a cache or the provider - and its rows and bytes in memory) and in
+# scoring each check.  Pass an Instrumentation to Daqual to turn it on; validate_objects then returns
+# (average_quality, object_list, metrics), where metrics is the summary built by metrics() below.
+#
+# Every timed step is a Span.  Hooks are called with each span as it ends, e.g. to log or export timings; a hook is any
+# callable taking a span, such as an OpenTelemetryHook.  Phases nest inside the validate_objects span, and objects and
+# checks inside the phase that was running when they started, whichever thread they ran on.
+#
+# Without an Instrumentation, Daqual uses null_instrumentation, whose spans do nothing at all.
+class Instrumentation:
+
+    enabled = True
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.spans = []
+        self.active = []        # the validate_objects span and the phase spans open within it
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    # a span for a step of the given kind ('validate_objects', 'phase', 'object' or 'check'), to be used as a context
+    # manager; attributes can be added with set() while it runs
+    def span(self, name, kind, **attributes):
+        return Span(self, name, kind, attributes)
+
+    def started(self, span):
+        with self.lock:
+            span.id = next(self.ids)
+            span.parent = self.active[-1].id if self.active else None
+            if span.kind in ('validate_objects', 'phase'):
+                self.active.append(span)
+
+    def ended(self, span):
+        with self.lock:
+            if span in self.active:
+                self.active.remove(span)
+            self.spans.append(span)
+        for hook in self.hooks:
+            hook(span)
+
+    def reset(self):
+        with self.lock:
+            self.spans = []
+            self.active = []
+
+    # a summary of the spans recorded since the last reset():
+    #   seconds  - the time spent in validate_objects
+    #   phases   - {phase: seconds}
+    #   objects  - {object_key: {'seconds', 'source', 'rows', 'bytes'}} for the objects that were retrieved
+    #   checks   - [{'index', 'object', 'function', 'seconds', 'score', 'source'}] in validation list order
+    #   cache    - {'hits', 'misses'}: objects retrieved from one of the caches, or from the provider
+    #   rows     - the rows retrieved, and bytes - their size in memory
+    def metrics(self):
+        with self.lock:
+            spans = list(self.spans)
+        objects = {s.attributes['object']: dict(seconds=s.seconds, **{k: v for k, v in s.attributes.items()
+                                                                      if k != 'object'})
+                   for s in spans if s.kind == 'object'}
+        checks = sorted((dict(seconds=s.seconds, **s.attributes) for s in spans if s.kind == 'check'),
+                        key=lambda check: check['index'])
+        hits = sum(1 for o in objects.values() if o.get('source', 'provider') != 'provider')
+        return {
+            'seconds': sum(s.seconds for s in spans if s.kind == 'validate_objects'),
+            'phases': {s.name: s.seconds for s in spans if s.kind == 'phase'},
+            'objects': objects,
+            'checks': checks,
+            'cache': {'hits': hits, 'misses': len(objects) - hits},
+            'rows': sum(o.get('rows', 0) for o in objects.values()),
+            'bytes': sum(o.get('bytes', 0) for o in objects.values()),
+        }
+
+
+class Span:
+
+    def __init__(self, instrumentation, name, kind, attributes):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.id = None
+        self.parent = None
+        self.start_time_ns = None       # wall clock, for exporters
+        self.end_time_ns = None
+        self.seconds = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.instrumentation.started(self)
+        self.start_time_ns = time.time_ns()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self.start
+        self.end_time_ns = self.start_time_ns + int(self.seconds * 1e9)
+        if exc_type is not None:
+            self.attributes['error'] = repr(exc_value)
+        self.instrumentation.ended(self)
+        return False
+
+
+class NullInstrumentation:
+
+    enabled = False
+
+    def span(self, name, kind, **attributes):
+        return null_span
+
+    def reset(self):
+        pass
+
+
+class NullSpan:
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+null_span = NullSpan()
+null_instrumentation = NullInstrumentation()
+
+
+# A hook that exports spans to OpenTelemetry, through the given tracer (e.g. opentelemetry.trace.get_tracer('daqual')).
+# Spans are held until their validate_objects span ends and are then exported together, so that each can be given its
+# parent; opentelemetry itself is only imported then.
+class OpenTelemetryHook:
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def __call__(self, span):
+        with self.lock:
+            self.pending.append(span)
+            if span.parent is not None:
+                return
+            spans, self.pending = self.pending, []
+
+        from opentelemetry import trace
+
+        exported = {}
+        for s in sorted(spans, key=lambda s: (s.start_time_ns, s.id)):
+            context = trace.set_span_in_context(exported[s.parent]) if s.parent in exported else None
+            attributes = {k: v if isinstance(v, (str, bool, int, float)) else str(v)
+                          for k, v in s.attributes.items() if v is not None}
+            exported[s.id] = self.tracer.start_span(s.name, context=context, start_time=s.start_time_ns,
+                                                    attributes=dict(attributes, kind=s.kind))
+            exported[s.id].end(end_time=s.end_time_ns)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+
+# Vectorized validation of numbers, whether a column holds them as numbers or as text.  Text is parsed in bulk with
+# pd.to_numeric, so signs, leading zeros, decimal points and exponents are all understood as pandas understands them.
+# The kinds of number are:
+#   int     - whole numbers, e.g. '42', '-7', '+007', 3.0
+#   decimal - any finite number, e.g. '1.25', '-0.5', '1e3'
+#   float   - any number, including infinities; number is the same
+# Blank values are never counted as invalid: whether a column may have blanks is a question for score_no_blanks.
+numeric_kinds = ('int', 'decimal', 'float', 'number')
+
+
+# {kind: boolean mask of the non-blank values of the series that are not numbers of that kind}, for each of kinds,
+# with the series parsed only once
+def invalid_numbers(series, kinds=numeric_kinds):
+    present = series.notna().to_numpy(dtype=bool)
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype):
+        return {kind: present for kind in kinds}
+    if pd.api.types.is_integer_dtype(dtype):
+        none = np.zeros(len(series), dtype=bool)
+        return {kind: none for kind in kinds}
+    if pd.api.types.is_numeric_dtype(dtype):
+        values = series.to_numpy(dtype=float, na_value=np.nan)
+    else:
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+
+    parsed = ~np.isnan(values)
+    finite = np.isfinite(values)
+    with np.errstate(invalid='ignore'):
+        integral = finite & (np.floor(values) == values)
+    valid = {'int': integral, 'decimal': finite, 'float': parsed, 'number': parsed}
+    return {kind: present & ~valid[kind] for kind in kinds}
+
+
+def invalid_number_mask(series, kind):
+    return invalid_numbers(series, (kind,))[kind]
+
+
+# a short, bounded, printable list of the labels of the rows in a mask, for use in log messages
+def sample_rows(index, mask, n=10):
+    positions = np.flatnonzero(mask)
+    sample = ', '.join(str(label) for label in index[positions[:n]])
+    if len(positions) > n:
+        sample += ', ... ({} more)'.format(len(positions) - n)
+    return sample
@@ -0,0 +1,199 @@
+import concurrent.futures
+import json
+import logging
+import re
+import threading
+import time
+
+from .formats import count_format_matches
+from .numeric import invalid_numbers, numeric_kinds
+
+logger = logging.getLogger(__name__)
+
+
+# A plan for scoring a validation list, used by Daqual.validate_objects.
+#
+# The plan groups the items of a validation list by object and column, so that the checks which can be answered from
+# simple facts about a column (see fused_checks in daqual.py) share a single scan of that column: e.g. a no-blanks
+# check, two regex checks and a uniqueness check on the same column look at the column's values once, rather than
+# four times.  Identical checks (same object, scoring function and parameters) are only scored once, but the log
+# records of that scoring are emitted again for each of them, so the log is the same as if each had been scored.
+#
+# Items are still scored, and therefore logged, in validation list order; a column is scanned when the first check
+# that needs it is scored.  Checks on an object that has a statistics profile (see profiles.py) covering the column are
+# answered from the profile instead, without a scan.  A check whose facts don't settle its score (see fused_checks) is
+# scored by its scoring function.
+class ValidationPlan:
+
+    def __init__(self, daqual, validation_list, fused_checks):
+        self.daqual = daqual
+        self.validation_list = validation_list
+        self.fused_checks = fused_checks
+        self.duplicate_of = {}      # index: index of the first identical item
+        self.facts_needed = {}      # (object_key, column): set of facts to collect in one scan of that column
+        self.facts = {}             # (object_key, column): dict of fact: value, once scanned
+        self.scores = {}            # index: score
+        self.seconds = {}           # index: the time taken to score it
+        self.scan_locks = {}        # (object_key, column): lock held while that column is scanned
+        self.log_records = {}       # index: the log records emitted while scoring an item that has duplicates
+
+        first_index = {}
+        for index, item in enumerate(validation_list):
+            object_key, scoring_function, p = item[0], item[1], item[2]
+            key = check_key(object_key, scoring_function, p)
+            if key is not None and key in first_index:
+                self.duplicate_of[index] = first_index[key]
+                continue
+            if key is not None:
+                first_index[key] = index
+            facts = self.facts_for(scoring_function, p)
+            if facts is not None:
+                self.facts_needed.setdefault((object_key, p['column']), set()).update(facts)
+                self.scan_locks.setdefault((object_key, p['column']), threading.Lock())
+
+        logger.debug("Planned {} checks: {} identical checks, {} column scans".format(
+            len(validation_list), len(self.duplicate_of), len(self.facts_needed)))
+
+    # the facts a check needs, or None if it isn't answered from facts about its column
+    def facts_for(self, scoring_function, p):
+        if scoring_function not in self.fused_checks:
+            return None
+        return self.fused_checks[scoring_function][0](p)
+
+    # the score for the item at index in the validation list
+    def score(self, index):
+        if index in self.duplicate_of:
+            self.seconds[index] = 0.0
+            emit(self.log_records.get(self.duplicate_of[index], []))
+            return self.scores[self.duplicate_of[index]]
+        if index not in self.duplicate_of.values():
+            return self.score_item(index)
+
+        previous, deferred_logs.local.records = getattr(deferred_logs.local, 'records', None), []
+        try:
+            score = self.score_item(index)
+        finally:
+            self.log_records[index], deferred_logs.local.records = deferred_logs.local.records, previous
+        emit(self.log_records[index])
+        return score
+
+    # score, for an item that isn't a duplicate
+    def score_item(self, index):
+        start = time.perf_counter()
+        object_key, scoring_function, p = self.validation_list[index][0:3]
+        with self.daqual.instrumentation.span(scoring_function.__name__, 'check', index=index, object=object_key,
+                                              function=scoring_function.__name__) as span:
+            entry = self.daqual.object_list[object_key]
+            df = entry.get('dataframe')
+            needed = self.facts_for(scoring_function, p)
+            evaluate = self.fused_checks[scoring_function][1] if needed is not None else None
+            score = None
+            if needed is not None and entry.get('profile') is not None:
+                facts = profile_facts(entry['profile'], p['column'], needed)
+                if facts is not None:
+                    span.set(source='profile')
+                    score = evaluate(facts, p)
+            if score is None and needed is not None and df is not None and p['column'] in df.columns:
+                span.set(source='scan')
+                group = (object_key, p['column'])
+                with self.scan_locks[group]:
+                    if group not in self.facts:
+                        self.facts[group] = scan_column(df[p['column']], self.facts_needed[group])
+                score = evaluate(self.facts[group], p)
+            if score is None:
+                span.set(source='function')
+                score = scoring_function(self.daqual, object_key, p)
+            span.set(score=score)
+
+        self.scores[index] = score
+        self.seconds[index] = time.perf_counter() - start
+        return score
+
+
+    # score the items at indexes (none of which may be duplicates) on a pool of threads, so that independent checks run
+    # at the same time; most of the work happens in pandas and numpy, much of which releases the GIL.  Returns a dict
+    # of index: (score, log records emitted while scoring that item); the log records are held back so that the caller
+    # can emit them in validation list order
+    def score_concurrently(self, indexes, workers):
+        def score_and_capture(index):
+            deferred_logs.local.records = []
+            try:
+                return self.score(index), deferred_logs.local.records
+            finally:
+                deferred_logs.local.records = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {index: executor.submit(score_and_capture, index) for index in indexes}
+            return {index: future.result() for index, future in futures.items()}
+
+
+# A logging filter which, on threads that are scoring items concurrently, holds back log records rather than letting
+# them be emitted straight away (see ValidationPlan.score_concurrently)
+class DeferredLogs(logging.Filter):
+
+    def __init__(self):
+        super().__init__()
+        self.local = threading.local()
+
+    def filter(self, record):
+        records = getattr(self.local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+deferred_logs = DeferredLogs()
+
+
+# emit log records again, through their loggers (and so, on a thread scoring concurrently, into its deferred records)
+def emit(records):
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+
+
+# a hashable identity for a check, or None if its parameters can't be compared (in which case it is never deduplicated)
+def check_key(object_key, scoring_function, p):
+    try:
+        return (object_key, scoring_function, json.dumps(p, sort_keys=True))
+    except (TypeError, ValueError):
+        return None
+
+
+# Collect the requested facts about a column in a single scan.  Facts are:
+#   ('rows',)            - the number of values
+#   ('nulls',)           - the number of blank values
+#   ('unique',)          - True if no value is repeated (using the same equality as a Python set)
+#   ('matches', regex)   - the number of values that match the regex, with blanks matched as empty strings
+#   ('invalid_numbers', kind) - the number of non-blank values that aren't numbers of that kind (see numeric.py)
+def scan_column(series, facts):
+    result = {('rows',): len(series)}
+    if ('nulls',) in facts:
+        result[('nulls',)] = int(series.isna().sum())
+    if ('unique',) in facts:
+        values = series.to_list()
+        result[('unique',)] = len(set(values)) == len(values)
+    kinds = [fact[1] for fact in facts if fact[0] == 'invalid_numbers']
+    if kinds:
+        for kind, invalid in invalid_numbers(series, kinds).items():
+            result[('invalid_numbers', kind)] = int(invalid.sum())
+    for fact in facts:
+        if fact[0] == 'matches':
+            result[fact] = count_format_matches(series, re.compile(fact[1]))
+    return result
+
+
+# the facts (in the form produced by scan_column) about a column that a statistics profile (see profiles.py) holds, or
+# None if the profile doesn't cover the column or lacks any of the facts needed
+profile_fact_names = {('rows',), ('nulls',), ('unique',)} | {('invalid_numbers', kind) for kind in numeric_kinds}
+
+def profile_facts(profile, column, needed):
+    column_profile = profile['columns'].get(column)
+    if column_profile is None or not set(needed).issubset(profile_fact_names):
+        return None
+    facts = {('rows',): profile['row_count'], ('nulls',): column_profile['nulls'],
+             ('unique',): column_profile['unique']}
+    for kind, count in (column_profile.get('invalid_numbers') or {}).items():
+        facts[('invalid_numbers', kind)] = count
+    if not set(needed).issubset(facts):
+        return None     # a profile recorded before these facts were
+    return facts
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from .numeric import numeric_kinds
+from .planner import scan_column
+from .sketches import HyperLogLog
+from .stores import ObjectStore
+
+
+# A persistent store of per-object statistics profiles, kept as JSON (see stores.py) so that they can be read by
+# dashboards as well as by Daqual.  When the profile of the current version of an object covers every column its checks
+# look at, and those checks can all be answered from a profile (see planner.profile_facts), the object need not be
+# retrieved at all (see Daqual.profiled_objects).
+#
+# A profile is a dict of:
+#   fingerprint  - the fingerprint of the object version profiled; a profile is only used while this still matches
+#   row_count    - the number of rows
+#   header       - the object's column names
+#   columns      - {column: column profile} for the columns that were loaded, each a dict of:
+#                    dtype    - the column's dtype, as a string
+#                    nulls    - the number of blank values
+#                    unique   - True if no value is repeated
+#                    distinct - an estimate of the number of distinct non-blank values, from...
+#                    sketch   - ...a HyperLogLog sketch of those values (see sketches.py)
+#                    min, max - of the non-blank values, or None if there are none or they can't be ordered (e.g.
+#                               a mix of text and numbers)
+#                    formats  - for text columns, the most common format signatures (see format_signature) and the
+#                               number of values with each
+#                    invalid_numbers - {kind: the number of non-blank values that aren't numbers of that kind}, for
+#                               each kind in numeric.numeric_kinds
+class ProfileStore(ObjectStore):
+
+    kind = 'profile'
+    suffix = '.profile.json'
+
+    def merge(self, existing, profile):
+        return dict(profile, columns=dict(existing['columns'], **profile['columns']))
+
+
+# profile the given columns of a dataframe, with the facts about each column collected in one scan of it
+def profile_dataframe(df, header, fingerprint, columns=None):
+    columns = df.columns if columns is None else columns
+    return {'fingerprint': fingerprint, 'row_count': len(df), 'header': list(header),
+            'columns': {column: profile_column(df[column]) for column in columns}}
+
+
+def profile_column(series):
+    numbers = {('invalid_numbers', kind) for kind in numeric_kinds}
+    facts = scan_column(series, {('nulls',), ('unique',)} | numbers)
+    sketch = HyperLogLog().add(series)
+    low, high = value_range(series.dropna())
+    profile = {'dtype': str(series.dtype), 'nulls': facts[('nulls',)], 'unique': facts[('unique',)],
+               'distinct': sketch.estimate(), 'sketch': sketch.to_string(), 'min': plain(low), 'max': plain(high),
+               'formats': None, 'invalid_numbers': {fact[1]: facts[fact] for fact in numbers}}
+    if not pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_datetime64_any_dtype(series.dtype):
+        profile['formats'] = format_signatures(series)
+    return profile
+
+
+# the lowest and highest of some values, or (None, None) if there are none or they can't be ordered
+def value_range(values):
+    if len(values) == 0:
+        return None, None
+    try:
+        return values.min(), values.max()
+    except TypeError:
+        return None, None
+
+
+# A regex-free description of the shape of a value: upper and lower case ASCII letters become 'A' and 'a', digits
+# become '9', and everything else is kept, e.g. 'GB29 NWBK' -> 'AA99 AAAA' and '2021-03-01' -> '9999-99-99'
+signature_table = str.maketrans({**{c: 'A' for c in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'},
+                                 **{c: 'a' for c in 'abcdefghijklmnopqrstuvwxyz'},
+                                 **{c: '9' for c in '0123456789'}})
+
+def format_signature(value):
+    return str(value).translate(signature_table)
+
+
+# the n most common format signatures of the non-blank values of a series, and the number of values with each; each
+# distinct value is only translated once
+def format_signatures(series, n=10):
+    counts = series.value_counts(dropna=True)
+    if len(counts) == 0:
+        return {}
+    signatures = pd.Series(counts.to_numpy(), index=[format_signature(value) for value in counts.index])
+    signatures = signatures.groupby(level=0).sum().sort_values(ascending=False, kind='stable')
+    return {signature: int(count) for signature, count in signatures.iloc[:n].items()}
+
+
+# a value as something JSON can hold
+def plain(value):
+    if value is None or (np.ndim(value) == 0 and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
@@ -0,0 +1,178 @@
+import datetime
+import logging
+import os
+import pathlib
+import sqlite3
+import threading
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+# Result sinks keep the outcome of every validate_objects run, so that the history of an object's quality can be
+# queried later (see Daqual's result_sink).  A sink is any object with a record(run, checks, objects) method, called
+# once at the end of each run with:
+#   run      - {'run_id', 'business_date', 'created', 'quality', 'checks', 'seconds', 'status'}; status 'completed',
+#               or 'retrieval failed' for a run whose objects could not all be retrieved (and so has no checks)
+#   checks   - [{'check_index', 'object_key', 'object_name', 'check_name', 'params', 'weight', 'threshold', 'score',
+#                'passed', 'seconds', 'fingerprint'}], one per item of the validation list; params as JSON, seconds
+#               None for checks scored a chunk at a time
+#   objects  - [{'object_key', 'object_name', 'fingerprint', 'quality', 'n_tests', 'rows', 'status'}], one per
+#               object; rows None if the object wasn't loaded; status 'validated', or for a failed run 'retrieval
+#               failed' or 'not validated', with quality None
+# Every record also carries the run's run_id and business_date.  object_name is the logical name of the object, which
+# stays the same from one business date to the next - e.g. the template 'accounts-{business_date}.csv' that a backfill
+# renders as 'accounts-20190301.csv' - and is the object key itself unless validate_objects was given object_names.
+#
+# Two sinks are built in: SQLiteResultStore and ParquetResultStore.  Both answer history() queries, by object name.
+
+run_columns = ['run_id', 'business_date', 'created', 'quality', 'checks', 'seconds', 'status']
+check_columns = ['run_id', 'business_date', 'check_index', 'object_key', 'object_name', 'check_name', 'params',
+                 'weight', 'threshold', 'score', 'passed', 'seconds', 'fingerprint']
+object_columns = ['run_id', 'business_date', 'object_key', 'object_name', 'fingerprint', 'quality', 'n_tests', 'rows',
+                  'status']
+
+# the types of the columns that may be None throughout a run (e.g. a failed run's qualities), so that every Parquet
+# file of a dataset has the same schema
+nullable_dtypes = {'fingerprint': 'string', 'quality': 'float64', 'score': 'float64', 'seconds': 'float64',
+                   'rows': 'Int64'}
+
+
+# A results database in a single SQLite file.  Each run is written in one transaction, and the checks and objects
+# tables are indexed by object name (and check) and business date, so that e.g. the last 90 days of an object's
+# quality are found without scanning the whole history.  The store can be shared between threads and Daqual
+# instances.  A database written before the object_name and status columns existed has them added when opened.
+class SQLiteResultStore:
+
+    tables = {
+        'runs': 'run_id TEXT PRIMARY KEY, business_date TEXT, created TEXT, quality REAL, checks INTEGER, '
+                'seconds REAL, status TEXT',
+        'checks': 'run_id TEXT, business_date TEXT, check_index INTEGER, object_key TEXT, object_name TEXT, '
+                  'check_name TEXT, params TEXT, weight REAL, threshold REAL, score REAL, passed INTEGER, '
+                  'seconds REAL, fingerprint TEXT',
+        'objects': 'run_id TEXT, business_date TEXT, object_key TEXT, object_name TEXT, fingerprint TEXT, '
+                   'quality REAL, n_tests INTEGER, rows INTEGER, status TEXT',
+    }
+
+    indexes = [
+        'CREATE INDEX IF NOT EXISTS runs_by_date ON runs (business_date)',
+        'CREATE INDEX IF NOT EXISTS checks_by_object ON checks (object_name, check_name, business_date)',
+        'CREATE INDEX IF NOT EXISTS objects_by_object ON objects (object_name, business_date)',
+    ]
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        with self.connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            for table, columns in self.tables.items():
+                connection.execute('CREATE TABLE IF NOT EXISTS {} ({})'.format(table, columns))
+                self.add_missing_columns(connection, table, columns)
+            for statement in self.indexes:
+                connection.execute(statement)
+
+    # add any columns of a table that an older database lacks; the indexes on object_key are replaced by ones on
+    # object_name, which older rows take from their object_key
+    def add_missing_columns(self, connection, table, columns):
+        existing = {row[1] for row in connection.execute('PRAGMA table_info({})'.format(table))}
+        for column in columns.split(', '):
+            name = column.split(' ')[0]
+            if name not in existing:
+                connection.execute('ALTER TABLE {} ADD COLUMN {}'.format(table, column))
+                if name == 'object_name':
+                    connection.execute('UPDATE {} SET object_name = object_key'.format(table))
+                    connection.execute('DROP INDEX IF EXISTS {}_by_object'.format(table))
+
+    def connect(self):
+        return sqlite3.connect(self.filename, timeout=60)
+
+    def record(self, run, checks, objects):
+        with self.lock:
+            connection = self.connect()
+            try:
+                with connection:
+                    connection.execute(insert('runs', run_columns), [run[c] for c in run_columns])
+                    connection.executemany(insert('checks', check_columns),
+                                           [[record[c] for c in check_columns] for record in checks])
+                    connection.executemany(insert('objects', object_columns),
+                                           [[record[c] for c in object_columns] for record in objects])
+            finally:
+                connection.close()
+
+    # the quality of an object, by object name (or, given check, the scores of that check of it) on each business date
+    # from days before until to until (today, by default), oldest first, as a DataFrame.  Runs whose objects could not
+    # be retrieved appear with a quality of None and their status
+    def history(self, object_name, days=90, check=None, until=None):
+        start, end = date_window(days, until)
+        if check is None:
+            query = ('SELECT business_date, object_key, quality, n_tests, rows, fingerprint, status, run_id '
+                     'FROM objects WHERE object_name = ? AND business_date BETWEEN ? AND ? '
+                     'ORDER BY business_date, run_id')
+            params = [object_name, start, end]
+        else:
+            query = ('SELECT business_date, object_key, check_index, params, score, passed, threshold, seconds, '
+                     'fingerprint, run_id FROM checks WHERE object_name = ? AND check_name = ? AND business_date '
+                     'BETWEEN ? AND ? ORDER BY business_date, run_id, check_index')
+            params = [object_name, check, start, end]
+        connection = self.connect()
+        try:
+            return pd.read_sql_query(query, connection, params=params)
+        finally:
+            connection.close()
+
+
+# Results as Parquet files under a folder, in runs/, checks/ and objects/ datasets partitioned by business date (one
+# file per run in each), for reading by anything that reads Parquet.  Requires pyarrow.
+class ParquetResultStore:
+
+    def __init__(self, folder):
+        self.folder = folder
+        pathlib.Path(folder).mkdir(parents=True, exist_ok=True)
+
+    def record(self, run, checks, objects):
+        for table, columns, records in (('runs', run_columns, [run]), ('checks', check_columns, checks),
+                                        ('objects', object_columns, objects)):
+            if not records:
+                continue
+            partition = os.path.join(self.folder, table, 'business_date={}'.format(run['business_date']))
+            pathlib.Path(partition).mkdir(parents=True, exist_ok=True)
+            df = pd.DataFrame(records, columns=columns).drop(columns=['business_date'])
+            df = df.astype({c: dtype for c, dtype in nullable_dtypes.items() if c in df.columns})
+            temp_filename = os.path.join(partition, '.{}.parquet.tmp'.format(run['run_id']))
+            df.to_parquet(temp_filename, index=False)
+            os.replace(temp_filename, os.path.join(partition, '{}.parquet'.format(run['run_id'])))
+
+    # as SQLiteResultStore.history; only the partitions of the business dates asked for are read
+    def history(self, object_name, days=90, check=None, until=None):
+        start, end = date_window(days, until)
+        table = 'objects' if check is None else 'checks'
+        if not os.path.isdir(os.path.join(self.folder, table)):
+            return pd.DataFrame(columns=object_columns if check is None else check_columns)
+        filters = [('business_date', '>=', start), ('business_date', '<=', end), ('object_name', '==', object_name)]
+        if check is not None:
+            filters.append(('check_name', '==', check))
+        df = pd.read_parquet(os.path.join(self.folder, table), filters=filters,
+                             partitioning=hive_string_partitioning())
+        df['business_date'] = df['business_date'].astype(str)
+        return df.sort_values(['business_date', 'run_id'] + ([] if check is None else ['check_index']),
+                              kind='stable').reset_index(drop=True)
+
+
+def hive_string_partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([('business_date', pa.string())]), flavor='hive')
+
+
+def insert(table, columns):
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(table, ', '.join(columns), ', '.join('?' * len(columns)))
+
+
+# the first and last ISO dates of a window of days ending on until (an ISO date or date; today by default)
+def date_window(days, until=None):
+    if until is None:
+        until = datetime.date.today()
+    elif isinstance(until, str):
+        until = datetime.date.fromisoformat(until)
+    return (until - datetime.timedelta(days=days - 1)).isoformat(), until.isoformat()
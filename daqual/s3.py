@@ -0,0 +1,47 @@
+import threading
+
+import boto3
+import boto3.s3.transfer
+import botocore.config
+
+
+# The connection layer for the aws_provider: a boto3 session and S3 client that are built once, on first use, and then
+# shared by retrieval, tagging and listing from any number of threads (boto3 clients are thread-safe; sessions are not,
+# which is why the client is built under a lock).
+#
+# max_pool_connections bounds the number of HTTP connections kept open to S3 and should be at least the number of
+# threads that use the client at once (e.g. Daqual's max_concurrency).  retries is passed to botocore as the retry
+# configuration, and transfer_config (a boto3.s3.transfer.TransferConfig) is used for file downloads.  Any other
+# keyword arguments (region_name, endpoint_url, ...) are passed to the client.
+class S3Session:
+
+    def __init__(self, max_pool_connections=32, retries=None, transfer_config=None, **client_kwargs):
+        self.max_pool_connections = max_pool_connections
+        self.retries = retries if retries is not None else {'max_attempts': 5, 'mode': 'adaptive'}
+        self.transfer_config = transfer_config if transfer_config is not None else \
+            boto3.s3.transfer.TransferConfig(max_concurrency=10, use_threads=True)
+        self.client_kwargs = client_kwargs
+        self._client = None
+        self.lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self.lock:
+                if self._client is None:
+                    config = botocore.config.Config(max_pool_connections=self.max_pool_connections,
+                                                    retries=self.retries)
+                    self._client = boto3.session.Session().client('s3', config=config, **self.client_kwargs)
+        return self._client
+
+    # every key in a bucket that starts with prefix
+    def list_keys(self, bucket, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                yield item['Key']
+
+    # drop the client, e.g. after credentials have changed; a new one is built on next use
+    def reset(self):
+        with self.lock:
+            self._client = None
@@ -0,0 +1,175 @@
+import base64
+import math
+
+import numpy as np
+import pandas as pd
+
+
+# the types of the values in object columns that are hashed as numbers, and the hash of every blank
+number_types = (bool, int, float, np.number, np.bool_)
+blank_hash = np.uint64(0x9e3779b97f4a7c15)
+
+
+# 64 bit hashes of the values of a series, computed by pandas in bulk; equal values hash equally whatever their position
+# and whatever the dtype of their series, as they compare equal for isin(): numbers (and booleans) are hashed as
+# float64, so that e.g. an int64 master and a column that is float64 because it has a blank agree, and every blank
+# hashes alike.  Numbers too large for a float64 to tell apart hash alike, which sketches allow for as collisions.
+# Each sketch has an add_hashes() as well as add(), so that several sketches of the same values need only hash them once
+def hash_values(series):
+    if pd.api.types.is_bool_dtype(series.dtype) or pd.api.types.is_numeric_dtype(series.dtype):
+        h = hash_series(series.astype('float64'))
+    elif series.dtype == object:
+        numbers = np.fromiter((isinstance(value, number_types) for value in series), dtype=bool, count=len(series))
+        h = hash_series(series.where(~numbers))
+        if numbers.any():
+            h[numbers] = hash_series(series[numbers].astype('float64'))
+    else:
+        h = hash_series(series)
+    h[series.isna().to_numpy()] = blank_hash
+    return h
+
+
+def hash_series(series):
+    return pd.util.hash_pandas_object(series, index=False, categorize=False).to_numpy(dtype=np.uint64).copy()
+
+
+# a second 64 bit hash, derived from the first by the splitmix64 finaliser
+def rehash(h):
+    with np.errstate(over='ignore'):
+        h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        return h ^ (h >> np.uint64(31))
+
+
+# the positions of each hash in each of k tables of the given width, from two independent hashes combined as
+# h1 + i * h2 (so-called double hashing); arithmetic wraps at 64 bits, as intended
+def hash_positions(h1, k, width):
+    h2 = rehash(h1) | np.uint64(1)
+    with np.errstate(over='ignore'):
+        return [((h1 + np.uint64(i) * h2) % np.uint64(width)).astype(np.int64) for i in range(k)]
+
+
+# the number of leading zero bits in each of an array of uint64
+def leading_zeros(x):
+    zeros = np.zeros(len(x), dtype=np.uint8)
+    x = x.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        small = x < (np.uint64(1) << np.uint64(64 - shift))
+        zeros[small] += shift
+        x[small] <<= np.uint64(shift)
+    zeros[x == 0] = 64
+    return zeros
+
+
+# A HyperLogLog sketch of the number of distinct values seen, in a fixed 2**precision bytes whatever the number of
+# values; the standard error of the estimate is about 1.04 / sqrt(2**precision), i.e. 1.6% at the default precision.
+# Sketches of the same precision can be merged, e.g. to count the distinct values across several chunks or objects.
+class HyperLogLog:
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else np.zeros(self.m, dtype=np.uint8)
+
+    def add(self, series):
+        return self.add_hashes(hash_values(series.dropna()))
+
+    def add_hashes(self, h):
+        index = (h >> np.uint64(64 - self.precision)).astype(np.int64)
+        rank = np.minimum(leading_zeros(h << np.uint64(self.precision)), 64 - self.precision) + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+        return self
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        return int(round(self.estimate_and_regime()[0]))
+
+    # the standard error of estimate(): that of linear counting while the small range correction applies, otherwise
+    # HyperLogLog's 1.04 / sqrt(m) of the estimate
+    def standard_error(self):
+        estimate, linear_counting = self.estimate_and_regime()
+        if linear_counting:
+            t = estimate / self.m
+            return math.sqrt(self.m * (math.exp(t) - t - 1))
+        return 1.04 * estimate / math.sqrt(self.m)
+
+    # the (unrounded) estimate, and whether it came from the small range correction (linear counting)
+    def estimate_and_regime(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        empty = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and empty > 0:      # small range correction
+            return self.m * np.log(self.m / empty), True
+        return estimate, False
+
+    # a compact, JSON-friendly representation, see from_string
+    def to_string(self):
+        return '{}:{}'.format(self.precision, base64.b64encode(self.registers.tobytes()).decode('ascii'))
+
+    @classmethod
+    def from_string(cls, s):
+        precision, registers = s.split(':', 1)
+        return cls(int(precision), np.frombuffer(base64.b64decode(registers), dtype=np.uint8).copy())
+
+
+# A Bloom filter: a set of values in a fixed number of bits, sized for capacity distinct values, which answers
+# membership with no false negatives and false positives at (up to capacity) about error_rate
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(int(capacity), 1)
+        self.m = max(1024, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.k = max(1, int(round(-math.log2(error_rate))))
+        self.bits = np.zeros((self.m + 7) // 8, dtype=np.uint8)
+
+    def add(self, series):
+        return self.add_hashes(hash_values(series))
+
+    def add_hashes(self, h):
+        bits = np.unpackbits(self.bits, count=self.m, bitorder='little').view(bool)
+        for position in hash_positions(h, self.k, self.m):
+            bits[position] = True
+        self.bits = np.packbits(bits, bitorder='little')
+        return self
+
+    # a boolean array, True where a value of the series may be in the set and False where it certainly is not
+    def contains(self, series):
+        return self.contains_hashes(hash_values(series))
+
+    def contains_hashes(self, h):
+        found = np.ones(len(h), dtype=bool)
+        for position in hash_positions(h, self.k, self.m):
+            found &= ((self.bits[position >> 3] >> (position & 7)) & 1).astype(bool)
+        return found
+
+
+# A count-min sketch: approximate counts of values in a fixed depth x width table of counters.  Counts are never
+# under-estimated, and (with probability 1 - delta) over-estimated by at most epsilon x the number of values added
+class CountMinSketch:
+
+    def __init__(self, epsilon=0.001, delta=0.01):
+        self.width = int(math.ceil(math.e / epsilon))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.counts = np.zeros((self.depth, self.width), dtype=np.int64)
+        self.total = 0
+
+    def add(self, series):
+        return self.add_hashes(hash_values(series))
+
+    def add_hashes(self, h):
+        for row, position in enumerate(hash_positions(h, self.depth, self.width)):
+            self.counts[row] += np.bincount(position, minlength=self.width)
+        self.total += len(h)
+        return self
+
+    def estimate(self, series):
+        return self.estimate_hashes(hash_values(series))
+
+    def estimate_hashes(self, h):
+        positions = hash_positions(h, self.depth, self.width)
+        return np.min([self.counts[row][position] for row, position in enumerate(positions)], axis=0)
@@ -0,0 +1,179 @@
+import copy
+import hashlib
+import json
+import string
+import threading
+import types
+
+# Declarative validation specs.  A spec is the JSON (or YAML) form of a validation list, naming its scoring functions
+# rather than referring to them, e.g.
+#
+#   {"checks": [
+#       {"object": "daqual/accounts-{business_date}.csv", "check": "score_unique_column",
+#        "params": {"column": "Account Number"}},
+#       {"object": "daqual/accounts-{business_date}.csv", "check": "score_row_count",
+#        "params": {"comparison": "daqual/accounts-{previous_business_date}.csv", "expected_delta": ">="},
+#        "weight": 2, "threshold": 0.5},
+#       {"object": "daqual/accounts-{previous_business_date}.csv", "check": "score_1"}
+#   ]}
+#
+# (a bare list of checks will do too).  weight and threshold default to 1, and params to none.  Object keys and string
+# parameters (other than 'match' regexes) are templates for str.format(), filled in for each run, e.g. for each
+# business date (see backfill.py).
+#
+# compile_spec() resolves and checks a spec once - every scoring function exists, has the parameters it needs, and every
+# master or comparison object it refers to is itself in the spec - into an immutable CompiledSpec, which then produces
+# a fresh validation list for each set of template values.  A CompiledSpec's params are frozen all the way down (dicts
+# as read-only mappings, lists as tuples, see frozen), and thawed into plain dicts and lists in each validation list.
+# Compiled specs are cached by the fingerprint of the spec, so compiling the same spec again (e.g. on every run of a
+# job) costs no more than computing its fingerprint.
+
+
+class CompiledSpec:
+
+    def __init__(self, checks, fields, fingerprint):
+        object.__setattr__(self, 'checks', checks)          # tuple of (object, function, params, weight, threshold)
+        object.__setattr__(self, 'fields', fields)          # the template fields used, e.g. {'business_date'}
+        object.__setattr__(self, 'fingerprint', fingerprint)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('a CompiledSpec is immutable')
+
+    def __len__(self):
+        return len(self.checks)
+
+    # a validation list for Daqual.validate_objects, with the templates filled in from values; each call returns new
+    # lists and params, so nothing a run does to them can affect the spec or another run
+    def validation_list(self, values=None):
+        values = values or {}
+        missing = self.fields - set(values)
+        if missing:
+            raise ValueError('No values given for the spec fields {}'.format(sorted(missing)))
+        return [[fill(object_key, values), scoring_function,
+                 {k: fill(v, values) if k != 'match' else thawed(v) for k, v in params.items()},
+                 weight, threshold]
+                for object_key, scoring_function, params, weight, threshold in self.checks]
+
+    # {object key: the object's template} for the validation list of the same values, e.g. for recording results
+    # against the template (see validate_objects' object_names)
+    def object_names(self, values=None):
+        return {fill(check[0], values or {}): check[0] for check in self.checks}
+
+
+# compiled specs, by fingerprint
+compiled_specs = {}
+compiled_specs_lock = threading.Lock()
+
+
+# compile a spec (as loaded by load_spec, or a list or dict of the same shape); functions maps the names of any custom
+# scoring functions to the functions themselves, and the score_* functions of daqual.py are always available.  Raises
+# ValueError, naming the check, if the spec is not valid
+def compile_spec(spec, functions=None):
+    functions = dict(scoring_functions(), **(functions or {}))
+    checks = spec['checks'] if isinstance(spec, dict) else spec
+    fingerprint = spec_fingerprint(checks, functions)
+    with compiled_specs_lock:
+        if fingerprint in compiled_specs:
+            return compiled_specs[fingerprint]
+
+    compiled = []
+    fields = set()
+    for n, check in enumerate(checks):
+        compiled.append(compile_check(n, check, functions, fields))
+    objects = {check[0] for check in compiled}
+    for n, (object_key, scoring_function, params, weight, threshold) in enumerate(compiled):
+        for role in ('master', 'comparison'):
+            if isinstance(params.get(role), str) and params[role] not in objects:
+                raise ValueError("Check {} ({} of {}): its {} {} is not an object of the spec; add a check of it, "
+                                 "e.g. score_1".format(n, scoring_function.__name__, object_key, role, params[role]))
+
+    result = CompiledSpec(tuple(compiled), frozenset(fields), fingerprint)
+    with compiled_specs_lock:
+        return compiled_specs.setdefault(fingerprint, result)
+
+
+def compile_check(n, check, functions, fields):
+    unknown = set(check) - {'object', 'check', 'params', 'weight', 'threshold'}
+    if unknown or 'object' not in check or 'check' not in check:
+        raise ValueError("Check {}: expected object, check and optionally params, weight and threshold; got {}".format(
+            n, sorted(check)))
+    name = check['check']
+    if name not in functions:
+        raise ValueError("Check {}: unknown scoring function {}".format(n, name))
+    scoring_function = functions[name]
+    params = dict(check.get('params') or {})
+    weight, threshold = check.get('weight', 1), check.get('threshold', 1)
+    for value in (weight, threshold):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError("Check {} ({}): weight and threshold must be numbers".format(n, name))
+
+    from .daqual import column_requirements
+    if scoring_function in column_requirements:
+        try:
+            column_requirements[scoring_function](check['object'], params)
+        except KeyError as e:
+            raise ValueError("Check {} ({}): missing parameter {}".format(n, name, e)) from None
+
+    fields.update(template_fields(check['object']))
+    for k, v in params.items():
+        if k != 'match':
+            fields.update(template_fields(v))
+    return (check['object'], scoring_function, frozen(params), weight, threshold)
+
+
+# load a spec from a .json, .yaml or .yml file (YAML needs PyYAML)
+def load_spec(filename):
+    with open(filename) as f:
+        if filename.endswith(('.yaml', '.yml')):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+# the score_* functions of daqual.py, by name
+def scoring_functions():
+    from . import daqual
+    return {name: value for name, value in vars(daqual).items() if name.startswith('score_') and callable(value)}
+
+
+# the fingerprint of a spec and the functions its checks name; functions are identified by object as well as by name,
+# since closures and lambdas share a qualname (the compiled spec cached under the fingerprint holds on to them, so
+# their ids cannot be reused by other functions while it is cached)
+def spec_fingerprint(checks, functions):
+    names = {check.get('check') for check in checks if isinstance(check, dict)}
+    identities = {name: '{}.{}@{}'.format(getattr(functions.get(name), '__module__', None),
+                                          getattr(functions.get(name), '__qualname__', None),
+                                          id(functions.get(name))) for name in names}
+    canonical = json.dumps([checks, identities], sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+def template_fields(value):
+    if not isinstance(value, str):
+        return set()
+    try:
+        return {field.split('.')[0].split('[')[0] for _, field, _, _ in string.Formatter().parse(value) if field}
+    except ValueError as e:
+        raise ValueError("Invalid template {}: {}".format(value, e)) from None
+
+
+def fill(value, values):
+    return value.format(**values) if isinstance(value, str) else thawed(value)
+
+
+# a read-only copy of a params value: dicts become read-only mappings and lists tuples, all the way down
+def frozen(value):
+    if isinstance(value, dict):
+        return types.MappingProxyType({k: frozen(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(frozen(v) for v in value)
+    return copy.deepcopy(value)
+
+
+# a plain, mutable copy of a frozen params value: read-only mappings become dicts and tuples lists
+def thawed(value):
+    if isinstance(value, types.MappingProxyType):
+        return {k: thawed(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thawed(v) for v in value]
+    return copy.deepcopy(value)
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+# A folder of JSON records, one per object, each for a single version (fingerprint) of the object - the storage shared
+# by SummaryStore and ProfileStore.  Records are written atomically, so a reader never sees half a record, and an
+# unreadable record is logged and treated as missing.  Subclasses name their records (kind, suffix), and may:
+#   merge  - combine a new record with the one already held for the same version of the object
+#   encode - turn a record into something JSON can hold, and decode to turn it back
+class ObjectStore:
+
+    kind = 'record'
+    suffix = '.json'
+
+    def __init__(self, folder):
+        self.folder = folder
+        pathlib.Path(folder).mkdir(parents=True, exist_ok=True)
+
+    def filename(self, object_key):
+        return os.path.join(self.folder, hashlib.sha1(object_key.encode('utf-8')).hexdigest() + self.suffix)
+
+    def get(self, object_key):
+        try:
+            with open(self.filename(object_key), 'r') as f:
+                return self.decode(json.load(f))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable {} for {}: {}".format(self.kind, object_key, e))
+            return None
+
+    # store a record, merging it with any record already held for the same version of the object
+    def put(self, object_key, record):
+        existing = self.get(object_key)
+        if existing is not None and existing['fingerprint'] == record['fingerprint']:
+            record = self.merge(existing, record)
+        filename = self.filename(object_key)
+        temp_filename = '{}.{}.tmp'.format(filename, uuid.uuid4().hex)
+        with open(temp_filename, 'w') as f:
+            json.dump(dict(self.encode(record), object_key=object_key), f, default=str)   # e.g. dates as ISO strings
+        os.replace(temp_filename, filename)
+
+    def merge(self, existing, record):
+        return record
+
+    def encode(self, record):
+        return record
+
+    def decode(self, record):
+        return record
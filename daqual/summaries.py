@@ -0,0 +1,65 @@
+import json
+
+import pandas as pd
+
+from .stores import ObjectStore
+
+
+# A persistent store of per-object summaries, so that an object which is only needed as the "previous version" in a
+# comparison (score_row_count, or score_comparison with a groupby) need not be retrieved and parsed again: the summary
+# recorded when that object was last validated is used instead (see Daqual.summarised_objects).  Summaries are kept as
+# JSON (see stores.py), so a summary folder holds nothing that runs code when read.
+#
+# A summary is a dict of:
+#   fingerprint  - the fingerprint of the object version summarised; a summary is only used while this still matches
+#   row_count    - the number of rows
+#   columns      - the object's column names
+#   bases        - {comparison spec: DataFrame}, the grouped and aggregated column that score_comparison compares
+#                  against, for each grouped comparison spec the object was the subject of; comparisons without a
+#                  groupby need every row, so aren't summarised.  Bases are stored as their rows and dtypes (see
+#                  basis_to_json)
+class SummaryStore(ObjectStore):
+
+    kind = 'summary'
+    suffix = '.summary.json'
+
+    def merge(self, existing, summary):
+        return dict(summary, bases=dict(existing['bases'], **summary['bases']))
+
+    def encode(self, summary):
+        return dict(summary, bases={spec: basis_to_json(basis) for spec, basis in summary['bases'].items()})
+
+    def decode(self, summary):
+        return dict(summary, bases={spec: basis_from_json(basis) for spec, basis in summary['bases'].items()})
+
+
+# the key under which a comparison's basis is kept in a summary: it depends on the column compared, any groupby and
+# any keys
+def comparison_spec(p):
+    spec = {'column': p['column'], 'groupby': p.get('groupby')}
+    if p.get('keys'):
+        spec['keys'] = list(p['keys'])
+    return json.dumps(spec, sort_keys=True)
+
+
+# a comparison basis as a JSON-friendly dict of its group key names, the dtypes of its columns (keys first) and its
+# rows; Python's JSON keeps every float exactly, so that '=' comparisons against a stored basis are unchanged
+def basis_to_json(basis):
+    flat = basis.reset_index()
+    return {'index': list(basis.index.names), 'dtypes': {column: str(dtype) for column, dtype in flat.dtypes.items()},
+            'data': flat.to_dict('split')['data']}
+
+
+def basis_from_json(basis):
+    flat = pd.DataFrame(basis['data'], columns=list(basis['dtypes'])).astype(basis['dtypes'])
+    return flat.set_index(basis['index'])
+
+
+# can a score_comparison with these params be answered from a summary?  Only if it compares aggregated groups
+def summarisable(p):
+    return (p.get('groupby') or {}).get('aggregation') is not None
+
+
+# summarise a (possibly column-projected) dataframe; bases are added by the caller
+def summarise(df, columns, fingerprint):
+    return {'fingerprint': fingerprint, 'row_count': len(df), 'columns': list(columns), 'bases': {}}
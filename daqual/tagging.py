@@ -0,0 +1,103 @@
+import concurrent.futures
+import logging
+import threading
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+
+# Writes tags (e.g. quality scores) to S3 objects.
+#
+# Writes use the client of the given session (see s3.py), or a single client created on first use.  Tags that a
+# version of an object is already known to carry (because this tagger read or wrote them for the same fingerprint,
+# e.g. ETag) are not written again, and neither are tags that turn out to match what is stored when the object's tags
+# are read - which they always are when no fingerprint is given, since a re-uploaded object loses its tags.  Writes for
+# several objects run concurrently on up to max_workers threads.
+#
+# With deferred=True tags are only collected by tag() and tag_many(), and are all written by flush(); this suits large
+# sets, or several validations in a row, where the writes can be made in bulk at the end.
+class S3Tagger:
+
+    def __init__(self, client=None, max_workers=8, deferred=False, session=None):
+        self._client = client
+        self.session = session
+        self.max_workers = max_workers
+        self.deferred = deferred
+        self.pending = {}       # objectkey: (fingerprint, {tag: value}), waiting for flush()
+        self.known = {}         # objectkey: (fingerprint, the TagSet we last read or wrote for it, as a dict)
+        self.writes = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self.session is not None:
+            return self.session.client
+        with self.lock:
+            if self._client is None:
+                self._client = boto3.client('s3')
+            return self._client
+
+    # tag a single object, optionally given the fingerprint of the version being tagged
+    def tag(self, objectkey, tag, value, fingerprint=None):
+        self.tag_many({objectkey: {tag: value}}, {objectkey: fingerprint})
+
+    # tag several objects, given as a dict of objectkey: {tag: value}, and optionally a dict of objectkey: fingerprint
+    def tag_many(self, tags, fingerprints=None):
+        fingerprints = fingerprints or {}
+        tags = {objectkey: (fingerprints.get(objectkey), {tag: str(value) for tag, value in object_tags.items()})
+                for objectkey, object_tags in tags.items()}
+        if self.deferred:
+            with self.lock:
+                for objectkey, (fingerprint, object_tags) in tags.items():
+                    pending = self.pending.get(objectkey, (None, {}))[1]
+                    self.pending[objectkey] = (fingerprint, dict(pending, **object_tags))
+            return
+        self.write_many(tags)
+
+    # write every deferred tag
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        self.write_many(pending)
+
+    def write_many(self, tags):
+        if len(tags) <= 1 or self.max_workers <= 1:
+            for objectkey, (fingerprint, object_tags) in tags.items():
+                self.write(objectkey, object_tags, fingerprint)
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.max_workers, len(tags))) as executor:
+            for future in [executor.submit(self.write, objectkey, object_tags, fingerprint)
+                           for objectkey, (fingerprint, object_tags) in tags.items()]:
+                future.result()
+
+    # merge tags into an object's existing tags, skipping the round trip(s) if nothing would change
+    def write(self, objectkey, tags, fingerprint=None):
+        bucket, s3_objectkey = objectkey.split('/', 1)
+        with self.lock:
+            known_fingerprint, known = self.known.get(objectkey, (None, None))
+        if fingerprint is not None and known_fingerprint == fingerprint and \
+                all(known.get(tag) == value for tag, value in tags.items()):
+            self.count_skipped()
+            return
+
+        client = self.client
+        existing = {t['Key']: t['Value']
+                    for t in client.get_object_tagging(Bucket=bucket, Key=s3_objectkey)['TagSet']}
+        if all(existing.get(tag) == value for tag, value in tags.items()):
+            with self.lock:
+                self.known[objectkey] = (fingerprint, existing)
+            self.count_skipped()
+            return
+
+        merged = dict(existing, **tags)
+        client.put_object_tagging(Bucket=bucket, Key=s3_objectkey,
+                                  Tagging={'TagSet': [{'Key': k, 'Value': v} for k, v in merged.items()]})
+        with self.lock:
+            self.known[objectkey] = (fingerprint, merged)
+            self.writes += 1
+
+    def count_skipped(self):
+        with self.lock:
+            self.skipped += 1
@@ -1,4 +1,10 @@
-import daqual
+# An example of using daqual; run it from this folder, as python test.py.  The daqual package is imported from the
+# folder above, rather than this folder's daqual.py as a module of its own, since the package's modules import each
+# other relatively
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from daqual import daqual
 
 import logging
 logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s', level=logging.INFO)
@@ -47,7 +53,7 @@ logger = logging.getLogger(__name__)
 
 
 # a function to look through String objects in the validation list and pre-process them according
-# to str.format() rules
+# to str.format() rules, returning a new list (see also specs.py, which compiles such lists once for reuse)
 def custom_transformer(validation_list, kwargs):
     output_list = []
 
@@ -58,10 +64,11 @@ def custom_transformer(validation_list, kwargs):
                 replacement_jitem = jitem.format(**kwargs)
                 output_jitems.append(replacement_jitem)
             elif type(jitem) == dict:
+                replacement_jitem = dict(jitem)     # leave the original list's params untouched
                 for k in jitem.keys():
                     if k != 'match' and type(jitem.get(k)) == str:
-                        jitem[k] = jitem.get(k).format(**kwargs)
-                output_jitems.append(jitem)
+                        replacement_jitem[k] = jitem.get(k).format(**kwargs)
+                output_jitems.append(replacement_jitem)
             else:
                 output_jitems.append(jitem)
         output_list.append(output_jitems)
@@ -1,7 +1,922 @@
 import daqual
+from daqual import daqual as dq
+import pandas as pd
+import time
+import threading
+import warnings
+import itertools
+import logging
+import os
+import json
+import re
+import numpy as np
+import pytest
+from daqual.sketches import HyperLogLog, BloomFilter, CountMinSketch
+from daqual.approximate import ApproximateUniqueness
+
 
 def test_an_example_test():
     assert 1==1
 
 
-daqual.Daqual
\ No newline at end of file
+daqual.Daqual
+
+
+# a Daqual instance with some dataframes already in place, as if validate_objects had retrieved them
+def instance_with(**dataframes):
+    d = daqual.Daqual(daqual.Daqual.file_system_provider)
+    for object_name, df in dataframes.items():
+        d.object_list[object_name] = {'dataframe': df}
+    return d
+
+
+def test_score_column_valid_values():
+    d = instance_with(t=pd.DataFrame({'account': ['A-1', 'A-2', 'A-9', 'A-9', None]}),
+                      m=pd.DataFrame({'Account Number': ['A-1', 'A-2', 'A-3']}))
+    p = {'column': 'account', 'master': 'm', 'master_column': 'Account Number'}
+    assert dq.score_column_valid_values(d, 't', p) == 2/5
+    assert d.object_list['t']['exceptions']['score_column_valid_values']['account']['A-9'] == 2
+    assert d.get_invalid_values('t', p).sum() == 3
+
+
+def test_score_every_master_value_used():
+    d = instance_with(t=pd.DataFrame({'account': ['A-1', 'A-1', 'A-2']}),
+                      m=pd.DataFrame({'Account Number': ['A-1', 'A-2', 'A-3', 'A-4']}))
+    p = {'column': 'account', 'master': 'm', 'master_column': 'Account Number'}
+    assert dq.score_every_master_value_used(d, 't', p) == 0.5
+    assert sorted(d.get_unused_master_values('t', p).index) == ['A-3', 'A-4']
+
+
+# a provider which serves dataframes from memory, optionally slowly
+def memory_provider(frames, delay=0):
+    def retrieve(self, objectkey):
+        time.sleep(delay)
+        if objectkey not in frames:
+            return (0, None)
+        return (1, frames[objectkey])
+    return {'retrieve': retrieve, 'tag': daqual.Daqual.qnothing}
+
+
+def test_retrieve_objects_concurrently():
+    frames = {k: pd.DataFrame({'a': [1, 2]}) for k in 'abcd'}
+    barrier = threading.Barrier(4, timeout=10)     # only passed if all four retrievals are in flight at once
+
+    def retrieve(self, objectkey):
+        barrier.wait()
+        return (1, frames[objectkey])
+
+    d = daqual.Daqual({'retrieve': retrieve, 'tag': daqual.Daqual.qnothing}, max_concurrency=4)
+    quality, results = d.validate_objects([[k, dq.score_row_count, {'expected_rows': 2}, 1, 1] for k in 'abcd'])
+    assert quality == 1
+    assert list(results) == list('abcd')
+
+
+def test_retrieve_objects_fails_the_set(caplog):
+    d = daqual.Daqual(memory_provider({'a': pd.DataFrame({'a': [1]})}))
+    assert d.validate_objects([['a', dq.score_1, {}, 1, 1], ['missing', dq.score_1, {}, 1, 1]]) == 0
+    assert 'Could not retrieve object missing' in caplog.text
+
+
+def test_retrieve_objects_timeout():
+    d = daqual.Daqual(memory_provider({'a': pd.DataFrame({'a': [1]})}, delay=0.5), retrieve_timeout=0.05)
+    assert d.retrieve_objects(['a']) is None
+
+
+def test_retrieve_timeout_runs_from_the_start_of_each_retrieval():
+    frames = {'a': pd.DataFrame({'a': [1]}), 'b': pd.DataFrame({'a': [1]})}
+
+    def retrieve(self, objectkey):
+        time.sleep(0.6 if objectkey == 'a' else 1.0)
+        return (1, frames[objectkey])
+
+    # b starts alongside a, so its 0.8 seconds are up before it finishes, however long we were waiting for a
+    d = daqual.Daqual({'retrieve': retrieve, 'tag': daqual.Daqual.qnothing}, retrieve_timeout=0.8)
+    assert d.retrieve_objects(['a', 'b']) is None
+
+
+def filesystem_provider():
+    return dict(daqual.Daqual.file_system_provider, file_system_provider_root='examples/')
+
+
+# a copy of a provider which also notes the key of every object it retrieves, and the list it notes them in
+def counting_provider(provider):
+    retrieved = []
+
+    def retrieve(self, objectkey, **kwargs):
+        retrieved.append(objectkey)
+        return provider['retrieve'](self, objectkey, **kwargs)
+
+    return dict(provider, retrieve=retrieve), retrieved
+
+
+def test_filesystem_retrieval_does_not_copy_files():
+    d = daqual.Daqual(filesystem_provider())
+    score, df = d.provider['retrieve'](d, 'daqual/iso-currencies.csv')
+    assert score == 1 and len(df) == 279
+    tempfilename = d.temp_filename('daqual/iso-currencies.csv')
+    assert not os.path.exists(tempfilename)
+    assert d.get_file('daqual/iso-currencies.csv') == tempfilename
+    assert os.path.exists(tempfilename)
+
+    legacy = daqual.Daqual({'retrieve': daqual.Daqual.retrieve_object_from_filesystem, 'tag': None})
+    assert legacy.get_file('daqual/iso-currencies.csv') == legacy.temp_filename('daqual/iso-currencies.csv')
+
+
+def test_dataframe_cache_evicts_least_recently_used():
+    df = pd.DataFrame({'a': range(100)})
+    size = df.memory_usage(deep=True).sum()
+    cache = daqual.DataFrameCache(max_bytes=2 * size)
+    cache.put('a', '1', df)
+    cache.put('b', '1', df)
+    assert cache.get('a', '1') is df
+    cache.put('c', '1', df)
+    assert cache.get('b', '1') is None
+    assert cache.get('a', '1') is df and cache.get('c', '1') is df
+    assert cache.get('a', '2') is None
+
+
+def test_dataframe_cache_on_disk_is_shared(tmp_path):
+    pytest.importorskip('pyarrow')
+    cache_folder = str(tmp_path / 'cache')
+    d = daqual.Daqual(filesystem_provider(), cache=daqual.DataFrameCache(folder=cache_folder))
+    assert d.load_object('daqual/iso-currencies.csv')[0] == 1
+    other = daqual.DataFrameCache(folder=cache_folder)
+    df = other.get('daqual/iso-currencies.csv', d.fingerprints['daqual/iso-currencies.csv'])
+    assert len(df) == 279 and other.hits == 1
+    pd.testing.assert_frame_equal(df, d.load_object('daqual/iso-currencies.csv')[1])
+    assert [f.endswith('.arrow') for f in os.listdir(cache_folder)] == [True]
+
+
+def test_filesystem_fingerprint_changes_with_the_file(tmp_path):
+    d = daqual.Daqual(dict(daqual.Daqual.file_system_provider, file_system_provider_root=str(tmp_path) + '/'))
+    (tmp_path / 'a.csv').write_text('a\n1\n')
+    before = d.provider['fingerprint'](d, 'a.csv')
+    assert d.provider['fingerprint'](d, 'a.csv') == before
+    (tmp_path / 'a.csv').write_text('a\n22\n')
+    assert d.provider['fingerprint'](d, 'a.csv') != before
+
+
+@pytest.mark.parametrize('format', ['feather', 'parquet'])
+def test_columnar_cache(tmp_path, format):
+    pytest.importorskip('pyarrow')
+    columnar_cache = daqual.ColumnarCache(str(tmp_path), format=format)
+    provider = dict(filesystem_provider(), columnar_cache=columnar_cache)
+    first = daqual.Daqual(provider).load_object('daqual/iso-currencies.csv')[1]
+    second = daqual.Daqual(provider).load_object('daqual/iso-currencies.csv')[1]
+    assert columnar_cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0}
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_columnar_cache_eviction(tmp_path):
+    pytest.importorskip('pyarrow')
+    columnar_cache = daqual.ColumnarCache(str(tmp_path), max_bytes=1)
+    columnar_cache.put('abc', pd.DataFrame({'a': [1, 2, 3]}))
+    assert columnar_cache.get('abc') is None
+    assert columnar_cache.stats()['evictions'] == 1
+
+
+currencies = [
+    ['daqual/iso-currencies.csv', dq.score_column_count, {"expected_columns": 5}, 1, 1],
+    ['daqual/iso-currencies.csv', dq.score_row_count, {"expected_rows": 279}, 1, 1],
+    ['daqual/iso-currencies.csv', dq.score_column_names, {"columns": ['ENTITY', 'Currency', 'Alphabetic Code',
+                                                                      'Numeric Code', 'Minor unit']}, 1, 1],
+    ['daqual/iso-currencies.csv', dq.score_column_format, {"column": "Alphabetic Code", 'match': '^$|[A-Z]{3}'}, 1, 1]
+]
+
+
+def test_only_required_columns_are_loaded():
+    d = daqual.Daqual(dict(filesystem_provider(), tag=daqual.Daqual.qnothing))
+    assert d.required_columns(currencies) == {'daqual/iso-currencies.csv': {'Alphabetic Code'}}
+    quality, results = d.validate_objects(currencies)
+    assert quality == 1
+    assert results['daqual/iso-currencies.csv']['loaded_columns'] == ['Alphabetic Code']
+
+    d = daqual.Daqual(dict(filesystem_provider(), tag=daqual.Daqual.qnothing), projection=False)
+    quality, results = d.validate_objects(currencies)
+    assert quality == 1
+    assert len(results['daqual/iso-currencies.csv']['loaded_columns']) == 5
+
+
+def test_custom_scoring_functions_get_every_column_of_their_master():
+    def score_currencies_in_master(self, object_name, p):
+        master = self.get_dataframe(p['master'])['Alphabetic Code']
+        return self.get_dataframe(object_name)['Currency'].isin(master).mean()
+
+    accounts, currencies = 'daqual/accounts-20190301.csv', 'daqual/iso-currencies.csv'
+    validation_list = [[currencies, dq.score_column_format, {'column': 'ENTITY', 'match': '.'}, 1, 1],
+                       [accounts, score_currencies_in_master, {'master': currencies}, 1, 1]]
+    d = daqual.Daqual(dict(filesystem_provider(), tag=daqual.Daqual.qnothing))
+    assert d.required_columns(validation_list) == {}
+    quality, results = d.validate_objects(validation_list)
+    assert quality == 1 and len(results[currencies]['loaded_columns']) == 5
+
+
+def test_chunked_validation_matches_in_memory(tmp_path):
+    (tmp_path / 'b').mkdir()
+    pd.DataFrame({'account': ['A-1', 'A-2', 'A-9', None, 'A-1'] * 7,
+                  'amount': [1.5, None, 3.0, 4.0, 5.0] * 7}).to_csv(tmp_path / 'b' / 't.csv', index=False)
+    pd.DataFrame({'Account Number': ['A-1', 'A-2', 'A-3']}).to_csv(tmp_path / 'b' / 'm.csv', index=False)
+    validation_list = [
+        ['b/m.csv', dq.score_unique_column, {'column': 'Account Number'}, 1, 1],
+        ['b/t.csv', dq.score_column_count, {'expected_columns': 2}, 1, 1],
+        ['b/t.csv', dq.score_row_count, {'expected_rows': 40}, 1, 1],
+        ['b/t.csv', dq.score_no_blanks, {'column': 'amount'}, 1, 0],
+        ['b/t.csv', dq.score_unique_column, {'column': 'account'}, 1, 0],
+        ['b/t.csv', dq.score_column_format, {'column': 'account', 'match': 'A-[12]'}, 1, 0],
+        ['b/t.csv', dq.score_column_valid_values,
+         {'column': 'account', 'master': 'b/m.csv', 'master_column': 'Account Number'}, 2, 0],
+    ]
+    provider = dict(daqual.Daqual.file_system_provider, file_system_provider_root=str(tmp_path) + '/',
+                    tag=daqual.Daqual.qnothing)
+    in_memory = daqual.Daqual(provider)
+    quality, results = in_memory.validate_objects(validation_list)
+    chunked = daqual.Daqual(provider)
+    chunked_quality, chunked_results = chunked.validate_objects(validation_list, chunksize=4)
+    assert chunked.streamable_objects(validation_list) == ['b/t.csv']
+    assert 'dataframe' not in chunked_results['b/t.csv']
+    assert chunked_quality == quality
+    for object_key in results:
+        assert chunked_results[object_key]['quality'] == results[object_key]['quality']
+    assert chunked_results['b/t.csv']['exceptions'] == results['b/t.csv']['exceptions']
+
+
+def test_chunked_validation_is_independent_of_each_chunk_s_dtypes(tmp_path):
+    (tmp_path / 'b').mkdir()
+    with open(tmp_path / 'b' / 't.csv', 'w') as f:        # code is all digits in the first chunk, but not the second
+        f.write('code,id,account\n001,001,1\n2,1,2\n3,2,9\n4,3,2\nx5,4,1\n1,5,3\n001,6,\n')
+    pd.DataFrame({'code': ['001', '2', '1', 'x5'], 'account': [1, 2, 3, 4]}).to_csv(tmp_path / 'b' / 'm.csv',
+                                                                                      index=False)
+    validation_list = [
+        ['b/m.csv', dq.score_1, {}, 1, 1],
+        ['b/t.csv', dq.score_column_format, {'column': 'code', 'match': r'\d+$'}, 1, 0],
+        ['b/t.csv', dq.score_unique_column, {'column': 'code'}, 1, 0],
+        ['b/t.csv', dq.score_unique_column, {'column': 'id'}, 1, 0],
+        ['b/t.csv', dq.score_column_valid_values, {'column': 'code', 'master': 'b/m.csv', 'master_column': 'code'},
+         1, 0],
+        ['b/t.csv', dq.score_column_valid_values,
+         {'column': 'account', 'master': 'b/m.csv', 'master_column': 'account'}, 1, 0],
+    ]
+    provider = dict(daqual.Daqual.file_system_provider, file_system_provider_root=str(tmp_path) + '/',
+                    tag=daqual.Daqual.qnothing)
+    quality, results = daqual.Daqual(provider).validate_objects(validation_list)
+    chunked = daqual.Daqual(provider)
+    chunked_quality, chunked_results = chunked.validate_objects(validation_list, chunksize=4)
+    assert chunked.streamable_objects(validation_list) == ['b/t.csv']
+    assert results['b/t.csv']['quality'] == (6/7 + 0 + 0 + 5/7 + 5/7) / 5
+    assert chunked_results['b/t.csv']['quality'] == results['b/t.csv']['quality']
+    assert repr(chunked_results['b/t.csv']['exceptions']) == repr(results['b/t.csv']['exceptions'])  # nan != nan
+
+
+def test_chunked_validation_reads_boolean_columns_as_booleans(tmp_path):
+    pd.DataFrame({'flag': ['True'] * 10 + ['False'], 'maybe': ['true', None] * 5 + ['FALSE']}).to_csv(
+        tmp_path / 't.csv', index=False)
+    pd.DataFrame({'flag': [True, False]}).to_csv(tmp_path / 'm.csv', index=False)
+    validation_list = [['m.csv', dq.score_1, {}, 1, 1]] + [
+        ['t.csv', dq.score_column_valid_values, {'column': column, 'master': 'm.csv', 'master_column': 'flag'}, 1, 0]
+        for column in ('flag', 'maybe')]
+    provider = dict(daqual.Daqual.file_system_provider, file_system_provider_root=str(tmp_path) + '/',
+                    tag=daqual.Daqual.qnothing)
+    quality, results = daqual.Daqual(provider).validate_objects(validation_list)
+    chunked_quality, chunked_results = daqual.Daqual(provider).validate_objects(validation_list, chunksize=4)
+    assert results['t.csv']['quality'] == (1 + 6/11) / 2
+    assert chunked_results['t.csv']['quality'] == results['t.csv']['quality']
+    assert repr(chunked_results['t.csv']['exceptions']) == repr(results['t.csv']['exceptions'])
+
+
+def test_identical_checks_log_as_if_each_was_scored(caplog):
+    frames = {'t': pd.DataFrame({'account': ['A-1', 'A-9']}), 'm': pd.DataFrame({'Account Number': ['A-1']})}
+    p = {'column': 'account', 'master': 'm', 'master_column': 'Account Number'}
+    validation_list = [['m', dq.score_1, {}, 1, 1]] + [['t', dq.score_column_valid_values, dict(p), 1, 0]] * 2
+    for workers in (None, 4):
+        caplog.clear()
+        daqual.Daqual(memory_provider(frames)).validate_objects(validation_list, workers=workers)
+        assert [r.getMessage() for r in caplog.records].count(
+            'Unexpected values in t column account; 1 values are not in master data m column Account Number: A-9: 1') \
+            == 2
+        assert not [r for r in caplog.records if r.getMessage().startswith('Planned') and r.levelno >= logging.INFO]
+
+
+def test_plan_shares_column_scans_and_identical_checks():
+    from daqual.planner import ValidationPlan
+    d = instance_with(t=pd.DataFrame({'account': ['A-1', 'A-2', None, 'B-1'], 'amount': [1, 2, 3, 4]}))
+    validation_list = [
+        ['t', dq.score_no_blanks, {'column': 'account'}, 1, 1],
+        ['t', dq.score_column_format, {'column': 'account', 'match': 'A-'}, 1, 1],
+        ['t', dq.score_column_format, {'column': 'account', 'match': '^$|[AB]-'}, 1, 1],
+        ['t', dq.score_unique_column, {'column': 'account'}, 1, 1],
+        ['t', dq.score_int, {'column': 'amount'}, 1, 1],
+        ['t', dq.score_column_format, {'match': 'A-', 'column': 'account'}, 1, 1],
+    ]
+    plan = ValidationPlan(d, validation_list, dq.fused_checks)
+    scores = [plan.score(i) for i in range(len(validation_list))]
+    assert scores == [item[1](d, item[0], item[2]) for item in validation_list]
+    assert plan.duplicate_of == {5: 1}
+    assert sorted(plan.facts) == [('t', 'account'), ('t', 'amount')]
+
+
+@pytest.mark.parametrize('values', [['A-1', 'A-22', None, 'B-1', 'A-1', 'A-333'] * 20,
+                                    ['A-{}'.format(i) for i in range(50)] + [None],
+                                    ['A-{}\n'.format(i) for i in range(50)] + ['A-1', 'A-22\n\n'],
+                                    [str(i) for i in range(50)] + ['d]', 't]x', None],
+                                    [None, None]])
+@pytest.mark.parametrize('dtype', [object, 'str'])
+@pytest.mark.parametrize('match', [r'A-\d{2}', '^$|A-[0-9]', 'A-(1|22)$', 'A-[0-9]+', '(?>A)-', 'A-[0-9]++',
+                                   'A-(?#c)1', '[[:digit:]]'])
+def test_count_format_matches_is_per_row_re_match(values, dtype, match):
+    from daqual.formats import count_format_matches
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', FutureWarning)      # re's warning about [[, which it reads as a literal [
+        pattern = re.compile(match)
+    expected = sum(1 for v in values if pattern.match('' if v is None else v))
+    assert count_format_matches(pd.Series(values, dtype=dtype), pattern) == expected
+
+
+def test_concurrent_scoring_matches_sequential(caplog):
+    frames = {'t': pd.DataFrame({'account': ['A-1', 'A-9', 'A-8', None] * 50, 'n': range(200)}),
+              'm': pd.DataFrame({'Account Number': ['A-1', 'A-2']})}
+    validation_list = [
+        ['m', dq.score_1, {}, 1, 1],
+        ['t', dq.score_column_valid_values, {'column': 'account', 'master': 'm', 'master_column': 'Account Number'},
+         1, 1],
+        ['t', dq.score_every_master_value_used,
+         {'column': 'account', 'master': 'm', 'master_column': 'Account Number'}, 1, 1],
+        ['t', dq.score_no_blanks, {'column': 'account'}, 1, 1],
+        ['t', dq.score_unique_column, {'column': 'n'}, 1, 1],
+        ['t', dq.score_column_format, {'column': 'account', 'match': 'A-[19]'}, 2, 0],
+    ]
+    results = []
+    for workers in (None, 4):
+        caplog.clear()
+        quality, object_list = daqual.Daqual(memory_provider(frames)).validate_objects(validation_list,
+                                                                                       workers=workers)
+        results.append(([r.getMessage() for r in caplog.records], {k: v['quality'] for k, v in object_list.items()}))
+    assert results[0] == results[1]
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    moto = pytest.importorskip('moto')
+    import boto3
+    for variable, value in [('AWS_DEFAULT_REGION', 'us-east-1'), ('AWS_ACCESS_KEY_ID', 'testing'),
+                            ('AWS_SECRET_ACCESS_KEY', 'testing')]:
+        monkeypatch.setenv(variable, value)
+    with moto.mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket='daqual')
+        for key in ('a.csv', 'b.csv', 'c.csv'):
+            client.put_object(Bucket='daqual', Key=key, Body=b'x,y\n1,2\n')
+        client.put_object_tagging(Bucket='daqual', Key='a.csv', Tagging={'TagSet': [{'Key': 'owner', 'Value': 'me'}]})
+        yield client
+
+
+def test_s3_tagger_merges_and_skips_unchanged(s3):
+    tagger = daqual.S3Tagger(client=s3)
+    tagger.tag_many({'daqual/a.csv': {'quality_score': 1}, 'daqual/b.csv': {'quality_score': 0.5}})
+    assert tagger.writes == 2
+    assert {t['Key']: t['Value'] for t in s3.get_object_tagging(Bucket='daqual', Key='a.csv')['TagSet']} == \
+        {'owner': 'me', 'quality_score': '1'}
+    tagger.tag('daqual/a.csv', 'quality_score', 1)
+    daqual.S3Tagger(client=s3).tag('daqual/b.csv', 'quality_score', 0.5)
+    assert tagger.writes == 2 and tagger.skipped == 1
+
+
+def test_s3_tagger_tags_a_re_uploaded_object_again(s3):
+    uploads = itertools.count()
+
+    def reupload():
+        s3.put_object(Bucket='daqual', Key='b.csv', Body='x,y\n1,2\n3,{}\n'.format(next(uploads)).encode())
+        return s3.head_object(Bucket='daqual', Key='b.csv')['ETag']
+
+    def tags():
+        return {t['Key']: t['Value'] for t in s3.get_object_tagging(Bucket='daqual', Key='b.csv')['TagSet']}
+
+    tagger = daqual.S3Tagger(client=s3)
+    etag = s3.head_object(Bucket='daqual', Key='b.csv')['ETag']
+    tagger.tag('daqual/b.csv', 'quality_score', 1, fingerprint=etag)
+    tagger.tag('daqual/b.csv', 'quality_score', 1, fingerprint=etag)
+    assert tagger.writes == 1 and tagger.skipped == 1
+    tagger.tag('daqual/b.csv', 'quality_score', 1, fingerprint=reupload())
+    assert tagger.writes == 2 and tags() == {'quality_score': '1'}
+    reupload()
+    tagger.tag('daqual/b.csv', 'quality_score', 1)
+    assert tagger.writes == 3 and tags() == {'quality_score': '1'}
+
+    session = daqual.S3Session()
+    provider = dict(daqual.Daqual.aws_provider, s3=session, tagger=daqual.S3Tagger(session=session))
+    validation_list = [['daqual/b.csv', dq.score_row_count, {'expected_rows': 2}, 1, 1]]
+    for n in (1, 2):
+        reupload()
+        assert daqual.Daqual(provider).validate_objects(validation_list)[0] == 1
+        assert provider['tagger'].writes == n and tags() == {'quality_score': '1.0'}
+
+
+def test_s3_tagger_deferred(s3):
+    tagger = daqual.S3Tagger(client=s3, deferred=True)
+    tagger.tag('daqual/c.csv', 'quality_score', 0.25)
+    assert s3.get_object_tagging(Bucket='daqual', Key='c.csv')['TagSet'] == []
+    tagger.flush()
+    assert s3.get_object_tagging(Bucket='daqual', Key='c.csv')['TagSet'] == [{'Key': 'quality_score',
+                                                                             'Value': '0.25'}]
+
+
+def test_aws_provider_shares_one_client(s3):
+    session = daqual.S3Session(max_pool_connections=4)
+    provider = dict(daqual.Daqual.aws_provider, s3=session, tagger=daqual.S3Tagger(session=session))
+    d = daqual.Daqual(provider)
+    assert d.provider['list'](d, 'daqual/') == ['daqual/a.csv', 'daqual/b.csv', 'daqual/c.csv']
+    quality, results = d.validate_objects([['daqual/a.csv', dq.score_row_count, {'expected_rows': 1}, 1, 1]])
+    assert quality == 1 and results['daqual/a.csv']['fingerprint'] is not None
+    assert provider['tagger'].writes == 1
+    assert d.s3().client is session.client
+
+
+def test_s3_headers_are_read_from_a_range(s3):
+    requests = []
+    session = daqual.S3Session()
+    session.client.meta.events.register('provide-client-params.s3.GetObject',
+                                        lambda params, **kwargs: requests.append(params))
+    s3.put_object(Bucket='daqual', Key='wide.csv', Body=b','.join(b'column_%d' % i for i in range(10)) + b'\n1\n')
+    provider = dict(daqual.Daqual.aws_provider, s3=session, tagger=daqual.S3Tagger(session=session))
+    d = daqual.Daqual(provider)
+    assert d.provider['header'](d, 'daqual/wide.csv', first_bytes=16) == ['column_{}'.format(i) for i in range(10)]
+    assert [r['Range'] for r in requests] == ['bytes=0-15', 'bytes=0-31', 'bytes=0-63', 'bytes=0-127']
+
+    requests.clear()
+    quality, results = d.validate_objects([['daqual/a.csv', dq.score_no_blanks, {'column': 'y'}, 1, 1],
+                                           ['daqual/a.csv', dq.score_column_count, {'expected_columns': 2}, 1, 1]])
+    assert quality == 1 and results['daqual/a.csv']['loaded_columns'] == ['y']
+    assert [r.get('Range') for r in requests] == ['bytes=0-65535', None]
+
+
+def test_previous_versions_are_answered_from_summaries(tmp_path):
+    provider, retrieved = counting_provider(dict(filesystem_provider(), tag=daqual.Daqual.qnothing))
+    comparison = {'column': 'amount', 'comparison': 'daqual/transactions-20190301.csv', 'comparator': '=',
+                  'groupby': {'columns': ['account', 'credit/debit'], 'aggregation': 'sum'}}
+    day_2 = [
+        ['daqual/transactions-20190301.csv', dq.score_1, {}, 1, 1],
+        ['daqual/transactions-20190304.csv', dq.score_row_count,
+         {'comparison': 'daqual/transactions-20190301.csv', 'expected_delta': '>='}, 1, 1],
+        ['daqual/transactions-20190304.csv', dq.score_comparison, comparison, 1, 1],
+    ]
+    expected = daqual.Daqual(provider).validate_objects(day_2)[0]
+
+    store = daqual.SummaryStore(str(tmp_path))
+    day_1 = [[day_2[1][0].replace('0304', '0301')] + day_2[1][1:], [day_2[2][0].replace('0304', '0301')] + day_2[2][1:]]
+    daqual.Daqual(provider, summary_store=store).validate_objects(day_1)
+    retrieved.clear()
+    assert daqual.Daqual(provider, summary_store=store).validate_objects(day_2)[0] == expected == 1
+    assert retrieved == ['daqual/transactions-20190304.csv']
+    with open(store.filename('daqual/transactions-20190301.csv')) as f:
+        assert len(json.load(f)['bases']) == 1
+
+    row_by_row = {k: v for k, v in comparison.items() if k != 'groupby'}
+    ungrouped = [item if item[1] is not dq.score_comparison else item[:2] + [row_by_row] + item[3:] for item in day_1]
+    daqual.Daqual(provider, summary_store=store).validate_objects(ungrouped)
+    bases = store.get('daqual/transactions-20190301.csv')['bases']
+    assert list(bases) == [daqual.summaries.comparison_spec(comparison)]
+    retrieved.clear()
+    daqual.Daqual(provider, summary_store=store).validate_objects(day_2[:2] + [day_2[2][:2] + [row_by_row, 1, 1]])
+    assert sorted(retrieved) == ['daqual/transactions-20190301.csv', 'daqual/transactions-20190304.csv']
+
+
+def test_hyperloglog_estimates_distinct_values():
+    sketch = HyperLogLog().add(pd.Series(np.arange(100000) % 20000))
+    assert abs(sketch.estimate() - 20000) < 20000 * 0.05
+    assert HyperLogLog.from_string(sketch.to_string()).estimate() == sketch.estimate()
+    assert HyperLogLog().add(pd.Series(['a', 'b', None, 'a'])).estimate() == 2
+
+
+def test_repeat_checks_are_answered_from_profiles(tmp_path):
+    provider, retrieved = counting_provider(dict(filesystem_provider(), tag=daqual.Daqual.qnothing))
+    key = 'daqual/balances-20190301.csv'
+    checks = [
+        [key, dq.score_row_count, {'expected_rows': 10}, 1, 0],
+        [key, dq.score_no_blanks, {'column': 'account'}, 1, 0],
+        [key, dq.score_unique_column, {'column': 'account'}, 1, 0],
+        [key, dq.score_float, {'column': 'balance'}, 1, 0],
+        [key, dq.score_column_names, {'columns': ['account', 'balance']}, 1, 0],
+    ]
+    expected = daqual.Daqual(provider).validate_objects(checks)
+
+    store = daqual.ProfileStore(str(tmp_path))
+    daqual.Daqual(provider, profile_store=store).validate_objects(checks)
+    retrieved.clear()
+    quality, results = daqual.Daqual(provider, profile_store=store).validate_objects(checks)
+    assert retrieved == []
+    assert quality == expected[0]
+    assert results[key]['quality'] == expected[1][key]['quality']
+
+    profile = store.get(key)['columns']['account']
+    assert profile['nulls'] == 0 and profile['distinct'] == 8 and profile['formats'] == {'A-999': 8}
+
+
+def test_profiles_of_unorderable_columns_have_no_range(tmp_path):
+    from daqual.profiles import profile_dataframe
+    df = pd.DataFrame({'mixed': pd.Series(['a', 1, None], dtype=object), 'n': [3, 1, 2]})
+    store = daqual.ProfileStore(str(tmp_path))
+    store.put('t', profile_dataframe(df, df.columns, 'f1', ['mixed']))
+    store.put('t', profile_dataframe(df, df.columns, 'f1', ['n']))
+    columns = store.get('t')['columns']
+    assert (columns['mixed']['min'], columns['mixed']['max']) == (None, None) and columns['mixed']['nulls'] == 1
+    assert (columns['n']['min'], columns['n']['max']) == (1, 3)
+
+
+def test_bloom_filter_and_count_min_sketch():
+    members = pd.Series(['M-{}'.format(i) for i in range(5000)])
+    bloom = BloomFilter(len(members), 0.01).add(members)
+    assert bloom.contains(members).all()
+    others = pd.Series(['X-{}'.format(i) for i in range(5000)])
+    assert bloom.contains(others).mean() < 0.03
+
+    counts = CountMinSketch(epsilon=0.001).add(pd.Series(['a'] * 50 + ['b'] * 5 + list(map(str, range(1000)))))
+    estimates = counts.estimate(pd.Series(['a', 'b', 'zzz']))
+    assert estimates[0] >= 50 and estimates[1] >= 5
+    assert estimates[0] <= 50 + 0.001 * counts.total
+
+
+@pytest.mark.parametrize('chunksize', [None, 7])
+def test_approximate_checks_agree_with_exact_checks(tmp_path, chunksize):
+    ids = pd.DataFrame({'id': ['T-{}'.format(i) for i in range(40)] + ['T-1', 'T-1', 'T-2'],
+                        'account': ['A-1', 'A-2', 'A-9'] * 14 + ['A-1']})
+    master = pd.DataFrame({'Account Number': ['A-1', 'A-2', 'A-3']})
+    ids.to_csv(tmp_path / 'ids.csv', index=False)
+    master.to_csv(tmp_path / 'master.csv', index=False)
+    d = daqual.Daqual(dict(daqual.Daqual.file_system_provider, file_system_provider_root=str(tmp_path) + '/'))
+
+    def results(error_bound):
+        p = {} if error_bound is None else {'error_bound': error_bound}
+        checks = [['ids.csv', dq.score_unique_column, dict(p, column='id'), 1, 0],
+                  ['ids.csv', dq.score_column_valid_values,
+                   dict(p, column='account', master='master.csv', master_column='Account Number'), 1, 0],
+                  ['master.csv', dq.score_every_master_value_used,
+                   dict(p, column='Account Number', master='ids.csv', master_column='account'), 1, 0]]
+        return d.validate_objects(checks, chunksize=chunksize)[1]
+
+    exact, approximate = results(None), results(0.01)
+    assert exact['ids.csv']['quality'] == approximate['ids.csv']['quality']
+    assert exact['master.csv']['quality'] == approximate['master.csv']['quality']
+    assert approximate['ids.csv']['exceptions']['score_column_valid_values']['account'] == {'A-9': 14}
+    assert results(0.1)['ids.csv']['quality'] == (0 + 29/43) / 2
+
+
+@pytest.mark.parametrize('chunksize', [None, 2])
+def test_approximate_membership_is_independent_of_dtype(tmp_path, chunksize):
+    pd.DataFrame({'code': [1, 2, None, 3]}).to_csv(tmp_path / 't.csv', index=False)       # float64, for the blank
+    pd.DataFrame({'code': [1, 2, 3]}).to_csv(tmp_path / 'm.csv', index=False)
+    provider = dict(daqual.Daqual.file_system_provider, file_system_provider_root=str(tmp_path) + '/',
+                    tag=daqual.Daqual.qnothing)
+
+    def scores(p):
+        checks = [['m.csv', dq.score_1, {}, 1, 1],
+                  ['t.csv', dq.score_column_valid_values, dict(p, column='code', master='m.csv', master_column='code'),
+                   1, 0],
+                  ['t.csv', dq.score_every_master_value_used,
+                   dict(p, column='code', master='m.csv', master_column='code'), 1, 0]]
+        return daqual.Daqual(provider).validate_objects(checks, chunksize=chunksize)[1]['t.csv']['quality']
+
+    assert scores({'error_bound': 0.01}) == scores({}) == (0.75 + 1) / 2
+
+
+def test_approximate_uniqueness_does_not_allow_repeats_within_the_error_bound():
+    ids = pd.Series(['T-{}'.format(i) for i in range(100000)])
+    assert ApproximateUniqueness(0.01).add(ids).unique()
+    repeated = ApproximateUniqueness(0.01).add(pd.concat([ids, ids[:800]]))
+    assert repeated.most_repeated() == {} and not repeated.unique()
+
+
+def test_score_comparison_aligns_rows():
+    old = pd.DataFrame({'account': ['A-1', 'A-2', 'A-3'], 'balance': [100.0, 200.0, 300.0]})
+    new = pd.DataFrame({'account': ['A-3', 'A-1', 'A-2', 'A-4'], 'balance': [305.0, 100.0, 250.0, 1.0]})
+    d = instance_with(old=old, new=new)
+    p = {'column': 'balance', 'comparison': 'old', 'comparator': 'between', 'delta': 10}
+    assert dq.score_comparison(d, 'new', p) == 0    # row by row: 305 v 100, 100 v 200, 250 v 300
+    assert dq.score_comparison(d, 'new', dict(p, keys=['account'])) == 2/3
+    assert dq.score_comparison(d, 'new', dict(p, keys=['account'], delta=0)) == 1/3
+    assert dq.score_comparison(d, 'old', dict(p, comparison='new', keys=['account'])) == 2/4
+    assert dq.score_comparison(instance_with(old=old, new=new.iloc[:2]), 'new', dict(p, comparator='>')) == 1/3
+
+
+@pytest.mark.parametrize('aggregation,expected',
+                         [('sum', 1), ('mean', 0.5), ('min', 0.5), ('max', 0.5), ('count', 0.5)])
+def test_score_comparison_aggregations(aggregation, expected):
+    old = pd.DataFrame({'ccy': ['GBP', 'GBP', 'USD'], 'amount': [1.0, 3.0, 5.0]})
+    new = pd.DataFrame({'ccy': ['USD', 'GBP', 'USD', 'GBP'], 'amount': [2.5, 3.0, 2.5, 1.0]})
+    d = instance_with(old=old, new=new)
+    p = {'column': 'amount', 'comparison': 'old', 'comparator': '=',
+         'groupby': {'columns': ['ccy'], 'aggregation': aggregation}}
+    assert dq.score_comparison(d, 'new', p) == expected
+    with pytest.raises(ValueError):
+        dq.score_comparison(d, 'new', dict(p, groupby={'columns': ['ccy'], 'aggregation': 'median'}))
+
+
+def test_benchmarks_cover_every_scoring_function():
+    from benchmarks import run
+    assert run.uncovered_scoring_functions() == []
+    results = run.run([1000], repeat=1)['results']
+    assert {r['benchmark'] for r in results} == {c[0] for c in run.checks} | set(run.end_to_end)
+    assert all(r['best'] >= 0 and r['peak_bytes'] >= 0 for r in results)
+
+
+def test_instrumentation_reports_phases_objects_and_checks():
+    key = 'daqual/balances-20190301.csv'
+    checks = [[key, dq.score_row_count, {'expected_rows': 8}, 1, 1],
+              [key, dq.score_no_blanks, {'column': 'account'}, 1, 1],
+              [key, dq.score_float, {'column': 'balance'}, 1, 1]]
+    assert len(daqual.Daqual(filesystem_provider()).validate_objects(checks)) == 2
+
+    spans = []
+    d = daqual.Daqual(dict(filesystem_provider(), tag=daqual.Daqual.qnothing),
+                      instrumentation=daqual.Instrumentation(hooks=[spans.append]))
+    quality, results, metrics = d.validate_objects(checks)
+    assert quality == 1
+    assert {'plan', 'retrieve', 'score', 'tag'} <= set(metrics['phases'])
+    assert metrics['objects'][key]['source'] == 'provider' and metrics['objects'][key]['rows'] == 8
+    assert metrics['cache'] == {'hits': 0, 'misses': 1} and metrics['bytes'] > 0
+    assert [c['function'] for c in metrics['checks']] == ['score_row_count', 'score_no_blanks', 'score_float']
+    assert [c['source'] for c in metrics['checks']] == ['function', 'scan', 'scan']
+    assert spans[-1].kind == 'validate_objects' and spans[-1].parent is None
+    phases = {s.id for s in spans if s.kind == 'phase'}
+    assert all(s.parent in phases for s in spans if s.kind in ('object', 'check'))
+
+    assert d.validate_objects(checks)[2]['cache'] == {'hits': 1, 'misses': 0}
+
+
+def test_opentelemetry_hook_exports_nested_spans():
+    sdk_trace = pytest.importorskip('opentelemetry.sdk.trace')
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    exporter = InMemorySpanExporter()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    hook = daqual.OpenTelemetryHook(provider.get_tracer('daqual'))
+    d = daqual.Daqual(dict(filesystem_provider(), tag=daqual.Daqual.qnothing),
+                      instrumentation=daqual.Instrumentation(hooks=[hook]))
+    d.validate_objects([['daqual/balances-20190301.csv', dq.score_no_blanks, {'column': 'account'}, 1, 1]])
+
+    spans = {s.name: s for s in exporter.get_finished_spans()}
+    assert spans['validate_objects'].parent is None
+    assert spans['score_no_blanks'].parent.span_id == spans['score'].context.span_id
+    assert spans['score'].parent.span_id == spans['validate_objects'].context.span_id
+    assert spans['score_no_blanks'].attributes['object'] == 'daqual/balances-20190301.csv'
+
+
+# calc_date as it was before calendars were compiled, stepping a day at a time
+def stepped_calc_date(current_date, custom_calendar, isoabbreviated, customdelta):
+    from datetime import date, timedelta
+    holidays = [date.fromisoformat(h) for h in custom_calendar['holidays'] if len(h) == 10]
+    recurring = [h for h in custom_calendar['holidays'] if len(h) == 5]
+    step = timedelta(days=7 if custom_calendar['schedule'] == 'weekly' else 1)
+    final = date.fromisoformat(current_date) + step * customdelta
+    while (final in holidays or '{}-{}'.format(final.month, final.day) in recurring or
+           (custom_calendar['schedule'] == 'workingdays' and final.weekday() > 4)):
+        final += timedelta(days=customdelta)
+    return final.isoformat().replace('-', '') if isoabbreviated else final.isoformat()
+
+
+@pytest.mark.parametrize('schedule', ['workingdays', 'daily', 'weekly'])
+def test_compiled_calendar_matches_stepping(schedule):
+    calendar = {'schedule': schedule, 'holidays': dq.Daqual.gb_holidays + ['12-24', '10-31', '2019-06-01']}
+    for day in pd.date_range('2018-12-01', '2020-01-31').strftime('%Y-%m-%d'):
+        for customdelta in (1, -1, 2, -3):
+            assert dq.Daqual.calc_date(day, calendar, False, customdelta) == \
+                stepped_calc_date(day, calendar, False, customdelta)
+    assert dq.Daqual.get_next_date('1960-12-23', calendar, True) == stepped_calc_date('1960-12-23', calendar, True, 1)
+    assert dq.Daqual.get_prev_date('2019-12-27', dq.Daqual.default_calendar) == '2019-12-24'
+
+
+def test_business_calendar_offsets_and_ranges():
+    calendar = dq.Daqual.business_calendar()
+    assert calendar.next_business_date('2019-04-18').isoformat() == '2019-04-23'
+    assert calendar.prev_business_date('2019-04-23').isoformat() == '2019-04-18'
+    assert calendar.offset('2019-04-18', 2).isoformat() == '2019-04-24'
+    assert calendar.offset('2019-04-20', -1).isoformat() == '2019-04-18'
+    assert calendar.date_range('2019-04-18', '2019-04-24') == ['2019-04-18', '2019-04-23', '2019-04-24']
+    assert calendar.date_range('2019-12-23', '2019-12-31', isoabbreviated=True) == \
+        ['20191223', '20191224', '20191227', '20191230', '20191231']
+    assert calendar is dq.Daqual.business_calendar(dict(dq.Daqual.default_calendar))
+    weekly = daqual.BusinessCalendar({'schedule': 'weekly', 'holidays': ['2019-01-08']})
+    assert weekly.date_range('2019-01-01', '2019-01-22') == ['2019-01-01', '2019-01-09', '2019-01-16']
+
+
+def test_backfill_retrieves_each_object_once_and_resumes(tmp_path):
+    dates = ['20190412', '20190415', '20190416', '20190417', '20190418', '20190423', '20190424']
+    for n, business_date in enumerate(dates):
+        pd.DataFrame({'account': ['A-{}'.format(i) for i in range(10 + n)], 'balance': range(10 + n)}).to_csv(
+            tmp_path / 'balances-{}.csv'.format(business_date), index=False)
+    provider, retrieved = counting_provider(dict(daqual.Daqual.file_system_provider,
+                                                 file_system_provider_root=str(tmp_path) + '/'))
+    template = [['balances-{previous_business_date}.csv', dq.score_1, {}, 1, 1],
+                ['balances-{business_date}.csv', dq.score_row_count,
+                 {'comparison': 'balances-{previous_business_date}.csv', 'expected_delta': '>='}, 1, 1],
+                ['balances-{business_date}.csv', dq.score_unique_column, {'column': 'account'}, 1, 1]]
+    progress = str(tmp_path / 'progress.jsonl')
+
+    backfill = daqual.Backfill(provider, template, workers=3, progress=progress)
+    assert backfill.validation_list('2019-04-23')[1][2]['comparison'] == 'balances-20190418.csv'
+    assert template[1][2]['comparison'] == 'balances-{previous_business_date}.csv'
+    results = backfill.run('2019-04-13', '2019-04-24')
+    assert list(results) == ['2019-04-15', '2019-04-16', '2019-04-17', '2019-04-18', '2019-04-23', '2019-04-24']
+    assert all(r['quality'] == 1 for r in results.values())
+    assert results['2019-04-23']['objects'] == {'balances-20190418.csv': 1, 'balances-20190423.csv': 1}
+    assert sorted(retrieved) == sorted('balances-{}.csv'.format(d) for d in dates)
+
+    retrieved.clear()
+    os.remove(tmp_path / 'balances-20190424.csv')
+    with open(progress) as f:
+        lines = [line for line in f if '2019-04-24' not in line]
+    with open(progress, 'w') as f:
+        f.writelines(lines)
+    resumed = daqual.Backfill(provider, template, workers=3, progress=progress).run('2019-04-13', '2019-04-24')
+    assert resumed['2019-04-24'] == {'quality': 0, 'objects': None}
+    assert {d: r for d, r in resumed.items() if d != '2019-04-24'} == {d: r for d, r in results.items()
+                                                                      if d != '2019-04-24'}
+    assert 'balances-20190415.csv' not in retrieved
+
+
+def test_daqual2_row_failure_index(tmp_path):
+    pd.DataFrame({'account': ['A-1', 'A-2', 'A-300', 'A-4'], 'balance': [1.5, -2.0, -3.5, 4.0]}).to_csv(
+        tmp_path / 'balances.csv', index=False)
+    d = daqual.daqual2(str(tmp_path / 'balances.csv'))
+    assert d.calculate_row_score() == d.calculate_column_score() == 1
+    assert d.generic_score(lambda x: x >= 0, 'balance') == 0.5
+    assert d.get_invalid_rows(lambda x: x >= 0, 'balance') == [1, 2]
+    assert d.generic_score(lambda s: s.str.len() < 5, 'account', vectorized=True) == 0.75
+    assert list(d.invalid_rows) == ['balance', 'account']
+    assert list(d.invalid_rows.rows(d.invalid_rows.union())) == [1, 2]
+    assert list(d.invalid_rows.rows(d.invalid_rows.intersection())) == [2]
+    assert d.calculate_column_score() == 0
+    assert d.calculate_row_score() == 0.5
+
+
+def test_numeric_validation_is_vectorized_and_logs_failing_rows(tmp_path, caplog):
+    from daqual.planner import ValidationPlan
+    from daqual.numeric import invalid_numbers
+    values = pd.Series(['1', '-2', '+007', '1.5', 'abc', None, '1e3', 'inf'], dtype='str')
+    assert {kind: list(np.flatnonzero(mask)) for kind, mask in invalid_numbers(values).items()} == \
+        {'int': [3, 4, 7], 'decimal': [4, 7], 'float': [4], 'number': [4]}
+
+    d = instance_with(t=pd.DataFrame({'text': values, 'whole': [1.0, 2.0, None, 4.0, 5.0, 6.0, 7.0, 8.0],
+                                      'ints': range(8)}))
+    assert dq.score_int(d, 't', {'column': 'text'}) == 4 / 7     # the blank is left out
+    assert 'in rows: 3, 4, 7' in caplog.text
+    assert d.object_list['t']['exceptions']['score_int']['text'] == {'1.5': 1, 'abc': 1, 'inf': 1}
+    assert dq.score_float(d, 't', {'column': 'text'}) == dq.score_number(d, 't', {'column': 'text'}) == 6 / 7
+    assert dq.score_int(instance_with(t=pd.DataFrame({'blank': [None, None]})), 't', {'column': 'blank'}) == 1
+    validation_list = [['t', scoring_function, {'column': column}, 1, 1]
+                       for scoring_function in (dq.score_int, dq.score_float, dq.score_number)
+                       for column in ('text', 'whole', 'ints')]
+    plan = ValidationPlan(d, validation_list, dq.fused_checks)
+    assert [plan.score(i) for i in range(len(validation_list))] == [4 / 7, 1, 1, 6 / 7, 1, 1, 6 / 7, 1, 1]
+
+    pd.DataFrame({'code': ['1', '2', 'x3', '4', None]}).to_csv(tmp_path / 'codes.csv', index=False)
+    d2 = daqual.daqual2(str(tmp_path / 'codes.csv'))
+    assert d2.score_field_int('code') == 0.6     # in daqual2, a blank is not an integer
+    assert list(d2.invalid_rows.rows(d2.invalid_rows.failing('code'))) == [2, 4]
+
+
+def test_daqual2_hashes_the_file_as_it_is_read(tmp_path):
+    import hashlib
+    filename = str(tmp_path / 'big.csv')
+    pd.DataFrame({'a': range(200000), 'b': ['x'] * 200000}).to_csv(filename, index=False)
+    with open(filename, 'rb') as f:
+        content = f.read()
+    d = daqual.daqual2(filename)
+    assert d.hash == hashlib.sha1(content).hexdigest() and len(d.df) == 200000
+    assert daqual.daqual2(filename, hashlib.blake2b).hash == hashlib.blake2b(content).hexdigest()
+    assert daqual.daqual2(filename, 'md5').hash == hashlib.md5(content).hexdigest()
+
+
+def test_specs_compile_once_and_render_fresh_validation_lists(tmp_path):
+    spec = {'checks': [
+        {'object': 'daqual/balances-{business_date}.csv', 'check': 'score_row_count',
+         'params': {'comparison': 'daqual/balances-{previous_business_date}.csv', 'expected_delta': '>='}},
+        {'object': 'daqual/balances-{business_date}.csv', 'check': 'score_column_format',
+         'params': {'column': 'account', 'match': r'A-\d{3}'}, 'weight': 2, 'threshold': 0.5},
+        {'object': 'daqual/balances-{previous_business_date}.csv', 'check': 'score_1'},
+    ]}
+    filename = str(tmp_path / 'spec.yaml')
+    with open(filename, 'w') as f:
+        import yaml
+        yaml.safe_dump(spec, f)
+    compiled = daqual.compile_spec(daqual.load_spec(filename))
+    assert compiled is daqual.compile_spec(spec)
+    assert compiled.fields == {'business_date', 'previous_business_date'}
+    with pytest.raises(AttributeError):
+        compiled.checks = ()
+
+    values = {'business_date': '20190304', 'previous_business_date': '20190301'}
+    validation_list = compiled.validation_list(values)
+    assert validation_list[0] == ['daqual/balances-20190304.csv', dq.score_row_count,
+                                  {'comparison': 'daqual/balances-20190301.csv', 'expected_delta': '>='}, 1, 1]
+    assert validation_list[1][2]['match'] == r'A-\d{3}' and validation_list[1][3:] == [2, 0.5]
+    validation_list[0][2]['comparison'] = 'changed'
+    assert compiled.validation_list(values)[0][2]['comparison'] == 'daqual/balances-20190301.csv'
+    with pytest.raises(ValueError):
+        compiled.validation_list({'business_date': '20190304'})
+    assert daqual.Backfill(filesystem_provider(), compiled).validation_list('2019-03-04') == \
+        compiled.validation_list(values)
+
+    for broken in ([{'object': 'a', 'check': 'score_nothing'}],
+                   [{'object': 'a', 'check': 'score_no_blanks', 'params': {}}],
+                   [{'object': 'a', 'check': 'score_row_count', 'params': {'comparison': 'b'}}],
+                   [{'object': 'a', 'check': 'score_1', 'weight': 'heavy'}]):
+        with pytest.raises(ValueError):
+            daqual.compile_spec(broken)
+
+
+def test_specs_freeze_nested_params():
+    groupby = {'columns': ['account'], 'aggregation': 'sum'}
+    compiled = daqual.compile_spec([
+        {'object': 'new', 'check': 'score_comparison',
+         'params': {'comparison': 'old', 'column': 'amount', 'expected_delta': '=', 'groupby': groupby}},
+        {'object': 'old', 'check': 'score_1'}])
+    groupby['columns'].append('ccy')
+    frozen_groupby = compiled.checks[0][2]['groupby']
+    with pytest.raises(TypeError):
+        frozen_groupby['aggregation'] = 'mean'
+    with pytest.raises(AttributeError):
+        frozen_groupby['columns'].append('ccy')
+
+    validation_list = compiled.validation_list()
+    assert validation_list[0][2]['groupby'] == {'columns': ['account'], 'aggregation': 'sum'}
+    validation_list[0][2]['groupby']['columns'].append('ccy')
+    assert compiled.validation_list()[0][2]['groupby'] == {'columns': ['account'], 'aggregation': 'sum'}
+
+
+def test_specs_with_same_named_closures_compile_separately():
+    def scorer(score):
+        def score_fixed(self, object_name, p):
+            return score
+        return score_fixed
+
+    spec = [{'object': 'a', 'check': 'score_fixed'}]
+    low, high = scorer(0.25), scorer(0.75)
+    compiled_low = daqual.compile_spec(spec, {'score_fixed': low})
+    compiled_high = daqual.compile_spec(spec, {'score_fixed': high})
+    assert compiled_low is not compiled_high
+    assert compiled_low.validation_list()[0][1] is low and compiled_high.validation_list()[0][1] is high
+    assert daqual.compile_spec(spec, {'score_fixed': low}) is compiled_low
+
+
+@pytest.mark.parametrize('store', ['sqlite', 'parquet'])
+def test_results_are_recorded_and_queried_by_object_check_and_date(tmp_path, store):
+    from daqual.results import SQLiteResultStore, ParquetResultStore
+    if store == 'parquet':
+        pytest.importorskip('pyarrow')
+    sink = SQLiteResultStore(str(tmp_path / 'results.db')) if store == 'sqlite' else \
+        ParquetResultStore(str(tmp_path / 'results'))
+    key = 'daqual/balances-20190301.csv'
+    checks = [[key, dq.score_row_count, {'expected_rows': 8}, 1, 1],
+              [key, dq.score_no_blanks, {'column': 'account'}, 1, 1],
+              [key, dq.score_column_format, {'column': 'account', 'match': 'A-12'}, 1, 0]]
+    d = daqual.Daqual(dict(filesystem_provider(), tag=daqual.Daqual.qnothing), result_sink=sink)
+    for business_date in ('2019-02-27', '2019-02-28', '2019-03-01'):
+        quality, results = d.validate_objects(checks, business_date=business_date)
+        assert 'dataframe' not in results[key] and results[key]['rows'] == 8
+
+    history = sink.history(key, days=2, until='2019-03-01')
+    assert history['business_date'].to_list() == ['2019-02-28', '2019-03-01']
+    assert history['quality'].to_list() == [results[key]['quality']] * 2 and history['rows'].to_list() == [8, 8]
+    formats = sink.history(key, days=90, check='score_column_format', until='2019-03-01')
+    assert len(formats) == 3 and formats['score'].to_list() == [0.875] * 3 and (formats['seconds'] >= 0).all()
+    assert json.loads(formats['params'].iloc[0]) == {'column': 'account', 'match': 'A-12'}
+    assert len(sink.history('daqual/other.csv', days=90, until='2019-03-01')) == 0
+
+    if store == 'sqlite':
+        import sqlite3
+        with sqlite3.connect(sink.filename) as connection:
+            plan = connection.execute('EXPLAIN QUERY PLAN SELECT score FROM checks WHERE object_name = ? AND '
+                                      'check_name = ? AND business_date BETWEEN ? AND ?',
+                                      ['a', 'b', 'c', 'd']).fetchall()
+        assert 'checks_by_object' in str(plan)
+
+
+@pytest.mark.parametrize('store', ['sqlite', 'parquet'])
+def test_backfill_history_is_kept_by_template_and_records_failed_runs(tmp_path, store):
+    from daqual.results import SQLiteResultStore, ParquetResultStore
+    if store == 'parquet':
+        pytest.importorskip('pyarrow')
+    sink = SQLiteResultStore(str(tmp_path / 'results.db')) if store == 'sqlite' else \
+        ParquetResultStore(str(tmp_path / 'results'))
+    for n, business_date in enumerate(['20190415', '20190416', '20190417']):
+        pd.DataFrame({'account': ['A-{}'.format(i) for i in range(10 + n)]}).to_csv(
+            tmp_path / 'balances-{}.csv'.format(business_date), index=False)
+    provider = dict(daqual.Daqual.file_system_provider, file_system_provider_root=str(tmp_path) + '/')
+    template = [['balances-{business_date}.csv', dq.score_row_count,
+                 {'comparison': 'balances-{previous_business_date}.csv', 'expected_delta': '>='}, 1, 1],
+                ['balances-{previous_business_date}.csv', dq.score_1, {}, 1, 1]]
+    results = daqual.Backfill(provider, template, workers=1, result_sink=sink).run('2019-04-15', '2019-04-17')
+    assert results['2019-04-15'] == {'quality': 0, 'objects': None}
+
+    history = sink.history('balances-{business_date}.csv', days=3, until='2019-04-17')
+    assert history['business_date'].to_list() == ['2019-04-15', '2019-04-16', '2019-04-17']
+    assert history['object_key'].to_list() == ['balances-20190415.csv', 'balances-20190416.csv',
+                                               'balances-20190417.csv']
+    assert pd.isna(history['quality'].iloc[0]) and history['quality'].to_list()[1:] == [1, 1]
+    assert history['status'].to_list() == ['not validated', 'validated', 'validated']
+    previous = sink.history('balances-{previous_business_date}.csv', days=3, until='2019-04-17')
+    assert previous['status'].to_list() == ['retrieval failed', 'validated', 'validated']
+    checks = sink.history('balances-{business_date}.csv', days=3, check='score_row_count', until='2019-04-17')
+    assert checks['score'].to_list() == [1, 1]
+    assert len(sink.history('balances-20190416.csv', days=3, until='2019-04-17')) == 0